@@ -0,0 +1,203 @@
+# تحليلات المبيعات من جداول تجميع (rollup) تُحدث تدريجياً بدلاً من المرور على كل الطلبات
+#
+# لكل طلب مساهمة في إيراد يومه ومبيعات منتجاته وطلبات محافظة صاحبه؛ تُضاف عند إتمامه
+# (مهمة في الطابور) وتُطرح إن أُلغي. Order.rolled_up يسجل إن كانت مساهمته محسوبة،
+# ويُقلب بتحديث مشروط قبل الجمع، فلا يُحسب طلب مرتين بين التحديث التدريجي والـ backfill.
+# لوحة الإدارة تقرأ الجداول المجمعة فقط، فزمنها يتبع عدد الأيام والمنتجات لا عدد الطلبات؛
+# مبيعات المنتجات مجمعة يومياً وشهرياً، والفترات الطويلة تقرأ الأشهر الكاملة من الشهري.
+#
+#   ANALYTICS_BACKFILL_CHUNK   عدد الطلبات في كل معاملة عند backfill (الافتراضي 5000)
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select, union_all, update
+
+CANCELLED = 'cancelled'
+
+
+class SalesRollups:
+    def __init__(self, db, order, order_item, user, product, daily, product_daily, product_monthly,
+                 governorate_daily):
+        self.db = db
+        self.order = order
+        self.order_item = order_item
+        self.user = user
+        self.product = product
+        self.daily = daily
+        self.product_daily = product_daily
+        self.product_monthly = product_monthly
+        self.governorate_daily = governorate_daily
+
+    # --- التحديث ---
+
+    def sync(self, order_ids):
+        # بعد إنشاء الطلب أو تغيير حالته؛ بدون commit
+        return self._update(order_ids, include=True) + self._update(order_ids, include=False)
+
+    def _update(self, order_ids, include):
+        orders = self.order.__table__
+        if include:
+            condition = orders.c.rolled_up.is_(False) & (orders.c.status != CANCELLED)
+        else:
+            condition = orders.c.rolled_up.is_(True) & (orders.c.status == CANCELLED)
+        session = self.db.session
+        flipped = session.scalars(update(orders).where(orders.c.id.in_(order_ids), condition)
+                                  .values(rolled_up=include).returning(orders.c.id)).all()
+        if not flipped:
+            return 0
+        sign = 1 if include else -1
+
+        users = self.user.__table__
+        daily, products, months, governorates, order_days = {}, {}, {}, {}, {}
+        for order_id, created_at, total, donation, governorate in session.execute(
+                select(orders.c.id, orders.c.created_at, orders.c.total_amount, orders.c.donation_amount,
+                       users.c.governorate)
+                .join(users, users.c.id == orders.c.user_id, isouter=True)
+                .where(orders.c.id.in_(flipped))):
+            day = created_at.date()
+            order_days[order_id] = day
+            totals = daily.setdefault(day, {'orders': 0, 'revenue': 0.0, 'donations': 0.0, 'units': 0})
+            totals['orders'] += 1
+            totals['revenue'] += total or 0
+            totals['donations'] += donation or 0
+            region = governorates.setdefault((day, governorate or ''), {'orders': 0, 'revenue': 0.0})
+            region['orders'] += 1
+            region['revenue'] += total or 0
+
+        items = self.order_item.__table__
+        for order_id, product_id, units, revenue in session.execute(
+                select(items.c.order_id, items.c.product_id, func.sum(items.c.quantity),
+                       func.sum(items.c.quantity * items.c.price))
+                .where(items.c.order_id.in_(flipped))
+                .group_by(items.c.order_id, items.c.product_id)):
+            day = order_days[order_id]
+            daily[day]['units'] += units
+            sales = products.setdefault((day, product_id), {'units': 0, 'revenue': 0.0})
+            sales['units'] += units
+            sales['revenue'] += revenue or 0
+            month = months.setdefault((day.replace(day=1), product_id), {'units': 0, 'revenue': 0.0})
+            month['units'] += units
+            month['revenue'] += revenue or 0
+
+        self._add(self.daily, ('day',), [
+            {'day': day, **{name: sign * value for name, value in totals.items()}}
+            for day, totals in daily.items()])
+        self._add(self.product_daily, ('day', 'product_id'), [
+            {'day': day, 'product_id': product_id, **{name: sign * value for name, value in sales.items()}}
+            for (day, product_id), sales in products.items()])
+        self._add(self.product_monthly, ('month', 'product_id'), [
+            {'month': month, 'product_id': product_id, **{name: sign * value for name, value in sales.items()}}
+            for (month, product_id), sales in months.items()])
+        self._add(self.governorate_daily, ('day', 'governorate'), [
+            {'day': day, 'governorate': governorate, **{name: sign * value for name, value in region.items()}}
+            for (day, governorate), region in governorates.items()])
+        return len(flipped)
+
+    def _add(self, model, keys, rows):
+        # جمع القيم على الصف الموجود أو إضافته، بتعليمة executemany واحدة
+        if not rows:
+            return
+        table = model.__table__
+        columns = [name for name in rows[0] if name not in keys]
+        session = self.db.session
+        dialect = session.get_bind().dialect.name
+        if dialect in ('sqlite', 'postgresql'):
+            if dialect == 'sqlite':
+                from sqlalchemy.dialects.sqlite import insert
+            else:
+                from sqlalchemy.dialects.postgresql import insert
+            statement = insert(table)
+            statement = statement.on_conflict_do_update(
+                index_elements=list(keys),
+                set_={name: table.c[name] + statement.excluded[name] for name in columns})
+            session.execute(statement, rows)
+            return
+        for row in rows:
+            match = [table.c[key] == row[key] for key in keys]
+            updated = session.execute(update(table).where(*match).values(
+                {name: table.c[name] + row[name] for name in columns})).rowcount
+            if not updated:
+                session.execute(table.insert().values(**row))
+
+    def backfill(self, chunk=None, rebuild=False, progress=None):
+        # الطلبات التي لم تُحسب بعد، على دفعات بترتيب id وكل دفعة في معاملة
+        chunk = chunk or int(os.environ.get('ANALYTICS_BACKFILL_CHUNK', 5000))
+        session = self.db.session
+        orders = self.order.__table__
+        if rebuild:
+            for model in (self.daily, self.product_daily, self.product_monthly, self.governorate_daily):
+                session.execute(model.__table__.delete())
+            session.execute(update(orders).where(orders.c.rolled_up.is_(True)).values(rolled_up=False))
+            session.commit()
+        done, last_id = 0, 0
+        while True:
+            order_ids = session.scalars(
+                select(orders.c.id)
+                .where(orders.c.rolled_up.is_(False), orders.c.status != CANCELLED, orders.c.id > last_id)
+                .order_by(orders.c.id).limit(chunk)).all()
+            if not order_ids:
+                return done
+            done += self._update(order_ids, include=True)
+            session.commit()
+            last_id = order_ids[-1]
+            if progress:
+                progress(done)
+
+    # --- القراءة ---
+
+    def dashboard(self, days=30, top=10):
+        # أيام التجميع بتوقيت UTC مثل created_at
+        start = datetime.utcnow().date() - timedelta(days=days - 1)
+        session = self.db.session
+        daily_model = self.daily
+        series = session.execute(select(daily_model.day, daily_model.orders, daily_model.revenue,
+                                        daily_model.donations, daily_model.units)
+                                 .where(daily_model.day >= start).order_by(daily_model.day)).all()
+        totals = {
+            'orders': sum(row.orders for row in series),
+            'revenue': sum(row.revenue for row in series),
+            'donations': sum(row.donations for row in series),
+            'units': sum(row.units for row in series),
+        }
+        totals['average_order'] = totals['revenue'] / totals['orders'] if totals['orders'] else 0
+
+        # الأيام حتى أول شهر كامل من الجدول اليومي والباقي من الشهري، ثم التجميع قبل
+        # جلب أسماء أول top منتجات فقط
+        first_month = start if start.day == 1 else (start.replace(day=1) + timedelta(days=32)).replace(day=1)
+        daily_sales, monthly_sales = self.product_daily, self.product_monthly
+        sales = union_all(
+            select(daily_sales.product_id, daily_sales.units, daily_sales.revenue)
+            .where(daily_sales.day >= start, daily_sales.day < first_month),
+            select(monthly_sales.product_id, monthly_sales.units, monthly_sales.revenue)
+            .where(monthly_sales.month >= first_month),
+        ).subquery()
+        revenue = func.sum(sales.c.revenue).label('revenue')
+        ranked = (select(sales.c.product_id, func.sum(sales.c.units).label('units'), revenue)
+                  .group_by(sales.c.product_id)
+                  .having(func.sum(sales.c.units) > 0)
+                  .order_by(revenue.desc()).limit(top).subquery())
+        top_products = session.execute(
+            select(ranked.c.product_id, self.product.name, ranked.c.units, ranked.c.revenue)
+            .join(self.product, self.product.id == ranked.c.product_id, isouter=True)
+            .order_by(ranked.c.revenue.desc())).all()
+
+        regions = self.governorate_daily
+        region_revenue = func.sum(regions.revenue).label('revenue')
+        governorates = session.execute(
+            select(regions.governorate, func.sum(regions.orders).label('orders'), region_revenue)
+            .where(regions.day >= start)
+            .group_by(regions.governorate)
+            .having(func.sum(regions.orders) > 0)
+            .order_by(region_revenue.desc())).all()
+
+        orders = self.order.__table__
+        pending = session.scalar(select(func.count()).select_from(orders).where(
+            orders.c.rolled_up.is_(False), orders.c.status != CANCELLED))
+        return {
+            'start': start,
+            'series': series,
+            'totals': totals,
+            'top_products': top_products,
+            'governorates': governorates,
+            'pending': pending,
+        }
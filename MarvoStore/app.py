@@ -1,19 +1,49 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, send_from_directory
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, abort, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_wtf import FlaskForm
-from flask_wtf.csrf import CSRFProtect
+from flask_wtf.csrf import CSRFProtect, generate_csrf
+from markupsafe import Markup
 from wtforms import StringField, TextAreaField, DecimalField, IntegerField, SelectField, FileField, SubmitField, HiddenField, PasswordField, BooleanField, EmailField
-from wtforms.validators import DataRequired, NumberRange, Email, Length, EqualTo
+from wtforms.validators import DataRequired, InputRequired, NumberRange, Email, Length, EqualTo, Optional
 from werkzeug.utils import secure_filename
-from PIL import Image
-from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
+from werkzeug.datastructures import MultiDict
+from search import create_search_index, index_product, index_products, unindex_product, search_products
+from ids import OrderNumberGenerator
+from db_config import database_uri, engine_options, init_db
+from cache import from_env as cache_from_env
+from images import ImagePipeline, process_image, upload_path, variant_paths, picture
+from assets import StaticAssets, compress_static
+from cart_store import from_env as cart_store_from_env
+from tasks import TaskQueue
+from instrumentation import Instrumentation
+from user_cache import UserCache
+from analytics import SalesRollups
+from json_api import accepted_encoding, compress_json, dump_json, json_error, json_response, not_modified
+from catalog_io import ImageFetcher, WRITERS, MIME_TYPES, chunked, detect_format, read_rows, split_options
+from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user, user_logged_in
 from werkzeug.security import generate_password_hash, check_password_hash
 import os
 import json
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta, date
 import secrets
 import string
+import base64
+import time
+import random
+import sqlite3
+import click
+import functools
+import gc
+import hashlib
+from sqlalchemy.exc import OperationalError, IntegrityError, ProgrammingError
+from sqlalchemy.orm import configure_mappers
+from sqlalchemy.schema import CreateIndex
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 app = Flask(__name__)
 
@@ -24,15 +54,24 @@ os.makedirs(app.instance_path, exist_ok=True)
 if os.environ.get('FLASK_ENV') == 'production' and not os.environ.get('SESSION_SECRET'):
     raise RuntimeError("SESSION_SECRET environment variable is required in production")
 app.config['SECRET_KEY'] = os.environ.get('SESSION_SECRET', 'dev-key-change-in-production')
-db_path = os.path.join(app.instance_path, 'marvo_store.db')
-app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+app.config['SQLALCHEMY_DATABASE_URI'] = database_uri(app.instance_path)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['UPLOAD_FOLDER'] = 'static/uploads'
+# مسار مطلق: الحفظ والتقديم لا يعتمدان على مجلد التشغيل الحالي
+app.config['UPLOAD_FOLDER'] = os.path.join(app.root_path, 'static', 'uploads')
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
 # CSRF Protection
 csrf = CSRFProtect(app)
 
+# روابط static ببصمة المحتوى وتخزين دائم في المتصفح
+assets = StaticAssets(app)
+
+@app.cli.command('compress-assets')
+def compress_assets_command():
+    """كتابة نسخ gzip (وbrotli إن كانت مثبتة) لملفات CSS وJS في مجلد static."""
+    print(f'تمت كتابة {compress_static(app.static_folder)} ملف مضغوط')
+
 # Login Manager
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -42,15 +81,11 @@ login_manager.login_message_category = 'info'
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return user_cache.get(int(user_id))
 
 # Allowed file extensions for images
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 
-# إنشاء مجلدات التحميل إذا لم تكن موجودة
-if not os.path.exists(app.config['UPLOAD_FOLDER']):
-    os.makedirs(app.config['UPLOAD_FOLDER'])
-
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
@@ -58,10 +93,15 @@ def save_uploaded_image(file):
     if file and allowed_file(file.filename):
         # Generate unique filename
         file_extension = file.filename.rsplit('.', 1)[1].lower()
+        if file_extension == 'jpeg':
+            file_extension = 'jpg'
         filename = f"{uuid.uuid4().hex}.{file_extension}"
+        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
         
         try:
+            from PIL import Image
+
             # Verify it's actually an image using Pillow
             img = Image.open(file)
             img.verify()
@@ -76,6 +116,18 @@ def save_uploaded_image(file):
     return None
 
 db = SQLAlchemy(app)
+# WAL وsynchronous=NORMAL وbusy_timeout وغيرها على كل اتصال SQLite جديد
+init_db(app, db)
+# زمن كل طلب مقسماً (قاعدة البيانات/القوالب/بايثون) وعدد الاستعلامات وN+1 على /metrics
+# (انظر instrumentation.py)
+instrumentation = Instrumentation(app, db)
+
+# أرقام طلبات فريدة لكل عامل gunicorn بدون استعلام لكل رقم
+order_numbers = OrderNumberGenerator(
+    prefix='MRV',
+    worker_id=os.environ.get('ORDER_WORKER_ID'),
+    lock_dir=os.path.join(app.instance_path, 'order_workers'),
+)
 
 # نموذج المنتج
 class Product(db.Model):
@@ -84,21 +136,107 @@ class Product(db.Model):
     description = db.Column(db.Text, nullable=False)
     price = db.Column(db.Float, nullable=False)
     image_url = db.Column(db.String(200), nullable=True)
+    image_variants = db.Column(db.Text, nullable=True)  # JSON: {thumb|card|detail: {width, files}}
     category = db.Column(db.String(50), nullable=False)
+    # قديم: الخيارات أصبحت في ProductVariant ويُقرأ هذان العمودان عند الترحيل فقط
     size_options = db.Column(db.Text, nullable=True)  # JSON string
     color_options = db.Column(db.Text, nullable=True)  # JSON string
-    stock = db.Column(db.Integer, default=0)
+    stock = db.Column(db.Integer, default=0)  # مجموع مخزون الخيارات
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # ملخص التقييمات يُحدّث مع كل تقييم جديد في نفس المعاملة
+    rating_count = db.Column(db.Integer, default=0, nullable=False)
+    rating_sum = db.Column(db.Integer, default=0, nullable=False)
+    rating_average = db.Column(db.Float, default=0, nullable=False)
+    rating_1 = db.Column(db.Integer, default=0, nullable=False)
+    rating_2 = db.Column(db.Integer, default=0, nullable=False)
+    rating_3 = db.Column(db.Integer, default=0, nullable=False)
+    rating_4 = db.Column(db.Integer, default=0, nullable=False)
+    rating_5 = db.Column(db.Integer, default=0, nullable=False)
+
+    # فهرس مركب لترقيم الصفحات بالمفتاح (created_at, id)
+    __table_args__ = (
+        db.Index('ix_product_created_at_id', 'created_at', 'id'),
+        db.Index('ix_product_rating', 'rating_average', 'rating_count', 'id'),
+        db.Index('ix_product_category_price', 'category', 'price'),
+        db.Index('ix_product_category_created', 'category', 'created_at', 'id'),
+        db.Index('ix_product_category_rating', 'category', 'rating_average', 'rating_count', 'id'),
+        db.Index('ix_product_price', 'price'),
+    )
     
     def get_sizes(self):
-        if self.size_options:
-            return json.loads(self.size_options)
-        return []
+        return list(dict.fromkeys(variant.size for variant in self.variants if variant.size))
     
     def get_colors(self):
-        if self.color_options:
-            return json.loads(self.color_options)
-        return []
+        return list(dict.fromkeys(variant.color for variant in self.variants if variant.color))
+
+    def get_rating_histogram(self):
+        return [(stars, getattr(self, f'rating_{stars}')) for stars in range(5, 0, -1)]
+
+# خيارات المنتج (الحجم واللون) ولكل خيار مخزونه؛ المنتج بلا خيارات له خيار واحد فارغ
+class ProductVariant(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    size = db.Column(db.String(20), nullable=True)
+    color = db.Column(db.String(50), nullable=True)
+    sku = db.Column(db.String(64), unique=True, nullable=True)
+    stock = db.Column(db.Integer, default=0, nullable=False)
+
+    product = db.relationship('Product', backref=db.backref(
+        'variants', lazy=True, order_by='ProductVariant.id', cascade='all, delete-orphan'))
+
+    __table_args__ = (
+        db.Index('uq_product_variant_options', 'product_id', 'size', 'color', unique=True),
+        # الفهرس السابق للبحث فقط حين يكون الحجم أو اللون NULL (كل NULL مختلف في فهرس فريد)،
+        # وهذا يمنع تكرار الخيار في كل الحالات
+        db.Index('uq_product_variant_option_values', 'product_id',
+                 db.func.coalesce(size, ''), db.func.coalesce(color, ''), unique=True),
+        # فلترة الكتالوج بالحجم أو اللون من الفهرس وحده
+        db.Index('ix_product_variant_size', 'size', 'product_id', 'stock'),
+        db.Index('ix_product_variant_color', 'color', 'product_id', 'stock'),
+    )
+
+def variant_options(sizes, colors):
+    return [(size, color) for size in (sizes or [None]) for color in (colors or [None])]
+
+def split_stock(total, count):
+    # توزيع المخزون بالتساوي والباقي على الخيارات الأولى
+    share, remainder = divmod(max(total or 0, 0), count)
+    return [share + (1 if i < remainder else 0) for i in range(count)]
+
+def sync_variants(products):
+    # products: [{'id', 'sizes', 'colors', 'stock'}]؛ بدون commit
+    # إن بقي مجموع مخزون الخيارات الحالية مساوياً للمخزون المطلوب يبقى توزيعه كما هو،
+    # وإلا يُوزع المخزون الجديد بالتساوي على كل الخيارات
+    current = {}
+    for variant in (db.session.query(ProductVariant.id, ProductVariant.product_id, ProductVariant.size,
+                                     ProductVariant.color, ProductVariant.stock)
+                    .filter(ProductVariant.product_id.in_([product['id'] for product in products]))):
+        current.setdefault(variant.product_id, {})[(variant.size, variant.color)] = variant
+    removed, added, changed = [], [], []
+    for product in products:
+        wanted = variant_options(product['sizes'], product['colors'])
+        existing = current.get(product['id'], {})
+        removed += [variant.id for options, variant in existing.items() if options not in wanted]
+        kept = {options: existing[options].stock for options in wanted if options in existing}
+        if sum(kept.values()) == product['stock']:
+            stocks = [kept.get(options, 0) for options in wanted]
+        else:
+            stocks = split_stock(product['stock'], len(wanted))
+        for (size, color), stock in zip(wanted, stocks):
+            variant = existing.get((size, color))
+            if variant is None:
+                added.append({'product_id': product['id'], 'size': size, 'color': color, 'stock': stock})
+            elif variant.stock != stock:
+                changed.append({'variant_id': variant.id, 'new_stock': stock})
+    if removed:
+        db.session.execute(db.delete(ProductVariant).where(ProductVariant.id.in_(removed))
+                           .execution_options(synchronize_session=False))
+    if changed:
+        variants = ProductVariant.__table__
+        db.session.execute(db.update(variants).where(variants.c.id == db.bindparam('variant_id'))
+                           .values(stock=db.bindparam('new_stock')), changed)
+    if added:
+        db.session.execute(db.insert(ProductVariant), added)
 
 # نموذج سلة التسوق
 class CartItem(db.Model):
@@ -112,12 +250,17 @@ class CartItem(db.Model):
     
     product = db.relationship('Product', backref=db.backref('cart_items', lazy=True))
 
+    __table_args__ = (
+        db.Index('ix_cart_item_session_product', 'session_id', 'product_id'),
+        db.Index('ix_cart_item_added_at', 'added_at'),
+    )
+
 # نموذج المستخدم
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    password_hash = db.Column(db.String(128))
+    password_hash = db.Column(db.String(256))  # scrypt في werkzeug ينتج 162 حرفاً
     first_name = db.Column(db.String(50))
     last_name = db.Column(db.String(50))
     phone = db.Column(db.String(15))
@@ -128,14 +271,18 @@ class User(UserMixin, db.Model):
     referral_code = db.Column(db.String(10), unique=True)
     referred_by = db.Column(db.Integer, db.ForeignKey('user.id'))
     is_active = db.Column(db.Boolean, default=True)
+    is_admin = db.Column(db.Boolean, default=False)  # يُمنح بالأمر flask grant-admin
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = generate_password_hash(password, method=PASSWORD_HASH_METHOD)
 
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
 
+    def password_needs_rehash(self):
+        return (self.password_hash or '').split('$', 1)[0] != password_hash_prefix()
+
     def generate_referral_code(self):
         if not self.referral_code:
             self.referral_code = ''.join(secrets.choice(string.ascii_uppercase + string.digits) for _ in range(8))
@@ -144,6 +291,86 @@ class User(UserMixin, db.Model):
     def get_full_name(self):
         return f"{self.first_name or ''} {self.last_name or ''}".strip() or self.username
 
+# تكلفة تجزئة كلمات المرور بصيغة werkzeug، مثل scrypt:32768:8:1 أو pbkdf2:sha256:600000؛
+# `flask tune-password-hash` يقيس الخيارات على هذا الجهاز. عند تغييرها تُعاد تجزئة
+# كلمة مرور كل مستخدم بالإعدادات الجديدة عند دخوله التالي
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+
+@functools.cache
+def password_hash_prefix():
+    # الصيغة الكاملة بعد إكمال werkzeug للقيم الافتراضية (scrypt -> scrypt:32768:8:1)
+    return generate_password_hash('', method=PASSWORD_HASH_METHOD).split('$', 1)[0]
+
+@app.cli.command('tune-password-hash')
+@click.option('--target-ms', default=100, help='أقصى زمن مقبول للتحقق من كلمة مرور واحدة')
+def tune_password_hash_command(target_ms):
+    """قياس تكلفة خيارات تجزئة كلمات المرور على هذا الجهاز واقتراح PASSWORD_HASH_METHOD"""
+    candidates = [f'scrypt:{2 ** power}:8:1' for power in range(14, 18)]
+    candidates += [f'pbkdf2:sha256:{iterations}' for iterations in (300000, 600000, 1000000)]
+    timings = {}
+    for method in candidates:
+        password_hash = generate_password_hash('benchmark', method=method)
+        runs = []
+        for _ in range(3):
+            started = time.perf_counter()
+            check_password_hash(password_hash, 'benchmark')
+            runs.append((time.perf_counter() - started) * 1000)
+        timings[method] = sorted(runs)[1]
+        print(f'{method:<24} {timings[method]:>8.1f} ms')
+    print(f'الحالي: {password_hash_prefix()}')
+    fitting = [method for method in candidates if method.startswith('scrypt') and timings[method] <= target_ms]
+    if fitting:
+        print(f'المقترح (أقوى scrypt خلال {target_ms}ms): PASSWORD_HASH_METHOD={fitting[-1]}')
+    else:
+        print(f'لا يوجد خيار scrypt خلال {target_ms}ms على هذا الجهاز')
+
+# current_user: نسخة مختصرة من User بلا كلمة المرور ولا علاقات، من الذاكرة المؤقتة
+SESSION_USER_COLUMNS = (User.id, User.username, User.email, User.first_name, User.last_name, User.phone,
+                        User.address, User.city, User.governorate, User.points, User.referral_code,
+                        User.is_active, User.is_admin, User.created_at)
+
+class SessionUser:
+    __slots__ = tuple(column.key for column in SESSION_USER_COLUMNS)
+    is_authenticated = True
+    is_anonymous = False
+    get_full_name = User.get_full_name
+
+    def __init__(self, row):
+        for name, value in zip(self.__slots__, row):
+            setattr(self, name, value)
+
+    def get_id(self):
+        return str(self.id)
+
+def load_session_user(user_id):
+    row = db.session.execute(db.select(*SESSION_USER_COLUMNS).where(User.id == user_id)).first()
+    return SessionUser(row) if row is not None else None
+
+user_cache = UserCache(db, load_session_user)
+
+# صفحات الإدارة التي تكشف بيانات العملاء أو تغيرها: مستخدم مسجل وله صلاحية الإدارة
+def admin_required(view):
+    @functools.wraps(view)
+    @login_required
+    def wrapped(*args, **kwargs):
+        if not current_user.is_admin:
+            abort(403)
+        return view(*args, **kwargs)
+    return wrapped
+
+@app.cli.command('grant-admin')
+@click.argument('username')
+@click.option('--revoke', is_flag=True, help='سحب الصلاحية بدلاً من منحها')
+def grant_admin_command(username, revoke):
+    """منح مستخدم صلاحية الإدارة (أو سحبها)"""
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        raise click.ClickException(f'لا يوجد مستخدم باسم {username}')
+    user.is_admin = not revoke
+    user_cache.invalidate(user.id)
+    db.session.commit()
+    print(f"{username}: {'مدير' if user.is_admin else 'مستخدم عادي'}")
+
 # نموذج الطلب
 class Order(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -160,13 +387,20 @@ class Order(db.Model):
     confirmed_at = db.Column(db.DateTime)
     shipped_at = db.Column(db.DateTime)
     delivered_at = db.Column(db.DateTime)
+    item_count = db.Column(db.Integer, default=0)  # عدد عناصر الطلب، يُحفظ عند إنشائه
+    rolled_up = db.Column(db.Boolean, default=False, nullable=False)  # محسوب في جداول التحليلات
 
     user = db.relationship('User', backref=db.backref('orders', lazy=True))
 
+    __table_args__ = (
+        db.Index('ix_order_user_created', 'user_id', 'created_at', 'id'),
+        db.Index('ix_order_rolled_up', 'rolled_up', 'id'),
+        db.Index('ix_order_status_created', 'status', 'created_at', 'id'),
+    )
+
     def generate_order_number(self):
         if not self.order_number:
-            timestamp = datetime.utcnow().strftime('%Y%m%d%H%M%S')
-            self.order_number = f"MRV{timestamp}"
+            self.order_number = order_numbers.next_order_number()
 
 # عناصر الطلب
 class OrderItem(db.Model):
@@ -181,6 +415,37 @@ class OrderItem(db.Model):
     order = db.relationship('Order', backref=db.backref('items', lazy=True))
     product = db.relationship('Product')
 
+    __table_args__ = (
+        db.Index('ix_order_item_order_id', 'order_id'),
+    )
+
+# جداول تجميع المبيعات اليومية (انظر analytics.py)؛ product_id بدون مفتاح أجنبي فيبقى
+# تاريخ مبيعات المنتج المحذوف
+class SalesDaily(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    orders = db.Column(db.Integer, default=0, nullable=False)
+    revenue = db.Column(db.Float, default=0, nullable=False)
+    donations = db.Column(db.Float, default=0, nullable=False)
+    units = db.Column(db.Integer, default=0, nullable=False)
+
+class ProductSalesDaily(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    product_id = db.Column(db.Integer, primary_key=True)
+    units = db.Column(db.Integer, default=0, nullable=False)
+    revenue = db.Column(db.Float, default=0, nullable=False)
+
+class ProductSalesMonthly(db.Model):
+    month = db.Column(db.Date, primary_key=True)  # أول يوم في الشهر
+    product_id = db.Column(db.Integer, primary_key=True)
+    units = db.Column(db.Integer, default=0, nullable=False)
+    revenue = db.Column(db.Float, default=0, nullable=False)
+
+class GovernorateSalesDaily(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    governorate = db.Column(db.String(50), primary_key=True)  # '' إن لم يحدد المستخدم محافظته
+    orders = db.Column(db.Integer, default=0, nullable=False)
+    revenue = db.Column(db.Float, default=0, nullable=False)
+
 # نموذج التقييمات
 class Review(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -193,6 +458,11 @@ class Review(db.Model):
     user = db.relationship('User', backref=db.backref('reviews', lazy=True))
     product = db.relationship('Product', backref=db.backref('reviews', lazy=True))
 
+    __table_args__ = (
+        db.Index('ix_review_product_id', 'product_id', 'id'),
+        db.Index('uq_review_user_product', 'user_id', 'product_id', unique=True),
+    )
+
 # نموذج مقارنة المنتجات
 class Comparison(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -203,30 +473,163 @@ class Comparison(db.Model):
     user = db.relationship('User', backref=db.backref('comparisons', lazy=True))
     product = db.relationship('Product')
 
+    __table_args__ = (
+        db.Index('uq_comparison_user_product', 'user_id', 'product_id', unique=True),
+        db.Index('ix_comparison_user_created', 'user_id', 'created_at'),
+        db.Index('ix_comparison_created_at', 'created_at'),
+    )
+
 # نموذج نقاط المستخدم
 class UserPoints(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     points = db.Column(db.Integer, nullable=False)
-    reason = db.Column(db.String(100))  # order, referral, review
+    reason = db.Column(db.String(100))  # order, referral, review, opening, adjustment
     order_id = db.Column(db.Integer, db.ForeignKey('order.id'))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     user = db.relationship('User', backref=db.backref('points_history', lazy=True))
     order = db.relationship('Order')
 
+    __table_args__ = (
+        db.Index('ix_user_points_user_id', 'user_id', 'id'),
+    )
+
+# بصمة آخر مخطط طُبق على قاعدة البيانات (انظر ensure_schema)
+class SchemaVersion(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    fingerprint = db.Column(db.String(64), nullable=False)
+    upgraded_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+# طابور المهام المؤجلة (انظر tasks.py)
+class Task(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    key = db.Column(db.String(200), unique=True)
+    payload = db.Column(db.Text)
+    status = db.Column(db.String(20), default='pending', nullable=False)  # pending, running, done, failed
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    run_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    locked_until = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_task_status_run_at', 'status', 'run_at'),
+    )
+
+tasks = TaskQueue(app, db, Task)
+
+# سجل النقاط: كل تغيير قيد جديد في UserPoints، وUser.points رصيد محسوب منه
+# يُحدث بزيادة ذرية في نفس المعاملة (بدون commit: المستدعي يملك المعاملة)
+def record_points(user_id, points, reason, order_id=None):
+    db.session.execute(db.insert(UserPoints), [{
+        'user_id': user_id,
+        'points': points,
+        'reason': reason,
+        'order_id': order_id,
+        'created_at': datetime.utcnow(),
+    }])
+    db.session.execute(db.update(User).where(User.id == user_id)
+                       .values(points=db.func.coalesce(User.points, 0) + points)
+                       .execution_options(synchronize_session=False))
+    user_cache.invalidate(user_id)
+
+@tasks.task('award_points')
+def award_points(user_id, points, reason, order_id=None):
+    record_points(user_id, points, reason, order_id)
+
+# أرصدة ما قبل السجل (إحالات قديمة بلا قيود) تُسجل مرة واحدة كقيد opening عند ترقية المخطط،
+# فلا تمحوها المطابقة
+def backfill_opening_points(conn):
+    users = User.__table__
+    entries = UserPoints.__table__
+    ledger = (db.select(db.func.coalesce(db.func.sum(entries.c.points), 0))
+              .where(entries.c.user_id == users.c.id).scalar_subquery())
+    balance = db.func.coalesce(users.c.points, 0)
+    opened = db.exists().where(entries.c.user_id == users.c.id, entries.c.reason == 'opening')
+    conn.execute(entries.insert().from_select(
+        ['user_id', 'points', 'reason', 'created_at'],
+        db.select(users.c.id, balance - ledger, db.literal('opening'), db.literal(datetime.utcnow(), db.DateTime))
+        .where(balance != ledger, ~opened)))
+
+@app.cli.command('reconcile-points')
+@click.option('--chunk', default=1000, help='عدد المستخدمين في كل معاملة')
+@click.option('--adjust/--overwrite', default=True,
+              help='تسجيل الفرق كقيد adjustment (الافتراضي) أو استبدال الرصيد بمجموع السجل')
+def reconcile_points_command(chunk, adjust):
+    """مطابقة أرصدة النقاط مع سجل UserPoints على دفعات"""
+    ledger = (db.select(db.func.coalesce(db.func.sum(UserPoints.points), 0))
+              .where(UserPoints.user_id == User.id).scalar_subquery())
+    last_id, fixed = 0, 0
+    while True:
+        ids = db.session.scalars(db.select(User.id).where(User.id > last_id)
+                                 .order_by(User.id).limit(chunk)).all()
+        if not ids:
+            break
+        in_chunk = User.id.between(ids[0], ids[-1])
+        balance = db.func.coalesce(User.points, 0)
+        if adjust:
+            drift = db.session.execute(db.select(User.id, balance - ledger)
+                                       .where(in_chunk, balance != ledger)).all()
+            if drift:
+                db.session.execute(db.insert(UserPoints), [{
+                    'user_id': user_id,
+                    'points': difference,
+                    'reason': 'adjustment',
+                    'created_at': datetime.utcnow(),
+                } for user_id, difference in drift])
+            fixed += len(drift)
+        else:
+            # تعليمة واحدة لكل دفعة فلا تضيع نقاط تُضاف أثناء المطابقة
+            fixed += db.session.execute(db.update(User).where(in_chunk, balance != ledger)
+                                        .values(points=ledger)
+                                        .execution_options(synchronize_session=False)).rowcount
+        db.session.commit()
+        last_id = ids[-1]
+    print(f'تمت مطابقة {fixed} رصيد')
+
+@app.cli.command('run-tasks')
+def run_tasks_command():
+    """تشغيل عامل مستقل لطابور المهام (مع TASK_WORKERS=0 في عمال الويب)"""
+    tasks.run_forever()
+
+@app.cli.command('task-stats')
+def task_stats_command():
+    """عرض عمق الطابور وزمن تنفيذ المهام"""
+    for name, value in tasks.stats().items():
+        print(f'{name}: {value}')
+
+@app.cli.command('purge-tasks')
+def purge_tasks_command():
+    """حذف المهام المنتهية الأقدم من أسبوع"""
+    print(f'تم حذف {tasks.purge()} مهمة منتهية')
+
+# عمق الطابور وزمن المهام على /metrics
+@instrumentation.add_collector
+def task_metrics():
+    stats = tasks.stats()
+    lines = ['# HELP marvo_tasks Task queue depth by status', '# TYPE marvo_tasks gauge']
+    lines += [f'marvo_tasks{{status="{status}"}} {stats[status]}' for status in ('pending', 'running', 'failed')]
+    lines += ['# HELP marvo_task_latency_seconds Enqueue to completion time in this process',
+              '# TYPE marvo_task_latency_seconds gauge']
+    lines += [f'marvo_task_latency_seconds{{quantile="{q / 100}"}} {stats[f"latency_p{q}"]}'
+              for q in (50, 95) if stats[f'latency_p{q}'] is not None]
+    return lines
+
 # نماذج WTForms
 class ProductForm(FlaskForm):
     name = StringField('اسم المنتج', validators=[DataRequired()])
     description = TextAreaField('الوصف', validators=[DataRequired()])
-    price = DecimalField('السعر', validators=[DataRequired(), NumberRange(min=0)])
+    price = DecimalField('السعر', validators=[InputRequired(), NumberRange(min=0)])
     category = SelectField('الفئة', choices=[
         ('shirts', 'قمصان'),
         ('pants', 'بناطيل'),
         ('shoes', 'أحذية'),
         ('accessories', 'إكسسوارات')
     ], validators=[DataRequired()])
-    stock = IntegerField('الكمية في المخزون', validators=[DataRequired(), NumberRange(min=0)])
+    stock = IntegerField('الكمية في المخزون', validators=[InputRequired(), NumberRange(min=0)])
     image = FileField('صورة المنتج')
     sizes = StringField('الأحجام (مفصولة بفاصلة)')
     colors = StringField('الألوان (مفصولة بفاصلة)')
@@ -305,9 +708,9 @@ class ReviewForm(FlaskForm):
 
 class SearchForm(FlaskForm):
     query = StringField('البحث عن المنتجات...')
-    category = SelectField('الفئة', choices=[('', 'كل الفئات'), ('shirts', 'قمصان'), ('pants', 'بناطيل'), ('shoes', 'أحذية'), ('accessories', 'إكسسوارات')])
-    min_price = DecimalField('أقل سعر')
-    max_price = DecimalField('أعلى سعر')
+    category = SelectField('الفئة', choices=[('', 'كل الفئات'), ('shirts', 'قمصان'), ('pants', 'بناطيل'), ('shoes', 'أحذية'), ('accessories', 'إكسسوارات')], default='')
+    min_price = DecimalField('أقل سعر', validators=[Optional(), NumberRange(min=0)])
+    max_price = DecimalField('أعلى سعر', validators=[Optional(), NumberRange(min=0)])
     submit = SubmitField('بحث')
 
 # helper functions للعملة
@@ -315,23 +718,417 @@ class SearchForm(FlaskForm):
 def currency_filter(amount):
     return f"{amount:.2f} ج.م"
 
+# روابط ونسخ الصورة لعنصر <picture> في _picture.html
+@app.template_global('image_picture')
+def image_picture(variants_json, variant):
+    data = picture(variants_json, variant)
+
+    def srcset(entries):
+        return ', '.join(f"{url_for('static', filename=path)} {width}w" for path, width in entries)
+
+    return {
+        'sources': [(mime, srcset(entries)) for mime, entries in data['sources']],
+        'src': url_for('static', filename=data['src']),
+        'srcset': srcset(data['srcset']),
+    }
+
+# ترقيم الصفحات بالمفتاح (keyset): أعمدة كل ترتيب تنازلياً وآخرها id لكسر التعادل،
+# ولكل ترتيب فهرس مركب على نفس الأعمدة
+CATALOG_PAGE_SIZE = 24
+ADMIN_PAGE_SIZE = 50
+CATALOG_SORTS = {
+    'newest': (Product.created_at, Product.id),
+    'rating': (Product.rating_average, Product.rating_count, Product.id),
+}
+
+def encode_cursor(values):
+    raw = json.dumps([value.isoformat() if isinstance(value, datetime) else value for value in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, keys):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(keys):
+            return None
+        if not all(isinstance(value, (int, float)) for value, key in zip(values, keys)
+                   if not isinstance(key.type, db.DateTime)):
+            return None
+        return tuple(datetime.fromisoformat(value) if isinstance(key.type, db.DateTime) else value
+                     for value, key in zip(values, keys))
+    except (ValueError, UnicodeDecodeError, TypeError):
+        return None
+
+def paginate_products(columns, cursor=None, per_page=CATALOG_PAGE_SIZE, sort='newest', size=None, color=None,
+                      category=None):
+    keys = CATALOG_SORTS[sort]
+    query = (db.session.query(*columns, *[key.label(f'sort_{i}') for i, key in enumerate(keys)])
+             .order_by(*[key.desc() for key in keys]))
+    if category:
+        query = query.filter(Product.category == category)
+    # المنتجات المتوفرة بالحجم أو اللون المطلوب من فهارس ProductVariant
+    if size or color:
+        available = db.select(ProductVariant.product_id).where(ProductVariant.stock > 0)
+        if size:
+            available = available.where(ProductVariant.size == size)
+        if color:
+            available = available.where(ProductVariant.color == color)
+        query = query.filter(Product.id.in_(available))
+    position = decode_cursor(cursor, keys) if cursor else None
+    if position:
+        query = query.filter(db.tuple_(*keys) < db.tuple_(*position))
+    rows = query.limit(per_page + 1).all()
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor([getattr(rows[-1], f'sort_{i}') for i in range(len(keys))])
+    return rows, next_cursor
+
+# الأعمدة المطلوبة لبطاقة المنتج فقط بدلاً من الكائن الكامل
+CATALOG_COLUMNS = (
+    Product.id,
+    Product.name,
+    db.func.substr(Product.description, 1, 100).label('description'),
+    Product.price,
+    Product.image_url,
+    Product.image_variants,
+    Product.rating_average,
+    Product.rating_count,
+)
+
+ADMIN_COLUMNS = (
+    Product.id,
+    Product.name,
+    Product.category,
+    Product.price,
+    Product.stock,
+    Product.image_url,
+    Product.image_variants,
+)
+
+# ذاكرة مؤقتة للأجزاء المشتركة بين كل الزوار؛ الهيكل العام (المستخدم والرسائل)
+# يُعرض لكل طلب، ورمز CSRF يُحقن في مكانه بعد القراءة من الذاكرة المؤقتة.
+# المجلد الافتراضي خاص بكل قاعدة بيانات فلا تُقرأ إصدارات قاعدة أخرى بعد تبديلها
+page_cache = cache_from_env(os.path.join(
+    app.instance_path, 'page_cache',
+    hashlib.sha1(app.config['SQLALCHEMY_DATABASE_URI'].encode()).hexdigest()[:12]))
+CSRF_HOLE = Markup('<!--csrf-token-->')
+
+def fill_csrf(html):
+    token = Markup('<input type="hidden" name="csrf_token" value="%s"/>') % generate_csrf()
+    return Markup(html.replace(CSRF_HOLE, token))
+
+def invalidate_catalog():
+    page_cache.bump('catalog')
+
+def invalidate_products(product_ids):
+    for product_id in set(product_ids):
+        page_cache.bump(f'product:{product_id}')
+
+# مفاتيح الذاكرة المؤقتة من معاملات الرابط بصيغة قياسية فقط، فلا تنشئ القيم العشوائية
+# مدخلاً جديداً لكل طلب: المؤشر غير الصالح هو الصفحة الأولى، وقيمة الفلتر غير الموجودة
+# في الكتالوج تُعرف بـ unknown_filters
+def catalog_cursor(sort):
+    cursor = request.args.get('after')
+    position = decode_cursor(cursor, CATALOG_SORTS[sort]) if cursor else None
+    return encode_cursor(position) if position else None
+
+def unknown_filters(filters, version):
+    options = catalog_filter_options(version)
+    known = {'size': options['sizes'], 'color': options['colors'],
+             'category': dict(ProductForm.category.kwargs['choices'])}
+    return [name for name, value in filters.items() if value is not None and value not in known[name]]
+
 # الصفحة الرئيسية
 @app.route('/')
 def index():
-    products = Product.query.all()
-    return render_template('index.html', products=products)
+    sort = request.args.get('sort', 'newest')
+    if sort not in CATALOG_SORTS:
+        sort = 'newest'
+    cursor = catalog_cursor(sort)
+    filters = {'size': request.args.get('size') or None, 'color': request.args.get('color') or None}
+    version = page_cache.version('catalog')
+    # حجم أو لون غير متوفر يُتجاهل ويُعرض الكتالوج كاملاً
+    for name in unknown_filters(filters, version):
+        filters[name] = None
+
+    def render_grid():
+        products, next_cursor = paginate_products(CATALOG_COLUMNS, cursor, sort=sort, **filters)
+        return str(render_template('_catalog_grid.html', products=products, sort=sort,
+                                   next_cursor=next_cursor, is_first_page=cursor is None,
+                                   filters=filters, filter_options=catalog_filter_options(version)))
+
+    key = json.dumps([version, sort, cursor, filters['size'], filters['color']], ensure_ascii=False)
+    grid = page_cache.cached(f'catalog:{key}', render_grid)
+    return render_template('index.html', catalog_grid=Markup(grid), sort=sort)
+
+def catalog_filter_options(version):
+    def load():
+        sizes = db.session.scalars(db.select(ProductVariant.size).distinct()
+                                   .where(ProductVariant.size.isnot(None), ProductVariant.stock > 0)
+                                   .order_by(ProductVariant.size)).all()
+        colors = db.session.scalars(db.select(ProductVariant.color).distinct()
+                                    .where(ProductVariant.color.isnot(None), ProductVariant.stock > 0)
+                                    .order_by(ProductVariant.color)).all()
+        return {'sizes': sizes, 'colors': colors}
+    return page_cache.cached(f'catalog-filters:{version}', load)
 
 # صفحة المنتج
 @app.route('/product/<int:id>')
 def product_detail(id):
-    product = Product.query.get_or_404(id)
-    return render_template('product_detail.html', product=product)
+    def render_detail():
+        product = Product.query.get_or_404(id)
+        reviews = (Review.query.options(db.joinedload(Review.user))
+                   .filter_by(product_id=id)
+                   .order_by(Review.id.desc())
+                   .limit(LATEST_REVIEWS + 1)
+                   .all())
+        return {
+            'title': product.name,
+            'html': str(render_template('_product_detail.html', product=product, csrf_input=CSRF_HOLE,
+                                        reviews=reviews[:LATEST_REVIEWS],
+                                        more_reviews=len(reviews) > LATEST_REVIEWS,
+                                        review_form=ReviewForm(formdata=None, meta={'csrf': False}))),
+        }
+
+    detail = page_cache.cached(f"product:{id}:{page_cache.version(f'product:{id}')}", render_detail)
+    return render_template('product_detail.html', title=detail['title'],
+                           detail_html=fill_csrf(detail['html']))
+
+# واجهة JSON للكتالوج (تطبيق الجوال ومواقع مقارنة الأسعار): الحقول يختارها المستدعي
+# بـ ?fields=، والرد محفوظ مضغوطاً تحت إصدار الكتالوج أو المنتج، فالطلب الشرطي
+# بنفس الإصدار يُجاب بـ 304 دون أي استعلام. القائمة بإصدار الكتالوج لذا لا تتضمن
+# المخزون (يتغير مع كل طلب شراء دون إبطال الكتالوج)؛ المخزون والخيارات في صفحة المنتج
+API_PRODUCT_FIELDS = {
+    'id': Product.id,
+    'name': Product.name,
+    'description': Product.description,
+    'price': Product.price,
+    'category': Product.category,
+    'image_url': Product.image_url,
+    'rating_average': Product.rating_average,
+    'rating_count': Product.rating_count,
+    'created_at': Product.created_at,
+}
+API_DETAIL_FIELDS = {
+    **API_PRODUCT_FIELDS,
+    'stock': Product.stock,
+}
+API_LIST_DEFAULT = ('id', 'name', 'price', 'category', 'image_url', 'rating_average', 'rating_count')
+API_PAGE_LIMIT = 100
+
+def api_fields(available, default):
+    # الحقول المطلوبة بترتيب تعريفها، أو None إن طُلب حقل غير معروف
+    requested = request.args.get('fields')
+    if not requested:
+        return list(default)
+    names = {name.strip() for name in requested.split(',') if name.strip()}
+    if not names <= set(available):
+        return None
+    return [name for name in available if name in names]
+
+def api_cached(version_name, key, build):
+    # build تعيد None إن لم يوجد المورد. الإصدار يصلح ETag فقط إن كان مشتركاً بين العمال؛
+    # بدونه لا 304 ولا رد محفوظ (قد يكون قديماً في عامل آخر) ويُبنى الرد في كل طلب
+    shared = page_cache.versions_shared
+    version = modified = None
+    if shared:
+        version, modified = page_cache.version(version_name), page_cache.modified(version_name)
+        response = not_modified(version, modified)
+        if response is not None:
+            return response
+    encoding = accepted_encoding()
+
+    def load():
+        data = build()
+        return None if data is None else dump_json(data)
+
+    def encode():
+        body = page_cache.cached(f'api:{version}:{key}', load) if shared else load()
+        return None if body is None else compress_json(body, encoding)
+
+    encoded = page_cache.cached(f'api:{version}:{key}:{encoding}', encode) if shared else encode()
+    if encoded is None:
+        return json_error('not found', 404)
+    return json_response(encoded, version, modified)
+
+def product_json(row, fields):
+    data = {name: getattr(row, name) for name in fields if name in API_DETAIL_FIELDS}
+    if 'url' in fields:
+        data['url'] = url_for('product_detail', id=row.id, _external=True)
+    return data
+
+@app.route('/api/products')
+def api_products():
+    fields = api_fields([*API_PRODUCT_FIELDS, 'url'], API_LIST_DEFAULT)
+    if fields is None:
+        return json_error(f"fields: {', '.join([*API_PRODUCT_FIELDS, 'url'])}")
+    sort = request.args.get('sort', 'newest')
+    if sort not in CATALOG_SORTS:
+        return json_error(f"sort: {', '.join(CATALOG_SORTS)}")
+    limit = min(max(request.args.get('limit', CATALOG_PAGE_SIZE, type=int), 1), API_PAGE_LIMIT)
+    filters = {name: request.args.get(name) or None for name in ('category', 'size', 'color')}
+    cursor = catalog_cursor(sort)
+    if unknown_filters(filters, page_cache.version('catalog')):
+        # لا منتجات متوفرة بهذه القيمة: رد فارغ دون استعلام ودون مدخل في الذاكرة المؤقتة
+        return json_response(compress_json(dump_json({'products': [], 'next_cursor': None}), None))
+
+    def build():
+        columns = [API_PRODUCT_FIELDS[name] for name in dict.fromkeys(['id', *fields]) if name != 'url']
+        products, next_cursor = paginate_products(columns, cursor, per_page=limit, sort=sort, **filters)
+        return {'products': [product_json(row, fields) for row in products], 'next_cursor': next_cursor}
+
+    key = json.dumps([fields, sort, limit, cursor, filters], ensure_ascii=False)
+    return api_cached('catalog', f'products:{key}', build)
+
+@app.route('/api/products/<int:id>')
+def api_product(id):
+    available = [*API_DETAIL_FIELDS, 'url', 'variants']
+    fields = api_fields(available, available)
+    if fields is None:
+        return json_error(f"fields: {', '.join(available)}")
+
+    def build():
+        columns = [API_DETAIL_FIELDS[name] for name in dict.fromkeys(['id', *fields])
+                   if name in API_DETAIL_FIELDS]
+        row = db.session.query(*columns).filter(Product.id == id).first()
+        if row is None:
+            return None
+        data = product_json(row, fields)
+        if 'variants' in fields:
+            data['variants'] = [variant._asdict() for variant in db.session.query(
+                ProductVariant.size, ProductVariant.color, ProductVariant.sku, ProductVariant.stock)
+                .filter_by(product_id=id).order_by(ProductVariant.id)]
+        return data
+
+    return api_cached(f'product:{id}', f'product:{id}:{",".join(fields)}', build)
+
+# التقييمات: ملخص التقييم على المنتج نفسه، فالعرض والترتيب لا يقرآن جدول Review
+REVIEWS_PAGE_SIZE = 10
+LATEST_REVIEWS = 5
+
+def add_review(product_id, user_id, rating, comment):
+    review = Review()
+    review.product_id = product_id
+    review.user_id = user_id
+    review.rating = rating
+    review.comment = comment
+    db.session.add(review)
+    stars = getattr(Product, f'rating_{rating}')
+    db.session.execute(
+        db.update(Product).where(Product.id == product_id).values({
+            Product.rating_count: Product.rating_count + 1,
+            Product.rating_sum: Product.rating_sum + rating,
+            Product.rating_average: db.cast(Product.rating_sum + rating, db.Float) / (Product.rating_count + 1),
+            stars: stars + 1,
+        }).execution_options(synchronize_session=False))
+    db.session.commit()
+    return review
+
+@app.cli.command('rebuild-ratings')
+def rebuild_ratings_command():
+    """إعادة حساب ملخص التقييمات لكل المنتجات من جدول Review."""
+    counts = {}
+    for product_id, rating, count in (db.session.query(Review.product_id, Review.rating, db.func.count())
+                                      .group_by(Review.product_id, Review.rating)):
+        counts.setdefault(product_id, {})[rating] = count
+    db.session.execute(db.update(Product).values(
+        rating_count=0, rating_sum=0, rating_average=0,
+        rating_1=0, rating_2=0, rating_3=0, rating_4=0, rating_5=0))
+    for product_id, histogram in counts.items():
+        total = sum(histogram.values())
+        rating_sum = sum(stars * count for stars, count in histogram.items())
+        values = {f'rating_{stars}': histogram.get(stars, 0) for stars in range(1, 6)}
+        db.session.execute(db.update(Product).where(Product.id == product_id).values(
+            rating_count=total, rating_sum=rating_sum, rating_average=rating_sum / total, **values))
+    db.session.commit()
+    invalidate_catalog()
+    invalidate_products(counts)
+    print(f'تمت إعادة حساب تقييمات {len(counts)} منتج')
+
+@app.route('/product/<int:id>/review', methods=['POST'])
+@login_required
+def submit_review(id):
+    if db.session.get(Product, id) is None:
+        abort(404)
+    form = ReviewForm()
+    if form.validate_on_submit():
+        try:
+            add_review(id, current_user.id, form.rating.data, form.comment.data)
+        except IntegrityError:
+            db.session.rollback()
+            flash('لقد قمت بتقييم هذا المنتج من قبل', 'error')
+        else:
+            invalidate_catalog()
+            invalidate_products([id])
+            flash('شكراً لتقييمك!', 'success')
+    else:
+        flash('التقييم غير صالح', 'error')
+    return redirect(url_for('product_detail', id=id) + '#reviews')
+
+@app.route('/product/<int:id>/reviews')
+def product_reviews(id):
+    product = db.session.query(Product.id, Product.name, Product.rating_average,
+                               Product.rating_count).filter_by(id=id).first_or_404()
+    query = (Review.query.options(db.joinedload(Review.user))
+             .filter_by(product_id=id)
+             .order_by(Review.id.desc()))
+    after = request.args.get('after', type=int)
+    if after:
+        query = query.filter(Review.id < after)
+    reviews = query.limit(REVIEWS_PAGE_SIZE + 1).all()
+    next_after = reviews[REVIEWS_PAGE_SIZE - 1].id if len(reviews) > REVIEWS_PAGE_SIZE else None
+    return render_template('reviews.html', product=product, reviews=reviews[:REVIEWS_PAGE_SIZE],
+                           next_after=next_after, is_first_page=after is None)
+
+# البحث عن المنتجات
+@app.route('/search')
+def search():
+    form = SearchForm(request.args, meta={'csrf': False})
+    page = request.args.get('page', 1, type=int)
+    products, has_next = [], False
+    if form.validate():
+        products, has_next = search_products(
+            db.session,
+            query=form.query.data,
+            category=form.category.data or None,
+            min_price=form.min_price.data,
+            max_price=form.max_price.data,
+            page=max(page, 1),
+        )
+    return render_template('search.html', form=form, products=products,
+                           page=max(page, 1), has_next=has_next)
+
+# السلة: سلة الزائر مرتبطة بالجلسة وسلة المستخدم برقمه، والتخزين حسب CART_BACKEND
+cart_store = cart_store_from_env(db, CartItem)
+
+def current_cart_id():
+    if current_user.is_authenticated:
+        cart_id = f'user:{current_user.id}'
+        # جلسة سُجل دخولها قبل نقل السلال لحساب المستخدم
+        if 'session_id' in session:
+            cart_store.merge(session.pop('session_id'), cart_id)
+        return cart_id
+    if 'session_id' not in session:
+        session['session_id'] = os.urandom(24).hex()
+    return session['session_id']
+
+# دمج سلة الزائر في سلة المستخدم عند تسجيل الدخول
+@user_logged_in.connect_via(app)
+def merge_anonymous_cart(sender, user):
+    anonymous_id = session.pop('session_id', None)
+    if anonymous_id:
+        cart_store.merge(anonymous_id, f'user:{user.id}')
+
+@app.cli.command('purge-carts')
+def purge_carts_command():
+    """حذف السلال المهجورة الأقدم من CART_TTL_DAYS"""
+    removed = cart_store.purge_expired()
+    print(f'تم حذف {removed} عنصر من السلال المهجورة')
 
 # إضافة للسلة
 @app.route('/add_to_cart', methods=['POST'])
 def add_to_cart():
-    if 'session_id' not in session:
-        session['session_id'] = os.urandom(24).hex()
+    cart_id = current_cart_id()
     
     try:
         product_id = int(request.form.get('product_id', 0))
@@ -340,70 +1137,240 @@ def add_to_cart():
         flash('بيانات غير صالحة', 'error')
         return redirect(url_for('index'))
     
-    # التحقق من وجود المنتج والمخزون
-    product = Product.query.get(product_id)
-    if not product:
-        flash('المنتج غير موجود', 'error')
-        return redirect(url_for('index'))
+    size = request.form.get('size') or None
+    color = request.form.get('color') or None
     
-    if product.stock < quantity:
-        flash('الكمية المطلوبة غير متوفرة', 'error')
+    # التحقق من وجود المنتج ومخزون الخيار المحدد
+    variant_stock = db.session.query(ProductVariant.stock).filter_by(
+        product_id=product_id, size=size, color=color).scalar()
+    if variant_stock is None:
+        if db.session.get(Product, product_id) is None:
+            flash('المنتج غير موجود', 'error')
+            return redirect(url_for('index'))
+        flash('الحجم أو اللون المحدد غير متوفر', 'error')
         return redirect(url_for('product_detail', id=product_id))
     
-    size = request.form.get('size')
-    color = request.form.get('color')
-    
-    # البحث عن عنصر موجود
-    existing_item = CartItem.query.filter_by(
-        session_id=session['session_id'],
-        product_id=product_id,
-        size=size,
-        color=color
-    ).first()
-    
-    if existing_item:
-        if product.stock < existing_item.quantity + quantity:
-            flash('الكمية المطلوبة غير متوفرة', 'error')
-            return redirect(url_for('product_detail', id=product_id))
-        existing_item.quantity += quantity
-    else:
-        cart_item = CartItem()
-        cart_item.session_id = session['session_id']
-        cart_item.product_id = product_id
-        cart_item.quantity = quantity
-        cart_item.size = size
-        cart_item.color = color
-        db.session.add(cart_item)
+    in_cart = cart_store.quantity(cart_id, product_id, size, color)
+    if variant_stock < in_cart + quantity:
+        flash('الكمية المطلوبة غير متوفرة', 'error')
+        return redirect(url_for('product_detail', id=product_id))
     
-    db.session.commit()
+    cart_store.add(cart_id, product_id, quantity, size, color)
     flash('تم إضافة المنتج للسلة بنجاح!', 'success')
     return redirect(url_for('cart'))
 
+# تحميل السلة مع منتجاتها وحساب المجموع مرة واحدة؛ المخازن التي لا تحمل
+# المنتجات بنفسها تُكمل باستعلام IN واحد
+def load_cart(cart_id):
+    cart_items = cart_store.get_lines(cart_id)
+    missing = {item.product_id for item in cart_items if item.product is None}
+    if missing:
+        products = {product.id: product for product in
+                    Product.query.filter(Product.id.in_(missing)).all()}
+        for item in cart_items:
+            if item.product is None:
+                item.product = products.get(item.product_id)
+    # منتج حُذف بعد إضافته للسلة
+    stale = [item for item in cart_items if item.product is None]
+    if stale:
+        cart_store.remove_lines(cart_id, stale)
+        db.session.commit()
+        cart_items = [item for item in cart_items if item.product is not None]
+    total = 0
+    for item in cart_items:
+        item.line_total = item.product.price * item.quantity
+        total += item.line_total
+    return cart_items, total
+
 # عرض السلة
 @app.route('/cart')
 def cart():
-    if 'session_id' not in session:
-        session['session_id'] = os.urandom(24).hex()
-    
-    cart_items = CartItem.query.filter_by(session_id=session['session_id']).all()
-    total = sum(item.product.price * item.quantity for item in cart_items)
+    cart_items, total = load_cart(current_cart_id())
     return render_template('cart.html', cart_items=cart_items, total=total)
 
 # حذف من السلة
-@app.route('/remove_from_cart/<int:id>', methods=['POST'])
-def remove_from_cart(id):
-    cart_item = CartItem.query.get_or_404(id)
-    if cart_item.session_id == session.get('session_id'):
-        db.session.delete(cart_item)
-        db.session.commit()
+@app.route('/remove_from_cart/<line_id>', methods=['POST'])
+def remove_from_cart(line_id):
+    if cart_store.remove(current_cart_id(), line_id):
         flash('تم حذف المنتج من السلة', 'success')
     return redirect(url_for('cart'))
 
+# مقارنة المنتجات: قائمة كل مستخدم (حتى COMPARE_LIMIT منتجات) باستعلام على فهرس
+# (user_id, created_at)، وبيانات الجدول كلها (المنتجات وخياراتها وملخص تقييماتها) باستعلام IN واحد.
+# المقارنات الأقدم من COMPARISON_TTL_DAYS تُحذف بمهمة في الطابور مرة يومياً
+COMPARE_LIMIT = 4
+COMPARISON_TTL_DAYS = int(os.environ.get('COMPARISON_TTL_DAYS', 30))
+COMPARE_COLUMNS = (
+    Product.id,
+    Product.name,
+    Product.description,
+    Product.price,
+    Product.image_url,
+    Product.image_variants,
+    Product.category,
+    Product.stock,
+    Product.rating_average,
+    Product.rating_count,
+)
+
+def comparison_ids(user_id):
+    return db.session.scalars(db.select(Comparison.product_id).where(Comparison.user_id == user_id)
+                              .order_by(Comparison.created_at, Comparison.id)).all()
+
+def load_comparison(product_ids):
+    # صف لكل خيار، يُجمع في قاموس لكل منتج بترتيب القائمة
+    rows = db.session.execute(
+        db.select(*COMPARE_COLUMNS, ProductVariant.size, ProductVariant.color,
+                  ProductVariant.stock.label('variant_stock'))
+        .outerjoin(ProductVariant, ProductVariant.product_id == Product.id)
+        .where(Product.id.in_(product_ids))
+        .order_by(Product.id, ProductVariant.id)).all()
+    products = {}
+    for row in rows:
+        product = products.get(row.id)
+        if product is None:
+            product = products[row.id] = {column.key: getattr(row, column.key) for column in COMPARE_COLUMNS}
+            product.update(sizes=[], colors=[])
+        if row.variant_stock:
+            if row.size and row.size not in product['sizes']:
+                product['sizes'].append(row.size)
+            if row.color and row.color not in product['colors']:
+                product['colors'].append(row.color)
+    return [products[product_id] for product_id in product_ids if product_id in products]
+
+def prune_comparisons_daily():
+    # مفتاح اليوم يجعلها مهمة واحدة يومياً مهما تعددت الطلبات والعمال
+    tasks.enqueue('prune_comparisons', key=f'prune-comparisons:{date.today().isoformat()}')
+
+@tasks.task('prune_comparisons')
+def prune_comparisons():
+    cutoff = datetime.utcnow() - timedelta(days=COMPARISON_TTL_DAYS)
+    return Comparison.query.filter(Comparison.created_at < cutoff).delete(synchronize_session=False)
+
+@app.cli.command('purge-comparisons')
+def purge_comparisons_command():
+    """حذف المقارنات الأقدم من COMPARISON_TTL_DAYS"""
+    removed = prune_comparisons()
+    db.session.commit()
+    print(f'تم حذف {removed} منتج من المقارنات القديمة')
+
+@app.route('/compare')
+@login_required
+def compare():
+    products = load_comparison(comparison_ids(current_user.id))
+    return render_template('compare.html', products=products, limit=COMPARE_LIMIT,
+                           categories=dict(ProductForm.category.kwargs['choices']))
+
+@app.route('/compare/add/<int:id>', methods=['POST'])
+@login_required
+def add_to_comparison(id):
+    if id in comparison_ids(current_user.id):
+        return redirect(url_for('compare'))
+    if db.session.get(Product, id) is None:
+        abort(404)
+    # العد داخل تعليمة الإضافة نفسها فلا يتجاوز طلبان متزامنان الحد
+    count = (db.select(db.func.count()).select_from(Comparison)
+             .where(Comparison.user_id == current_user.id).scalar_subquery())
+    try:
+        added = db.session.execute(db.insert(Comparison).from_select(
+            ['user_id', 'product_id', 'created_at'],
+            db.select(db.literal(current_user.id), db.literal(id), db.literal(datetime.utcnow(), db.DateTime))
+            .where(count < COMPARE_LIMIT))).rowcount
+        if added:
+            prune_comparisons_daily()
+        db.session.commit()
+    except IntegrityError:
+        # أُضيف من طلب آخر في نفس الوقت
+        db.session.rollback()
+        return redirect(url_for('compare'))
+    if not added:
+        flash(f'يمكن مقارنة {COMPARE_LIMIT} منتجات كحد أقصى، احذف منتجاً أولاً', 'error')
+        return redirect(url_for('compare'))
+    flash('تمت إضافة المنتج للمقارنة', 'success')
+    return redirect(url_for('compare'))
+
+@app.route('/compare/remove/<int:id>', methods=['POST'])
+@login_required
+def remove_from_comparison(id):
+    Comparison.query.filter_by(user_id=current_user.id, product_id=id).delete(synchronize_session=False)
+    db.session.commit()
+    return redirect(url_for('compare'))
+
 # لوحة الإدارة
 @app.route('/admin')
 def admin():
-    products = Product.query.all()
-    return render_template('admin.html', products=products)
+    products, next_cursor = paginate_products(ADMIN_COLUMNS, request.args.get('after'),
+                                              per_page=ADMIN_PAGE_SIZE)
+    return render_template('admin.html', products=products, next_cursor=next_cursor,
+                           is_first_page='after' not in request.args)
+
+# تحليلات المبيعات من جداول التجميع (انظر analytics.py)
+sales_rollups = SalesRollups(db, Order, OrderItem, User, Product, SalesDaily,
+                             ProductSalesDaily, ProductSalesMonthly, GovernorateSalesDaily)
+ANALYTICS_RANGES = (7, 30, 90, 365)
+
+@tasks.task('rollup_orders')
+def rollup_orders(order_ids):
+    sales_rollups.sync(order_ids)
+
+@app.cli.command('backfill-analytics')
+@click.option('--chunk', default=None, type=int, help='عدد الطلبات في كل معاملة')
+@click.option('--rebuild', is_flag=True, help='مسح جداول التجميع وإعادة حساب كل الطلبات')
+def backfill_analytics_command(chunk, rebuild):
+    """حساب الطلبات السابقة في جداول التحليلات على دفعات"""
+    done = sales_rollups.backfill(chunk=chunk, rebuild=rebuild,
+                                  progress=lambda done: print(f'{done} طلب...'))
+    print(f'تم حساب {done} طلب في جداول التحليلات')
+
+@app.route('/admin/analytics')
+@admin_required
+def admin_analytics():
+    days = request.args.get('days', 30, type=int)
+    if days not in ANALYTICS_RANGES:
+        days = 30
+    report = sales_rollups.dashboard(days)
+    peak = max((row.revenue for row in report['series']), default=0)
+    governorates = dict(RegisterForm.governorate.kwargs['choices'])
+    return render_template('admin_analytics.html', report=report, days=days, ranges=ANALYTICS_RANGES,
+                           peak=peak, governorates=governorates)
+
+# النسخ المصغرة تُنشأ في الخلفية حتى لا ينتظرها طلب الإدارة، وحتى اكتمالها
+# تعرض القوالب الصورة الأصلية
+image_pipeline = ImagePipeline()
+
+def build_product_images(product_id, filename):
+    with app.app_context():
+        try:
+            variants = process_image(app.config['UPLOAD_FOLDER'], filename)
+            db.session.execute(db.update(Product).where(Product.id == product_id)
+                               .values(image_variants=json.dumps(variants)))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            app.logger.exception('فشل إنشاء نسخ صورة المنتج %s', product_id)
+            return
+    invalidate_catalog()
+    invalidate_products([product_id])
+
+@app.cli.command('build-images')
+def build_images_command():
+    """إنشاء النسخ المصغرة للمنتجات التي رُفعت صورها قبل خط معالجة الصور."""
+    rows = (db.session.query(Product.id, Product.image_url)
+            .filter(Product.image_url.isnot(None), Product.image_variants.is_(None))
+            .all())
+    for product_id, image_url in rows:
+        build_product_images(product_id, os.path.basename(image_url))
+    print(f'تمت معالجة صور {len(rows)} منتج')
+
+def delete_product_images(product):
+    for relative_path in [product.image_url, *variant_paths(product.image_variants)]:
+        path = upload_path(app.config['UPLOAD_FOLDER'], relative_path)
+        if path is None:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            pass
 
 # إضافة منتج جديد
 @app.route('/admin/add_product', methods=['GET', 'POST'])
@@ -411,15 +1378,15 @@ def add_product():
     form = ProductForm()
     if form.validate_on_submit():
         # معالجة الصورة
-        image_url = None
+        image_url = filename = None
         if form.image.data:
             filename = save_uploaded_image(form.image.data)
             if filename:
                 image_url = f"uploads/{filename}"
         
         # معالجة الأحجام والألوان
-        sizes = [s.strip() for s in form.sizes.data.split(',')] if form.sizes.data else []
-        colors = [c.strip() for c in form.colors.data.split(',')] if form.colors.data else []
+        sizes = split_options(form.sizes.data)
+        colors = split_options(form.colors.data)
         
         product = Product()
         product.name = form.name.data
@@ -428,39 +1395,283 @@ def add_product():
         product.category = form.category.data
         product.stock = form.stock.data
         product.image_url = image_url
-        product.size_options = json.dumps(sizes)
-        product.color_options = json.dumps(colors)
         
         db.session.add(product)
+        db.session.flush()
+        sync_variants([{'id': product.id, 'sizes': sizes, 'colors': colors, 'stock': product.stock}])
+        index_product(db.session, product)
         db.session.commit()
+        invalidate_catalog()
+        if filename:
+            image_pipeline.submit(build_product_images, product.id, filename)
         flash('تم إضافة المنتج بنجاح!', 'success')
         return redirect(url_for('admin'))
     
     return render_template('add_product.html', form=form)
 
+# استيراد وتصدير المنتجات على دفعات (انظر catalog_io.py)
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 1000))
+EXPORT_BATCH_SIZE = 1000
+IMPORT_MAX_ERRORS = 100
+
+# نفس قواعد ProductForm المستخدمة في صفحة الإضافة؛ النموذج يُعاد استخدامه لكل الصفوف
+# لأن إنشاءه أغلى من التحقق نفسه
+def validate_product_row(form, row):
+    form.process(MultiDict({key: '' if value is None else value
+                            for key, value in row.items() if key and not isinstance(value, list)}))
+    errors = [f'{form[name].label.text}: {messages[0]}'
+              for name, messages in form.errors.items()] if not form.validate() else []
+    product_id = str(row.get('id') or '').strip()
+    if product_id and not product_id.isdigit():
+        errors.append('id: رقم غير صالح')
+    if errors:
+        return None, '، '.join(errors)
+    return {
+        'id': int(product_id) if product_id else None,
+        'name': form.name.data,
+        'description': form.description.data,
+        'price': float(form.price.data),
+        'category': form.category.data,
+        'stock': form.stock.data,
+        'sizes': split_options(row.get('sizes')),
+        'colors': split_options(row.get('colors')),
+    }, None
+
+def upsert_products(rows):
+    # الصفوف ذات id موجود تُحدث، والباقي يُضاف؛ كل مجموعة بتعليمة executemany واحدة
+    options = [(row, row.pop('sizes'), row.pop('colors')) for row in rows]
+    ids = [row['id'] for row in rows if row['id'] is not None]
+    existing = {row.id: row for row in db.session.query(Product.id, Product.image_url, Product.image_variants)
+                .filter(Product.id.in_(ids))} if ids else {}
+    updates, inserts, new_rows, replaced = [], [], [], []
+    for row in rows:
+        if row['id'] in existing:
+            current = existing[row['id']]
+            if row['image_url'] is None or row['image_url'] == current.image_url:
+                row['image_url'], row['image_variants'] = current.image_url, current.image_variants
+            else:
+                replaced.append(current)
+            updates.append(row)
+        elif row['id'] is not None:
+            inserts.append(row)
+        else:
+            del row['id']
+            new_rows.append(row)
+
+    if updates:
+        products = Product.__table__
+        columns = [key for key in updates[0] if key != 'id']
+        db.session.execute(
+            db.update(products).where(products.c.id == db.bindparam('product_id'))
+            .values({column: db.bindparam(f'new_{column}') for column in columns}),
+            [{'product_id': row['id'], **{f'new_{column}': row[column] for column in columns}}
+             for row in updates])
+    if inserts:
+        db.session.execute(db.insert(Product), inserts)
+    if new_rows:
+        new_ids = db.session.scalars(db.insert(Product).returning(Product.id, sort_by_parameter_order=True),
+                                     new_rows).all()
+        for row, product_id in zip(new_rows, new_ids):
+            row['id'] = product_id
+    sync_variants([{'id': row['id'], 'sizes': sizes, 'colors': colors, 'stock': row['stock']}
+                   for row, sizes, colors in options])
+    index_products(db.session, updates + inserts + new_rows)
+    return updates, inserts + new_rows, replaced
+
+def import_products(stream, fmt, image_dir=None, batch_size=None):
+    fetcher = ImageFetcher(app.config['UPLOAD_FOLDER'], image_dir, app.config['MAX_CONTENT_LENGTH'])
+    form = ProductForm(formdata=None, meta={'csrf': False})
+    result = {'inserted': 0, 'updated': 0, 'failed': 0, 'errors': []}
+
+    def fail(line, message):
+        result['failed'] += 1
+        if len(result['errors']) < IMPORT_MAX_ERRORS:
+            result['errors'].append((line, message))
+
+    for chunk in chunked(read_rows(stream, fmt), batch_size or IMPORT_BATCH_SIZE):
+        valid = {}
+        for line, row in chunk:
+            values, error = validate_product_row(form, row) if row is not None else (None, 'صف غير صالح')
+            if error:
+                fail(line, error)
+                continue
+            values['image_url'] = None
+            values['image_variants'] = None
+            values['image'] = str(row.get('image') or '').strip()
+            # آخر صف لنفس المنتج داخل الدفعة هو المعتمد
+            valid[values['id'] if values['id'] is not None else ('line', line)] = (line, values)
+
+        # جلب الصور الجديدة بالتوازي قبل الكتابة في قاعدة البيانات
+        sources = [values['image'] for _, values in valid.values()
+                   if values['image'] and not fetcher.is_existing_upload(values['image'])]
+        fetched = fetcher.fetch_all(sources)
+        rows = []
+        for line, values in valid.values():
+            source = values.pop('image')
+            if source in fetched:
+                filename, error = fetched[source]
+                if error:
+                    fail(line, error)
+                    continue
+                values['image_url'] = f'uploads/{filename}'
+            elif source:
+                values['image_url'] = source
+            rows.append(values)
+
+        try:
+            updated, inserted, replaced = upsert_products(rows)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            app.logger.exception('فشل استيراد دفعة منتجات')
+            for line, _ in valid.values():
+                fail(line, f'فشل حفظ الدفعة: {e}')
+            continue
+        result['updated'] += len(updated)
+        result['inserted'] += len(inserted)
+        invalidate_products([row['id'] for row in updated])
+        for row in replaced:
+            delete_product_images(row)
+        for row in updated + inserted:
+            if row['image_url'] and not row['image_variants']:
+                image_pipeline.submit(build_product_images, row['id'], os.path.basename(row['image_url']))
+
+    invalidate_catalog()
+    return result
+
+def export_products(batch_size=EXPORT_BATCH_SIZE):
+    # مؤشر من جهة الخادم: دفعة من الصفوف في الذاكرة في كل مرة
+    rows = db.session.execute(
+        db.select(Product.id, Product.name, Product.description, Product.price, Product.category,
+                  Product.stock, Product.image_url)
+        .order_by(Product.id)
+        .execution_options(yield_per=batch_size))
+    for partition in rows.partitions():
+        sizes, colors = {}, {}
+        for product_id, size, color in (db.session.query(ProductVariant.product_id, ProductVariant.size,
+                                                         ProductVariant.color)
+                                        .filter(ProductVariant.product_id.in_([row.id for row in partition]))
+                                        .order_by(ProductVariant.id)):
+            if size:
+                sizes.setdefault(product_id, {})[size] = None
+            if color:
+                colors.setdefault(product_id, {})[color] = None
+        yield [{
+            'id': row.id,
+            'name': row.name,
+            'description': row.description,
+            'price': row.price,
+            'category': row.category,
+            'stock': row.stock,
+            'sizes': ','.join(sizes.get(row.id, ())),
+            'colors': ','.join(colors.get(row.id, ())),
+            'image': row.image_url or '',
+        } for row in partition]
+
+@app.route('/admin/export')
+@admin_required
+def export_products_view():
+    fmt = request.args.get('format', 'csv')
+    if fmt not in WRITERS:
+        abort(404)
+    response = Response(stream_with_context(WRITERS[fmt](export_products())), mimetype=MIME_TYPES[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename=products.{fmt}'
+    return response
+
+# الاستيراد يكتب في الكتالوج ويجلب روابط الصور من الخادم: للمدير فقط
+@app.route('/admin/import', methods=['POST'])
+@admin_required
+def import_products_view():
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        flash('يرجى اختيار ملف CSV أو JSONL', 'error')
+        return redirect(url_for('admin'))
+    result = import_products(upload.stream, detect_format(upload.filename))
+    flash(f"تم استيراد {result['inserted']} منتج جديد وتحديث {result['updated']} منتج", 'success')
+    if result['failed']:
+        details = '؛ '.join(f'سطر {line}: {message}' for line, message in result['errors'][:5])
+        flash(f"تعذر استيراد {result['failed']} صف: {details}", 'error')
+    return redirect(url_for('admin'))
+
+@app.cli.command('import-products')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--images', type=click.Path(exists=True, file_okay=False),
+              help='مجلد مسارات الصور النسبية في الملف')
+@click.option('--batch-size', type=int, default=None)
+def import_products_command(path, images, batch_size):
+    """استيراد منتجات من ملف CSV أو JSONL (الصفوف ذات id موجود تُحدث)"""
+    with open(path, 'rb') as stream:
+        result = import_products(stream, detect_format(path), images, batch_size)
+    # انتظار إنشاء النسخ المصغرة قبل خروج العملية
+    image_pipeline.shutdown(wait=True)
+    print(f"تم استيراد {result['inserted']} منتج جديد وتحديث {result['updated']} منتج وتعذر {result['failed']} صف")
+    for line, message in result['errors']:
+        print(f'  سطر {line}: {message}')
+
+@app.cli.command('export-products')
+@click.argument('path')
+def export_products_command(path):
+    """تصدير كل المنتجات إلى ملف CSV أو JSONL حسب الامتداد (- للمخرج القياسي)"""
+    chunks = WRITERS[detect_format(path)](export_products())
+    if path == '-':
+        click.get_text_stream('stdout').writelines(chunks)
+        return
+    with open(path, 'w', encoding='utf-8', newline='') as output:
+        output.writelines(chunks)
+
+# مخزون ورمز SKU لكل خيار
+@app.route('/admin/product/<int:id>/variants', methods=['GET', 'POST'])
+@admin_required
+def product_variants(id):
+    product = Product.query.get_or_404(id)
+    if request.method == 'POST':
+        changes = []
+        for variant in product.variants:
+            stock = request.form.get(f'stock-{variant.id}', type=int)
+            if stock is None or stock < 0:
+                flash('المخزون يجب أن يكون رقماً موجباً', 'error')
+                return redirect(url_for('product_variants', id=id))
+            changes.append({'variant_id': variant.id, 'new_stock': stock,
+                            'new_sku': (request.form.get(f'sku-{variant.id}') or '').strip() or None})
+        variants = ProductVariant.__table__
+        db.session.execute(db.update(variants).where(variants.c.id == db.bindparam('variant_id'))
+                           .values(stock=db.bindparam('new_stock'), sku=db.bindparam('new_sku')), changes)
+        db.session.execute(db.update(Product).where(Product.id == id)
+                           .values(stock=sum(change['new_stock'] for change in changes))
+                           .execution_options(synchronize_session=False))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            flash('رمز SKU مستخدم لخيار آخر', 'error')
+            return redirect(url_for('product_variants', id=id))
+        invalidate_catalog()
+        invalidate_products([id])
+        flash('تم تحديث المخزون', 'success')
+        return redirect(url_for('admin'))
+    return render_template('product_variants.html', product=product)
+
 # حذف منتج
 @app.route('/admin/delete_product/<int:id>', methods=['POST'])
 def delete_product(id):
     product = Product.query.get_or_404(id)
     
-    # حذف صورة المنتج إن وجدت
-    if product.image_url:
-        image_path = os.path.join(app.config['UPLOAD_FOLDER'], product.image_url)
-        if os.path.exists(image_path):
-            try:
-                os.remove(image_path)
-            except OSError:
-                pass
+    # حذف صورة المنتج ونسخها المصغرة إن وجدت
+    delete_product_images(product)
     
+    unindex_product(db.session, product.id)
+    Comparison.query.filter_by(product_id=product.id).delete(synchronize_session=False)
     db.session.delete(product)
     db.session.commit()
+    invalidate_catalog()
+    invalidate_products([id])
     flash('تم حذف المنتج بنجاح!', 'success')
     return redirect(url_for('admin'))
 
 # تقديم الصور المرفوعة
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    return assets.send(app.config['UPLOAD_FOLDER'], filename)
 
 # رووتات المستخدمين
 @app.route('/register', methods=['GET', 'POST'])
@@ -493,14 +1704,17 @@ def register():
         user.generate_referral_code()
         
         # معالجة كود الإحالة
+        referrer_id = None
         if form.referral_code.data:
-            referrer = User.query.filter_by(referral_code=form.referral_code.data).first()
-            if referrer:
-                user.referred_by = referrer.id
-                # إضافة نقاط للمُحيل
-                referrer.points += 50
+            referrer_id = db.session.query(User.id).filter_by(referral_code=form.referral_code.data).scalar()
+            user.referred_by = referrer_id
         
         db.session.add(user)
+        if referrer_id:
+            db.session.flush()
+            # إضافة نقاط للمُحيل في طابور المهام
+            tasks.enqueue('award_points', key=f'referral:{user.id}',
+                          user_id=referrer_id, points=50, reason='referral')
         db.session.commit()
         
         flash('تم إنشاء حسابك بنجاح!', 'success')
@@ -518,6 +1732,9 @@ def login():
     if form.validate_on_submit():
         user = User.query.filter_by(email=form.email.data).first()
         if user and user.check_password(form.password.data):
+            if user.password_needs_rehash():
+                user.set_password(form.password.data)
+                db.session.commit()
             login_user(user, remember=form.remember_me.data)
             next_page = request.args.get('next')
             if not next_page or not next_page.startswith('/'):
@@ -537,18 +1754,181 @@ def logout():
 @app.route('/profile')
 @login_required
 def profile():
-    orders = Order.query.filter_by(user_id=current_user.id).order_by(Order.created_at.desc()).all()
-    return render_template('profile.html', user=current_user, orders=orders)
+    orders, next_cursor = paginate_orders(current_user.id, request.args.get('after'))
+    # الرصيد من User.points المحملة مع الجلسة، والسجل آخر القيود فقط
+    points_history = (UserPoints.query.filter_by(user_id=current_user.id)
+                      .order_by(UserPoints.id.desc()).limit(LATEST_POINTS + 1).all())
+    return render_template('profile.html', user=current_user, orders=orders, next_cursor=next_cursor,
+                           is_first_page='after' not in request.args,
+                           points_history=points_history[:LATEST_POINTS],
+                           more_points=len(points_history) > LATEST_POINTS)
+
+# سجل الطلبات بصفحات ثابتة الحجم مرتبة بـ (created_at, id) على فهرس ix_order_user_created
+ORDERS_PAGE_SIZE = 10
+ORDER_HISTORY_KEYS = (Order.created_at, Order.id)
+ORDER_HISTORY_COLUMNS = (
+    Order.id,
+    Order.order_number,
+    Order.status,
+    Order.created_at,
+    Order.total_amount,
+    Order.donation_amount,
+    Order.item_count,
+)
+
+def paginate_newest_orders(query, cursor, per_page):
+    # الأحدث أولاً بالمفتاح (created_at, id)؛ الاستعلام يحدد الأعمدة والشروط
+    query = query.order_by(Order.created_at.desc(), Order.id.desc())
+    position = decode_cursor(cursor, ORDER_HISTORY_KEYS) if cursor else None
+    if position:
+        query = query.filter(db.tuple_(*ORDER_HISTORY_KEYS) < db.tuple_(*position))
+    rows = query.limit(per_page + 1).all()
+    next_cursor = None
+    if len(rows) > per_page:
+        last = rows[per_page - 1]
+        next_cursor = encode_cursor([last.created_at, last.id])
+    return rows[:per_page], next_cursor
+
+def paginate_orders(user_id, cursor=None, per_page=ORDERS_PAGE_SIZE):
+    return paginate_newest_orders(db.session.query(*ORDER_HISTORY_COLUMNS).filter(Order.user_id == user_id),
+                                  cursor, per_page)
+
+@app.route('/api/orders')
+@login_required
+def api_orders():
+    orders, next_cursor = paginate_orders(current_user.id, request.args.get('after'))
+    return jsonify({
+        'orders': [{
+            'order_number': order.order_number,
+            'status': order.status,
+            'created_at': order.created_at.isoformat(),
+            'total': order.total_amount + order.donation_amount,
+            'item_count': order.item_count,
+            'url': url_for('order_tracking', order_number=order.order_number),
+        } for order in orders],
+        'next_cursor': next_cursor,
+    })
+
+POINTS_PAGE_SIZE = 20
+LATEST_POINTS = 5
+
+@app.route('/profile/points')
+@login_required
+def points_history():
+    query = UserPoints.query.filter_by(user_id=current_user.id).order_by(UserPoints.id.desc())
+    after = request.args.get('after', type=int)
+    if after:
+        query = query.filter(UserPoints.id < after)
+    entries = query.limit(POINTS_PAGE_SIZE + 1).all()
+    next_after = entries[POINTS_PAGE_SIZE - 1].id if len(entries) > POINTS_PAGE_SIZE else None
+    return render_template('points_history.html', entries=entries[:POINTS_PAGE_SIZE],
+                           next_after=next_after, is_first_page=after is None)
+
+# حجز المخزون وإنشاء الطلب في معاملة واحدة قصيرة
+CHECKOUT_RETRIES = 5
+CHECKOUT_RETRY_DELAY = 0.05  # ثانية، تتضاعف مع كل محاولة
+
+class InsufficientStock(Exception):
+    def __init__(self, product_names):
+        super().__init__('، '.join(product_names))
+        self.product_names = product_names
+
+def is_database_busy(error):
+    return isinstance(error.orig, sqlite3.OperationalError) and (
+        'locked' in str(error.orig) or 'busy' in str(error.orig))
+
+def place_order(user_id, cart_id, cart_items, total, donation, shipping_address, phone, notes):
+    quantities = {}
+    for item in cart_items:
+        options = (item.product_id, item.size, item.color)
+        quantities[options] = quantities.get(options, 0) + item.quantity
+    for attempt in range(CHECKOUT_RETRIES):
+        try:
+            order = _place_order(user_id, cart_id, cart_items, quantities, total, donation,
+                                 shipping_address, phone, notes)
+            break
+        except OperationalError as e:
+            db.session.rollback()
+            if not is_database_busy(e) or attempt == CHECKOUT_RETRIES - 1:
+                raise
+            time.sleep(CHECKOUT_RETRY_DELAY * (2 ** attempt) * (0.5 + random.random()))
+    # مخزن خارج قاعدة البيانات يُفرغ بعد نجاح المعاملة فقط
+    if not cart_store.transactional:
+        cart_store.remove_lines(cart_id, cart_items)
+    return order
+
+def _place_order(user_id, cart_id, cart_items, quantities, total, donation, shipping_address, phone, notes):
+    # حجز مخزون كل خيار بتحديث مشروط على فهرس (product_id, size, color)
+    variants = ProductVariant.__table__
+    reserve = (db.update(variants)
+               .where(variants.c.product_id == db.bindparam('reserve_id'),
+                      variants.c.size.is_not_distinct_from(db.bindparam('reserve_size')),
+                      variants.c.color.is_not_distinct_from(db.bindparam('reserve_color')),
+                      variants.c.stock >= db.bindparam('reserve_quantity'))
+               .values(stock=variants.c.stock - db.bindparam('reserve_quantity')))
+    reserved = db.session.execute(reserve, [
+        {'reserve_id': product_id, 'reserve_size': size, 'reserve_color': color, 'reserve_quantity': quantity}
+        for (product_id, size, color), quantity in quantities.items()
+    ]).rowcount
+    if reserved != len(quantities):
+        db.session.rollback()
+        stock = {(variant.product_id, variant.size, variant.color): variant.stock for variant in
+                 db.session.query(ProductVariant.product_id, ProductVariant.size, ProductVariant.color,
+                                  ProductVariant.stock)
+                 .filter(ProductVariant.product_id.in_({options[0] for options in quantities}))}
+        names = {item.product_id: item.product.name for item in cart_items}
+        raise InsufficientStock([' '.join(filter(None, (names[options[0]], *options[1:])))
+                                 for options, quantity in quantities.items()
+                                 if stock.get(options, 0) < quantity])
+
+    # مجموع مخزون المنتج المعروض في الكتالوج
+    totals = {}
+    for (product_id, _, _), quantity in quantities.items():
+        totals[product_id] = totals.get(product_id, 0) + quantity
+    products = Product.__table__
+    db.session.execute(db.update(products).where(products.c.id == db.bindparam('total_id'))
+                       .values(stock=products.c.stock - db.bindparam('total_quantity')),
+                       [{'total_id': product_id, 'total_quantity': quantity}
+                        for product_id, quantity in totals.items()])
+
+    order = Order()
+    order.user_id = user_id
+    order.generate_order_number()
+    order.total_amount = total
+    order.donation_amount = donation
+    order.shipping_address = shipping_address
+    order.phone = phone
+    order.notes = notes
+    order.item_count = len(cart_items)
+    db.session.add(order)
+    db.session.flush()  # للحصول على order.id
+
+    db.session.execute(db.insert(OrderItem), [{
+        'order_id': order.id,
+        'product_id': item.product_id,
+        'quantity': item.quantity,
+        'price': item.product.price,
+        'size': item.size,
+        'color': item.color,
+    } for item in cart_items])
+
+    if cart_store.transactional:
+        cart_store.remove_lines(cart_id, cart_items)
+
+    # نقاط المستخدم (نقطة واحدة لكل جنيه) وجداول التحليلات تُحدث بعد الطلب في طابور المهام
+    tasks.enqueue('award_points', key=f'order-points:{order.id}',
+                  user_id=user_id, points=int(total), reason='order', order_id=order.id)
+    tasks.enqueue('rollup_orders', key=f'rollup:{order.id}', order_ids=[order.id])
+
+    db.session.commit()
+    return order
 
 # Checkout محدث
 @app.route('/checkout', methods=['GET', 'POST'])
 @login_required
 def checkout():
-    if 'session_id' not in session:
-        flash('سلة التسوق فارغة', 'error')
-        return redirect(url_for('cart'))
-    
-    cart_items = CartItem.query.filter_by(session_id=session['session_id']).all()
+    cart_id = current_cart_id()
+    cart_items, total = load_cart(cart_id)
     if not cart_items:
         flash('سلة التسوق فارغة', 'error')
         return redirect(url_for('cart'))
@@ -558,67 +1938,373 @@ def checkout():
     form.phone.data = current_user.phone
     
     if form.validate_on_submit():
-        # حساب المجموع
-        total = sum(item.product.price * item.quantity for item in cart_items)
         donation = 1.0 if form.donation.data else 0.0
+        product_ids = [item.product_id for item in cart_items]
         
-        # إنشاء الطلب
-        order = Order()
-        order.user_id = current_user.id
-        order.generate_order_number()
-        order.total_amount = total
-        order.donation_amount = donation
-        order.shipping_address = form.shipping_address.data
-        order.phone = form.phone.data
-        order.notes = form.notes.data
-        
-        db.session.add(order)
-        db.session.flush()  # للحصول على order.id
-        
-        # إضافة عناصر الطلب
-        for item in cart_items:
-            order_item = OrderItem()
-            order_item.order_id = order.id
-            order_item.product_id = item.product_id
-            order_item.quantity = item.quantity
-            order_item.price = item.product.price
-            order_item.size = item.size
-            order_item.color = item.color
-            db.session.add(order_item)
-        
-        # حذف عناصر السلة
-        for item in cart_items:
-            db.session.delete(item)
-        
-        # إضافة نقاط للمستخدم (نقطة واحدة لكل جنيه)
-        points = int(total)
-        current_user.points += points
-        user_points = UserPoints()
-        user_points.user_id = current_user.id
-        user_points.points = points
-        user_points.reason = 'order'
-        user_points.order_id = order.id
-        db.session.add(user_points)
-        
-        db.session.commit()
+        try:
+            order = place_order(current_user.id, cart_id, cart_items, total, donation,
+                                form.shipping_address.data, form.phone.data, form.notes.data)
+        except InsufficientStock as e:
+            flash(f'الكمية المطلوبة غير متوفرة: {e}', 'error')
+            return redirect(url_for('cart'))
+        except OperationalError:
+            flash('المتجر مشغول حالياً، يرجى المحاولة مرة أخرى', 'error')
+            return redirect(url_for('checkout'))
+        # المخزون المعروض في صفحات المنتجات تغير
+        invalidate_products(product_ids)
         
         flash(f'تم تأكيد طلبك رقم {order.order_number} بنجاح!', 'success')
         return redirect(url_for('order_tracking', order_number=order.order_number))
     
-    total = sum(item.product.price * item.quantity for item in cart_items)
     return render_template('checkout.html', form=form, cart_items=cart_items, total=total)
 
 @app.route('/order_tracking/<order_number>')
 @login_required
 def order_tracking(order_number):
-    order = Order.query.filter_by(order_number=order_number, user_id=current_user.id).first_or_404()
+    # العناصر ومنتجاتها باستعلام واحد بدلاً من استعلام لكل عنصر (N+1 ظاهر في /metrics)
+    order = (Order.query.options(db.selectinload(Order.items).joinedload(OrderItem.product))
+             .filter_by(order_number=order_number, user_id=current_user.id).first_or_404())
     return render_template('order_tracking.html', order=order)
 
-# Initialize database tables on startup
-with app.app_context():
+# حالة الطلب فقط لصفحة التتبع: الصفحة تسأل دورياً ولا يُعاد عرضها إلا إذا تغيرت الحالة،
+# وETag يجعل الرد 304 بلا محتوى طالما لم يتغير شيء
+@app.route('/api/orders/<order_number>/status')
+@login_required
+def order_status(order_number):
+    order = (db.session.query(Order.status, Order.created_at, Order.confirmed_at, Order.shipped_at,
+                              Order.delivered_at)
+             .filter_by(order_number=order_number, user_id=current_user.id).first_or_404())
+    response = jsonify({
+        'order_number': order_number,
+        'status': order.status,
+        'status_label': ORDER_STATUSES.get(order.status, order.status),
+        **{name: value.isoformat() if value else None
+           for name, value in order._asdict().items() if name.endswith('_at')},
+    })
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.add_etag()
+    return response.make_conditional(request)
+
+# إدارة الطلبات: طابور لكل حالة بالأحدث أولاً على فهرس (status, created_at, id)، وتغيير
+# حالة مئات الطلبات بتعليمة UPDATE واحدة مشروطة بالحالات التي يُسمح بالانتقال منها
+ORDER_STATUSES = {
+    'pending': 'قيد الانتظار',
+    'confirmed': 'مؤكد',
+    'shipped': 'تم الشحن',
+    'delivered': 'تم التسليم',
+    'cancelled': 'ملغي',
+}
+ORDER_TRANSITIONS = {  # الحالة الجديدة: الحالات التي يمكن الانتقال منها
+    'confirmed': ('pending',),
+    'shipped': ('confirmed',),
+    'delivered': ('shipped',),
+    'cancelled': ('pending', 'confirmed'),
+}
+ORDER_TIMESTAMPS = {'confirmed': 'confirmed_at', 'shipped': 'shipped_at', 'delivered': 'delivered_at'}
+ORDER_QUEUE_PAGE_SIZE = 50
+ORDER_BATCH_LIMIT = 1000
+ORDER_QUEUE_COLUMNS = (
+    Order.id,
+    Order.order_number,
+    Order.status,
+    Order.created_at,
+    Order.total_amount,
+    Order.donation_amount,
+    Order.item_count,
+    User.username,
+    User.first_name,
+    User.last_name,
+    User.governorate,
+)
+
+def paginate_order_queue(status, cursor=None, per_page=ORDER_QUEUE_PAGE_SIZE):
+    query = (db.session.query(*ORDER_QUEUE_COLUMNS)
+             .join(User, User.id == Order.user_id)
+             .filter(Order.status == status))
+    return paginate_newest_orders(query, cursor, per_page)
+
+def restock_orders(order_ids):
+    # إرجاع كميات الطلبات الملغاة لمخزون خياراتها ومجموع منتجاتها؛ بدون commit
+    quantities = db.session.execute(
+        db.select(OrderItem.product_id, OrderItem.size, OrderItem.color, db.func.sum(OrderItem.quantity))
+        .where(OrderItem.order_id.in_(order_ids))
+        .group_by(OrderItem.product_id, OrderItem.size, OrderItem.color)).all()
+    if not quantities:
+        return set()
+    variants = ProductVariant.__table__
+    db.session.execute(
+        db.update(variants)
+        .where(variants.c.product_id == db.bindparam('restock_id'),
+               variants.c.size.is_not_distinct_from(db.bindparam('restock_size')),
+               variants.c.color.is_not_distinct_from(db.bindparam('restock_color')))
+        .values(stock=variants.c.stock + db.bindparam('restock_quantity')),
+        [{'restock_id': product_id, 'restock_size': size, 'restock_color': color, 'restock_quantity': quantity}
+         for product_id, size, color, quantity in quantities])
+    totals = {}
+    for product_id, _, _, quantity in quantities:
+        totals[product_id] = totals.get(product_id, 0) + quantity
+    products = Product.__table__
+    db.session.execute(db.update(products).where(products.c.id == db.bindparam('total_id'))
+                       .values(stock=products.c.stock + db.bindparam('total_quantity')),
+                       [{'total_id': product_id, 'total_quantity': quantity}
+                        for product_id, quantity in totals.items()])
+    return set(totals)
+
+def transition_orders(order_ids, status):
+    # المعرفات التي تغيرت فعلاً؛ الطلبات التي لا تسمح حالتها بالانتقال تبقى كما هي
+    values = {'status': status}
+    if status in ORDER_TIMESTAMPS:
+        values[ORDER_TIMESTAMPS[status]] = datetime.utcnow()
+    orders = Order.__table__
+    changed = db.session.scalars(
+        db.update(orders)
+        .where(orders.c.id.in_(order_ids), orders.c.status.in_(ORDER_TRANSITIONS[status]))
+        .values(values).returning(orders.c.id)).all()
+    restocked = set()
+    if changed and status == 'cancelled':
+        restocked = restock_orders(changed)
+        tasks.enqueue('rollup_orders', order_ids=changed)
+    db.session.commit()
+    if restocked:
+        invalidate_catalog()
+        invalidate_products(restocked)
+    return changed
+
+def order_queue_json(order):
+    return {
+        'id': order.id,
+        'order_number': order.order_number,
+        'status': order.status,
+        'created_at': order.created_at.isoformat(),
+        'total': order.total_amount + order.donation_amount,
+        'item_count': order.item_count,
+        'customer': f"{order.first_name or ''} {order.last_name or ''}".strip() or order.username,
+        'governorate': order.governorate,
+    }
+
+@app.route('/admin/orders')
+@admin_required
+def admin_orders():
+    status = request.args.get('status', 'pending')
+    if status not in ORDER_STATUSES:
+        status = 'pending'
+    orders, next_cursor = paginate_order_queue(status, request.args.get('after'))
+    transitions = [target for target, sources in ORDER_TRANSITIONS.items() if status in sources]
+    return render_template('admin_orders.html', orders=orders, status=status, next_cursor=next_cursor,
+                           is_first_page='after' not in request.args, statuses=ORDER_STATUSES,
+                           transitions=transitions, governorates=dict(RegisterForm.governorate.kwargs['choices']))
+
+@app.route('/api/admin/orders')
+@admin_required
+def api_admin_orders():
+    status = request.args.get('status', 'pending')
+    if status not in ORDER_STATUSES:
+        return jsonify({'error': 'unknown status'}), 400
+    per_page = min(request.args.get('limit', ORDER_QUEUE_PAGE_SIZE, type=int), ORDER_BATCH_LIMIT)
+    orders, next_cursor = paginate_order_queue(status, request.args.get('after'), max(per_page, 1))
+    return jsonify({'orders': [order_queue_json(order) for order in orders], 'next_cursor': next_cursor})
+
+# من نموذج لوحة الإدارة (order_ids وstatus) أو JSON بنفس الحقول مع ترويسة X-CSRFToken
+@app.route('/admin/orders/status', methods=['POST'])
+@admin_required
+def update_order_status():
+    data = request.get_json(silent=True) if request.is_json else None
+    if data is not None:
+        status, raw_ids = data.get('status'), data.get('order_ids')
+    else:
+        status, raw_ids = request.form.get('status'), request.form.getlist('order_ids')
+    try:
+        order_ids = list(dict.fromkeys(int(order_id) for order_id in raw_ids or ()))
+    except (TypeError, ValueError):
+        order_ids = None
+    error = None
+    if status not in ORDER_TRANSITIONS:
+        error = 'حالة غير صالحة'
+    elif not order_ids:
+        error = 'لم يتم اختيار أي طلب'
+    elif len(order_ids) > ORDER_BATCH_LIMIT:
+        error = f'الحد الأقصى {ORDER_BATCH_LIMIT} طلب في المرة الواحدة'
+    if error:
+        if data is not None:
+            return jsonify({'error': error}), 400
+        flash(error, 'error')
+        return redirect(request.referrer or url_for('admin_orders'))
+
+    changed = transition_orders(order_ids, status)
+    if data is not None:
+        changed_ids = set(changed)
+        return jsonify({'updated': changed, 'skipped': [order_id for order_id in order_ids
+                                                       if order_id not in changed_ids]})
+    skipped = len(order_ids) - len(changed)
+    flash(f'تم تحويل {len(changed)} طلب إلى "{ORDER_STATUSES[status]}"'
+          + (f'، وتُرك {skipped} طلب لا تسمح حالته بذلك' if skipped else ''),
+          'success' if changed else 'error')
+    return redirect(request.referrer or url_for('admin_orders'))
+
+# ملء الأعمدة المحسوبة عند إضافتها لجدول فيه بيانات
+BACKFILLS = {
+    ('order', 'item_count'): 'UPDATE "order" SET item_count = '
+                             '(SELECT COUNT(*) FROM order_item WHERE order_item.order_id = "order".id)',
+}
+
+# المنتجات التي سبقت جدول الخيارات: خيار لكل (حجم، لون) من أعمدة JSON القديمة
+# ومخزون المنتج موزع عليها بالتساوي
+def backfill_product_variants(conn):
+    products = Product.__table__
+    variants = ProductVariant.__table__
+
+    def options(value):
+        try:
+            values = json.loads(value) if value else []
+        except ValueError:
+            return []
+        return list(dict.fromkeys(str(item).strip() for item in values if str(item).strip()))
+
+    rows = conn.execute(db.select(products.c.id, products.c.size_options, products.c.color_options,
+                                  products.c.stock)
+                        .where(~db.exists().where(variants.c.product_id == products.c.id))).all()
+    added = []
+    for row in rows:
+        combinations = variant_options(options(row.size_options), options(row.color_options))
+        for (size, color), stock in zip(combinations, split_stock(row.stock, len(combinations))):
+            added.append({'product_id': row.id, 'size': size, 'color': color, 'stock': stock})
+    if added:
+        conn.execute(variants.insert(), added)
+
+# خيارات مكررة (نفس الحجم واللون مع NULL) أو فارغة ('' لا يطابق أي اختيار في النموذج)
+# من قبل uq_product_variant_option_values: '' يصبح NULL ويُدمج مخزون المكرر في أقدم خيار
+def dedupe_product_variants(conn):
+    variants = ProductVariant.__table__
+    for column in (variants.c.size, variants.c.color):
+        conn.execute(variants.update().where(db.func.trim(column) == '').values({column: None}))
+    keep = {}
+    merged, removed = {}, []
+    for row in conn.execute(db.select(variants.c.id, variants.c.product_id, variants.c.size,
+                                      variants.c.color, variants.c.stock).order_by(variants.c.id)):
+        first = keep.setdefault((row.product_id, row.size, row.color), row.id)
+        if first != row.id:
+            merged[first] = merged.get(first, 0) + row.stock
+            removed.append(row.id)
+    if removed:
+        conn.execute(variants.delete().where(variants.c.id.in_(removed)))
+        conn.execute(variants.update().where(variants.c.id == db.bindparam('variant_id'))
+                     .values(stock=variants.c.stock + db.bindparam('extra_stock')),
+                     [{'variant_id': variant_id, 'extra_stock': stock} for variant_id, stock in merged.items()])
+
+# create_all لا يضيف الأعمدة أو الفهارس الجديدة للجداول الموجودة مسبقاً
+def upgrade_schema():
     db.create_all()
+    inspector = db.inspect(db.engine)
+    with db.engine.begin() as conn:
+        dedupe_product_variants(conn)
+        for table in db.metadata.sorted_tables:
+            existing = {column['name']: column['type'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                column_type = column.type.compile(dialect=conn.dialect)
+                if column.name in existing:
+                    # SQLite لا يفرض طول VARCHAR؛ في PostgreSQL يُوسع العمود إن زاد طوله في النموذج
+                    current = getattr(existing[column.name], 'length', None)
+                    wanted = getattr(column.type, 'length', None)
+                    if conn.dialect.name == 'postgresql' and current and wanted and current < wanted:
+                        conn.execute(db.text(f'ALTER TABLE "{table.name}" ALTER COLUMN "{column.name}" TYPE {column_type}'))
+                    continue
+                ddl = f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'
+                default = column.default.arg if column.default is not None and column.default.is_scalar else None
+                if default is not None:
+                    # القيمة بصيغة قاعدة البيانات: BOOLEAN DEFAULT false في PostgreSQL و0 في SQLite
+                    literal = db.literal(default, column.type).compile(dialect=conn.dialect,
+                                                                     compile_kwargs={'literal_binds': True})
+                    ddl += f' DEFAULT {literal}'
+                conn.execute(db.text(ddl))
+                if (table.name, column.name) in BACKFILLS:
+                    conn.execute(db.text(BACKFILLS[(table.name, column.name)]))
+            # IF NOT EXISTS لا checkfirst: فحص الوجود لا يرى فهارس التعبيرات (coalesce) في SQLite
+            for index in table.indexes:
+                conn.execute(CreateIndex(index, if_not_exists=True))
+        create_search_index(conn)
+        backfill_product_variants(conn)
+        backfill_opening_points(conn)
+
+# ترقية المخطط لا تتم عند استيراد الوحدة: يشغلها النشر مرة واحدة (flask upgrade-schema أو
+# on_starting في gunicorn.conf.py) أو create_app() في العملية الرئيسية مع --preload.
+# البصمة المحفوظة تجعل التحقق في كل إقلاع استعلاماً واحداً بدلاً من فحص كل الجداول.
+#   SCHEMA_UPGRADE   auto (الافتراضي): create_app يرقي المخطط إن تغيرت البصمة؛
+#                    off: create_app لا يلمس قاعدة البيانات
+SCHEMA_REVISION = 2  # تُزاد عند تغيير البيانات (BACKFILLS أو فهرس البحث) دون تغيير النماذج
+
+@functools.cache
+def schema_fingerprint():
+    parts = [str(SCHEMA_REVISION)]
+    for table in db.metadata.sorted_tables:
+        parts.append(table.name)
+        parts.extend(f'{column.name}:{column.type}' for column in table.columns)
+        parts.extend(sorted(index.name for index in table.indexes))
+    return hashlib.sha256('\n'.join(parts).encode()).hexdigest()
+
+def schema_is_current():
+    try:
+        return db.session.scalar(db.select(SchemaVersion.fingerprint)) == schema_fingerprint()
+    except (OperationalError, ProgrammingError):
+        # قاعدة جديدة أو سابقة لجدول schema_version
+        db.session.rollback()
+        return False
+    finally:
+        db.session.remove()
+
+def ensure_schema():
+    if schema_is_current():
+        return False
+    # قفل ملف حتى لا يرقي عاملان المخطط معاً إن بدأ كل منهما دون --preload
+    handle = open(os.path.join(app.instance_path, 'schema.lock'), 'w')
+    try:
+        if fcntl is not None:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+        if schema_is_current():
+            return False
+        upgrade_schema()
+        with db.engine.begin() as conn:
+            conn.execute(db.delete(SchemaVersion))
+            conn.execute(db.insert(SchemaVersion).values(fingerprint=schema_fingerprint(),
+                                                         upgraded_at=datetime.utcnow()))
+        return True
+    finally:
+        handle.close()
+
+@app.cli.command('upgrade-schema')
+def upgrade_schema_command():
+    """ترقية مخطط قاعدة البيانات مرة واحدة قبل تشغيل العمال"""
+    print('تمت ترقية المخطط' if ensure_schema() else 'المخطط محدث')
+
+# نقطة الدخول لـ gunicorn (app:create_app()، انظر gunicorn.conf.py): ليست مصنعاً للتطبيقات،
+# بل تتحقق من المخطط ثم تعيد نفس التطبيق المعرف في الوحدة (الإضافات مسجلة عليه عند
+# الاستيراد دون أي اتصال بقاعدة البيانات). الاتصالات تُفتح عند أول استخدام وخيوط المهام
+# مع after_fork أو أول طلب
+def create_app():
+    if os.environ.get('SCHEMA_UPGRADE', 'auto') != 'off':
+        with app.app_context():
+            ensure_schema()
+            # لا تبقى اتصالات مفتوحة في العملية الرئيسية ليرثها العمال
+            db.engine.dispose()
+    return app
+
+# مع --preload فقط (on_starting في gunicorn.conf.py): ربط النماذج وترجمة كل القوالب مرة
+# واحدة في العملية الرئيسية بدلاً من أول طلبات كل عامل، ثم gc.freeze حتى لا يلمس جامع
+# القمامة في العمال الكائنات الموروثة فتُنسخ صفحاتها (copy-on-write)
+def warm_up():
+    configure_mappers()
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    gc.freeze()
+
+def after_fork():
+    # اتصالات المجمع الموروثة من العملية الرئيسية لا تُستخدم في عمليتين: العامل يتركها
+    # دون إغلاقها (close=False) ويفتح اتصالاته الخاصة
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    tasks.start()
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     debug = os.environ.get('FLASK_DEBUG', 'True').lower() == 'true'
-    app.run(host='0.0.0.0', port=port, debug=debug)
\ No newline at end of file
+    create_app().run(host='0.0.0.0', port=port, debug=debug)
\ No newline at end of file
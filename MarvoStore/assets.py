@@ -0,0 +1,151 @@
+# تقديم الملفات الثابتة والصور المرفوعة: أسماء ملفات ببصمة المحتوى وتخزين دائم
+# في المتصفح، ETag قوي مع 304 وRange، ونسخ مضغوطة مسبقاً (gzip/brotli)، وتسليم
+# الملف للخادم الأمامي بدلاً من بثه من عامل بايثون
+#
+#   STATIC_SENDFILE        x-sendfile (Apache/lighttpd) أو x-accel (nginx)؛ فارغ للتقديم من بايثون
+#   STATIC_ACCEL_PREFIX    موقع nginx الداخلي المقابل لمجلد static (الافتراضي /_static/)
+#
+# مثال nginx:  location /_static/ { internal; alias /path/to/MarvoStore/static/; }
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+
+from flask import abort, request, send_file
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+HASH_LENGTH = 10
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.txt', '.html', '.map'}
+# الامتداد المضغوط وقيمة Content-Encoding بترتيب الأفضلية
+ENCODINGS = (('.br', 'br'), ('.gz', 'gzip'))
+
+_HASHED_NAME = re.compile(r'^(?P<stem>.+)\.(?P<digest>[0-9a-f]{%d})(?P<ext>\.[^./]+)$' % HASH_LENGTH)
+
+
+class StaticAssets:
+    def __init__(self, app=None):
+        self._hashes = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.static_folder = app.static_folder
+        self.sendfile = os.environ.get('STATIC_SENDFILE', '').lower()
+        self.accel_prefix = os.environ.get('STATIC_ACCEL_PREFIX', '/_static/')
+        if self.sendfile == 'x-sendfile':
+            app.config['USE_X_SENDFILE'] = True
+        app.url_defaults(self._hash_static_url)
+        app.view_functions['static'] = self.serve_static
+
+    def content_hash(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        key = (stat.st_mtime_ns, stat.st_size)
+        cached = self._hashes.get(path)
+        if cached and cached[0] == key:
+            return cached[1]
+        digest = hashlib.sha256()
+        with open(path, 'rb') as handle:
+            for chunk in iter(lambda: handle.read(1 << 16), b''):
+                digest.update(chunk)
+        value = digest.hexdigest()
+        self._hashes[path] = (key, value)
+        return value
+
+    def hashed_filename(self, filename):
+        path = safe_join(self.static_folder, filename)
+        digest = self.content_hash(path) if path else None
+        if not digest:
+            return filename
+        stem, ext = os.path.splitext(filename)
+        return f'{stem}.{digest[:HASH_LENGTH]}{ext}'
+
+    def _hash_static_url(self, endpoint, values):
+        if endpoint == 'static' and 'filename' in values:
+            values['filename'] = self.hashed_filename(values['filename'])
+
+    def serve_static(self, filename):
+        return self.send(self.static_folder, filename)
+
+    def send(self, directory, filename):
+        requested_digest = None
+        path = safe_join(directory, filename)
+        if path is None:
+            abort(404)
+        if not os.path.isfile(path):
+            match = _HASHED_NAME.match(filename)
+            if not match:
+                abort(404)
+            requested_digest = match.group('digest')
+            path = safe_join(directory, match.group('stem') + match.group('ext'))
+            if path is None or not os.path.isfile(path):
+                abort(404)
+
+        digest = self.content_hash(path)
+        # رابط ببصمة قديمة يحصل على المحتوى الحالي لكن بدون تخزين دائم
+        immutable = requested_digest is not None and digest.startswith(requested_digest)
+        mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+        served_path, encoding = path, None
+        if os.path.splitext(path)[1] in COMPRESSIBLE:
+            accepted = request.accept_encodings
+            for suffix, name in ENCODINGS:
+                candidate = path + suffix
+                if accepted[name] and os.path.isfile(candidate) \
+                        and os.path.getmtime(candidate) >= os.path.getmtime(path):
+                    served_path, encoding = candidate, name
+                    break
+
+        etag = f'{digest}-{encoding}' if encoding else digest
+        relative = os.path.relpath(os.path.abspath(served_path), self.static_folder).replace(os.sep, '/')
+        if self.sendfile == 'x-accel' and not relative.startswith('../'):
+            response = self.app.response_class(mimetype=mimetype)
+            response.headers['X-Accel-Redirect'] = self.accel_prefix + relative
+            response.set_etag(etag)
+            response.make_conditional(request)
+        else:
+            response = send_file(served_path, mimetype=mimetype, etag=etag, conditional=True)
+
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        if os.path.splitext(path)[1] in COMPRESSIBLE:
+            response.vary.add('Accept-Encoding')
+        if immutable:
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = IMMUTABLE_MAX_AGE
+            response.cache_control.immutable = True
+        else:
+            response.cache_control.no_cache = True
+        return response
+
+
+def compress_static(static_folder, level=9):
+    written = 0
+    for root, _, files in os.walk(static_folder):
+        for name in files:
+            path = os.path.join(root, name)
+            if os.path.splitext(name)[1] not in COMPRESSIBLE:
+                continue
+            with open(path, 'rb') as handle:
+                data = handle.read()
+            outputs = [('.gz', gzip.compress(data, compresslevel=level, mtime=0))]
+            if brotli is not None:
+                outputs.append(('.br', brotli.compress(data, quality=11)))
+            for suffix, compressed in outputs:
+                # لا فائدة من نسخة مضغوطة ليست أصغر من الأصل
+                if len(compressed) < len(data):
+                    with open(path + suffix, 'wb') as handle:
+                        handle.write(compressed)
+                    written += 1
+    return written
@@ -0,0 +1,125 @@
+"""Concurrent checkout benchmark: throughput and oversell check.
+
+Many buyers check out the same limited-stock product at once through the
+real /checkout route. The run reports throughput and latency and fails if
+more units were sold than were in stock.
+
+    cd MarvoStore && python benchmarks/checkout_concurrency.py --buyers 200 --stock 100
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--buyers', type=int, default=200)
+    parser.add_argument('--stock', type=int, default=100)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--lines', type=int, default=3, help='cart lines per buyer')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='marvo-bench-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ['PAGE_CACHE_DIR'] = os.path.join(workdir, 'page_cache')
+    os.chdir(workdir)
+    from app import create_app, db, Product, User, CartItem, OrderItem, sync_variants
+    app = create_app()
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.logger.disabled = True
+
+    with app.app_context():
+        hot = Product(name='hot', description='flash sale', price=100, category='shirts', stock=args.stock)
+        db.session.add(hot)
+        others = [Product(name=f'p{i}', description='filler', price=10, category='pants',
+                          stock=args.buyers * args.lines) for i in range(args.lines - 1)]
+        db.session.add_all(others)
+        db.session.flush()
+        sync_variants([{'id': product.id, 'sizes': [], 'colors': [], 'stock': product.stock}
+                       for product in [hot, *others]])
+        sessions = []
+        for i in range(args.buyers):
+            user = User(username=f'buyer{i}', email=f'buyer{i}@example.com',
+                        address='Cairo', phone='0100000000')
+            db.session.add(user)
+            db.session.flush()
+            session_id = f'user:{user.id}'
+            db.session.add(CartItem(session_id=session_id, product_id=hot.id, quantity=1))
+            for other in others:
+                db.session.add(CartItem(session_id=session_id, product_id=other.id, quantity=1))
+            sessions.append((user.id, session_id))
+        db.session.commit()
+        hot_id = hot.id
+
+    clients = []
+    for user_id, session_id in sessions:
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['_user_id'] = str(user_id)
+            sess['_fresh'] = True
+        clients.append(client)
+
+    barrier = threading.Barrier(min(args.threads, len(clients)))
+    latencies, outcomes = [], {'ordered': 0, 'out_of_stock': 0, 'busy': 0, 'error': 0}
+    lock = threading.Lock()
+
+    def checkout(client):
+        try:
+            barrier.wait(timeout=1)
+        except threading.BrokenBarrierError:
+            pass
+        started = time.perf_counter()
+        response = client.post('/checkout', data={'shipping_address': 'Cairo', 'phone': '0100000000'})
+        elapsed = time.perf_counter() - started
+        location = response.headers.get('Location', '')
+        if '/order_tracking/' in location:
+            outcome = 'ordered'
+        elif location.endswith('/cart'):
+            outcome = 'out_of_stock'
+        elif location.endswith('/checkout'):
+            outcome = 'busy'
+        else:
+            outcome = 'error'
+        with lock:
+            latencies.append(elapsed)
+            outcomes[outcome] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        list(pool.map(checkout, clients))
+    wall = time.perf_counter() - started
+
+    with app.app_context():
+        remaining = db.session.get(Product, hot_id).stock
+        sold = db.session.query(db.func.coalesce(db.func.sum(OrderItem.quantity), 0)) \
+            .filter(OrderItem.product_id == hot_id).scalar()
+
+    print(f'buyers={args.buyers} stock={args.stock} threads={args.threads} lines={args.lines}')
+    print(f'outcomes: {outcomes}')
+    print(f'throughput: {len(latencies) / wall:.1f} checkouts/s over {wall:.2f}s')
+    print(f'latency ms: p50={percentile(latencies, 50) * 1000:.1f} '
+          f'p95={percentile(latencies, 95) * 1000:.1f} '
+          f'p99={percentile(latencies, 99) * 1000:.1f} '
+          f'mean={statistics.mean(latencies) * 1000:.1f}')
+    print(f'hot product: sold={sold} remaining={remaining}')
+    oversold = remaining < 0 or sold + remaining != args.stock
+    print('oversell: ' + ('DETECTED' if oversold else 'none'))
+    return 1 if oversold else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
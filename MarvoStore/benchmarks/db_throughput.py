@@ -0,0 +1,121 @@
+"""SQLite read/write throughput before and after the db_config tuning.
+
+Runs the same mixed workload twice, on two scratch database files. The
+first run uses a plain SQLAlchemy engine with SQLite defaults (rollback
+journal, synchronous=FULL). The second uses the engine options and
+per-connection PRAGMAs from db_config. Writer threads insert products and
+commit one row at a time. Reader threads fetch catalog pages.
+
+    cd MarvoStore && python benchmarks/db_throughput.py --seconds 5 --readers 8 --writers 2
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from db_config import engine_options, install_sqlite_pragmas  # noqa: E402
+
+SCHEMA = """
+CREATE TABLE product (
+    id INTEGER PRIMARY KEY,
+    name VARCHAR(100) NOT NULL,
+    description TEXT NOT NULL,
+    price FLOAT NOT NULL,
+    category VARCHAR(50) NOT NULL,
+    stock INTEGER,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+
+def build_engine(path, tuned):
+    uri = f'sqlite:///{path}'
+    if not tuned:
+        return create_engine(uri, connect_args={'check_same_thread': False})
+    engine = create_engine(uri, **engine_options(uri))
+    install_sqlite_pragmas(engine)
+    return engine
+
+
+def run(engine, seconds, readers, writers, seed_rows):
+    with engine.begin() as conn:
+        conn.execute(text(SCHEMA))
+        conn.execute(text('CREATE INDEX ix_product_created_at_id ON product (created_at, id)'))
+        conn.execute(text(
+            "INSERT INTO product (name, description, price, category, stock) "
+            "VALUES (:n, 'seed', 10, 'shirts', 5)"), [{'n': f'seed{i}'} for i in range(seed_rows)])
+
+    counts = {'reads': 0, 'writes': 0, 'errors': 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def reader():
+        done = errors = 0
+        while time.perf_counter() < deadline:
+            try:
+                with engine.connect() as conn:
+                    conn.execute(text(
+                        'SELECT id, name, price FROM product '
+                        'ORDER BY created_at DESC, id DESC LIMIT 24')).all()
+                done += 1
+            except OperationalError:
+                errors += 1
+        with lock:
+            counts['reads'] += done
+            counts['errors'] += errors
+
+    def writer():
+        done = errors = 0
+        while time.perf_counter() < deadline:
+            try:
+                with engine.begin() as conn:
+                    conn.execute(text(
+                        "INSERT INTO product (name, description, price, category, stock) "
+                        "VALUES ('w', 'bench', 20, 'pants', 1)"))
+                done += 1
+            except OperationalError:
+                errors += 1
+        with lock:
+            counts['writes'] += done
+            counts['errors'] += errors
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    threads += [threading.Thread(target=writer) for _ in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    engine.dispose()
+    return {key: value / seconds if key != 'errors' else value for key, value in counts.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seed-rows', type=int, default=20000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='marvo-db-')
+    results = {}
+    for label, tuned in (('default', False), ('tuned', True)):
+        engine = build_engine(os.path.join(workdir, f'{label}.db'), tuned)
+        results[label] = run(engine, args.seconds, args.readers, args.writers, args.seed_rows)
+
+    print(f'readers={args.readers} writers={args.writers} seconds={args.seconds}')
+    print(f"{'':8} {'reads/s':>10} {'writes/s':>10} {'errors':>8}")
+    for label, result in results.items():
+        print(f"{label:8} {result['reads']:>10.0f} {result['writes']:>10.0f} {result['errors']:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""Order history benchmark: profile latency against customer lifetime.
+
+Users with growing numbers of past orders request the first and a deep
+page of /profile and /api/orders. With keyset pagination and the stored
+item counts, the latency and the number of queries should not depend on
+how many orders the user has placed.
+
+    cd MarvoStore && python benchmarks/order_history.py --orders 10 1000 5000
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--orders', type=int, nargs='+', default=[10, 1000, 5000])
+    parser.add_argument('--items', type=int, default=3, help='items per order')
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='marvo-bench-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ['PAGE_CACHE_DIR'] = os.path.join(workdir, 'page_cache')
+    os.environ.setdefault('TASK_WORKERS', '0')
+    os.chdir(workdir)
+    from sqlalchemy import event
+    from app import create_app, db, Product, User, Order, OrderItem
+    app = create_app()
+
+    app.logger.disabled = True
+    queries = [0]
+
+    with app.app_context():
+        product = Product(name='p', description='d', price=10, category='shirts', stock=0)
+        db.session.add(product)
+        db.session.flush()
+        users = []
+        start = datetime.utcnow() - timedelta(days=365)
+        for count in args.orders:
+            user = User(username=f'buyer{count}', email=f'buyer{count}@example.com')
+            db.session.add(user)
+            db.session.flush()
+            db.session.execute(db.insert(Order), [{
+                'user_id': user.id,
+                'order_number': f'B{user.id}-{i}',
+                'total_amount': 30.0,
+                'donation_amount': 0.0,
+                'status': 'delivered',
+                'item_count': args.items,
+                'created_at': start + timedelta(minutes=i),
+            } for i in range(count)])
+            order_ids = db.session.scalars(db.select(Order.id).where(Order.user_id == user.id)).all()
+            db.session.execute(db.insert(OrderItem), [{
+                'order_id': order_id, 'product_id': product.id, 'quantity': 1, 'price': 10.0,
+            } for order_id in order_ids for _ in range(args.items)])
+            users.append((count, user.id))
+        db.session.commit()
+        event.listen(db.engine, 'before_cursor_execute',
+                     lambda *a: queries.__setitem__(0, queries[0] + 1))
+
+    print(f'{"orders":>7} {"url":<22} {"p50 ms":>8} {"p95 ms":>8} {"queries":>8}')
+    for count, user_id in users:
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['_user_id'] = str(user_id)
+            sess['_fresh'] = True
+        deep = client.get('/api/orders').get_json()['next_cursor']
+        urls = ['/profile', '/api/orders']
+        if deep:
+            urls.append(f'/api/orders?after={deep}')
+        for url in urls:
+            timings = []
+            for _ in range(args.repeat):
+                queries[0] = 0
+                started = time.perf_counter()
+                response = client.get(url)
+                timings.append((time.perf_counter() - started) * 1000)
+                assert response.status_code == 200, response.status_code
+            timings.sort()
+            label = url if len(url) <= 22 else url[:19] + '...'
+            print(f'{count:>7} {label:<22} {statistics.median(timings):>8.2f} '
+                  f'{timings[int(len(timings) * 0.95) - 1]:>8.2f} {queries[0]:>8}')
+
+
+if __name__ == '__main__':
+    main()
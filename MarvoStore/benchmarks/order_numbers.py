@@ -0,0 +1,71 @@
+"""Order number generator benchmark: throughput and collision check.
+
+A generator is built once and then used after fork by several worker
+processes, as gunicorn --preload does, each with a few threads. Every
+issued number is checked for uniqueness and per-worker ordering.
+
+    cd MarvoStore && python benchmarks/order_numbers.py --workers 8 --count 50000
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from ids import OrderNumberGenerator  # noqa: E402
+
+generator = None
+
+
+def issue(args):
+    count, threads = args
+    per_thread = count // threads
+
+    def run(_):
+        return [generator.next_order_number() for _ in range(per_thread)]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        batches = list(pool.map(run, range(threads)))
+    elapsed = time.perf_counter() - started
+    ordered = all(batch == sorted(batch) for batch in batches)
+    return generator.worker_id, [n for batch in batches for n in batch], elapsed, ordered
+
+
+def main():
+    global generator
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--count', type=int, default=50000, help='numbers per worker')
+    args = parser.parse_args()
+
+    generator = OrderNumberGenerator(lock_dir=tempfile.mkdtemp(prefix='marvo-ids-'))
+    generator.next_order_number()  # اختيار رقم العامل في العملية الأم قبل fork
+
+    context = multiprocessing.get_context('fork')
+    started = time.perf_counter()
+    with context.Pool(args.workers) as pool:
+        results = pool.map(issue, [(args.count, args.threads)] * args.workers)
+    wall = time.perf_counter() - started
+
+    numbers = [n for _, batch, _, _ in results for n in batch]
+    workers = {worker_id for worker_id, _, _, _ in results}
+    duplicates = len(numbers) - len(set(numbers))
+    print(f'workers={args.workers} threads={args.threads} per_worker={args.count}')
+    print(f'distinct worker ids: {len(workers)}')
+    print(f'issued={len(numbers)} duplicates={duplicates} '
+          f'per-thread ordered={all(ordered for _, _, _, ordered in results)}')
+    print(f'throughput: {len(numbers) / wall:,.0f} numbers/s overall, '
+          f'{sum(len(b) / e for _, b, e, _ in results) / len(results):,.0f} per worker')
+    print(f'sample: {numbers[0]} .. {numbers[-1]}')
+    return 1 if duplicates or len(workers) != args.workers else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
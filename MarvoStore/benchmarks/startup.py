@@ -0,0 +1,325 @@
+"""Startup benchmark: cold start and per-worker memory, with and without preload.
+
+Seeds a scratch database with the load-testing suite's data, then measures
+in fresh interpreters (median of --repeat runs):
+
+    import           import app, which does no database I/O
+    create_app       the schema check against an up-to-date database
+    upgrade_schema   the full schema upgrade the old import ran on every boot
+    first request    GET / right after create_app()
+    total            interpreter start to first response, seen from outside
+
+Then it starts --workers workers twice, each serving the same --requests
+catalog, product and API pages. The first time they are forked from one
+process that imported the app, like gunicorn --preload. The second time they
+are independent interpreters, like gunicorn without preload. Memory comes
+from /proc/<pid>/smaps_rollup while all the workers are alive. RSS counts
+shared pages in full. PSS splits them among the processes sharing them. USS
+is what the worker alone holds. The total PSS, master included, is what the
+host pays. With --server gunicorn the same numbers come from real gunicorn
+workers started with gunicorn.conf.py.
+
+    cd MarvoStore && python benchmarks/startup.py
+    python benchmarks/startup.py --workers 8 --products 50000
+    python benchmarks/startup.py --server gunicorn
+
+Linux only: memory is read from /proc.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from suite import SECRET, git_revision, seed  # noqa: E402
+
+PATHS = ('/', '/?sort=rating', '/product/{id}', '/api/products', '/api/products/{id}')
+
+
+# --- أدوار العمليات الفرعية ---
+
+def serve(app, requests, products):
+    client = app.test_client()
+    for i in range(requests):
+        for path in PATHS:
+            client.get(path.format(id=i % products + 1))
+
+
+def run_seed(args):
+    from app import create_app, db
+    app = create_app()
+    app.logger.disabled = True
+    seed(app, db, args, random.Random(1))
+
+
+def run_coldstart(args):
+    started = time.perf_counter()
+    import app as module
+    imported = time.perf_counter()
+    app = module.create_app()
+    created = time.perf_counter()
+    app.logger.disabled = True
+    status = app.test_client().get('/').status_code
+    responded = time.perf_counter()
+    print('ready', flush=True)
+    with app.app_context():
+        module.upgrade_schema()
+    upgraded = time.perf_counter()
+    print(json.dumps({
+        'import': imported - started,
+        'create_app': created - imported,
+        'first_request': responded - created,
+        'upgrade_schema': upgraded - responded,
+        'status': status,
+    }))
+
+
+def run_worker(args):
+    from app import create_app
+    app = create_app()
+    app.logger.disabled = True
+    serve(app, args.requests, args.products)
+    print(os.getpid(), flush=True)
+    sys.stdin.read()
+
+
+def run_master(args):
+    from app import after_fork, create_app, warm_up
+    app = create_app()
+    app.logger.disabled = True
+    warm_up()
+    sys.stdout.flush()
+    children = []
+    for _ in range(args.workers):
+        pid = os.fork()
+        if pid == 0:
+            after_fork()
+            serve(app, args.requests, args.products)
+            # كتابة واحدة حتى لا تتداخل أسطر العمال في نفس الأنبوب
+            os.write(sys.stdout.fileno(), f'{os.getpid()}\n'.encode())
+            sys.stdin.read()
+            os._exit(0)
+        children.append(pid)
+    for pid in children:
+        os.waitpid(pid, 0)
+
+
+ROLES = {'seed': run_seed, 'coldstart': run_coldstart, 'worker': run_worker, 'master': run_master}
+
+
+# --- القياس ---
+
+def memory(pid):
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as handle:
+        for line in handle:
+            name, _, rest = line.partition(':')
+            fields = rest.split()
+            if len(fields) == 2 and fields[1] == 'kB':
+                values[name] = int(fields[0])
+    return {
+        'rss': values['Rss'] / 1024,
+        'pss': values['Pss'] / 1024,
+        'uss': (values['Private_Clean'] + values['Private_Dirty']) / 1024,
+    }
+
+
+def spawn(args, role, env, **kwargs):
+    command = [sys.executable, os.path.abspath(__file__), '--role', role, '--workers', str(args.workers),
+               '--requests', str(args.requests), '--products', str(args.products),
+               '--users', str(args.users), '--orders', str(args.orders), '--reviews', str(args.reviews)]
+    return subprocess.Popen(command, cwd=ROOT, env=env, text=True, **kwargs)
+
+
+def measure_coldstart(args, env):
+    runs = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        process = spawn(args, 'coldstart', env, stdout=subprocess.PIPE)
+        # الزمن الكلي حتى أول رد، قبل ترقية المخطط التي تُقاس بعده
+        process.stdout.readline()
+        total = time.perf_counter() - started
+        output, _ = process.communicate()
+        if process.returncode:
+            raise SystemExit('cold start run failed')
+        run = json.loads(output)
+        if run['status'] != 200:
+            raise SystemExit(f'cold start run failed: {run}')
+        run['total'] = total
+        runs.append(run)
+    return {name: statistics.median(run[name] for run in runs) * 1000
+            for name in ('import', 'create_app', 'upgrade_schema', 'first_request', 'total')}
+
+
+def summarize_workers(ready, pids, master_pid=None):
+    workers = [memory(pid) for pid in pids]
+    master = memory(master_pid) if master_pid else None
+    result = {
+        'ready_s': ready,
+        'workers': len(workers),
+        'worker_rss_mb': statistics.mean(worker['rss'] for worker in workers),
+        'worker_pss_mb': statistics.mean(worker['pss'] for worker in workers),
+        'worker_uss_mb': statistics.mean(worker['uss'] for worker in workers),
+        'master_pss_mb': master['pss'] if master else 0.0,
+    }
+    result['total_pss_mb'] = sum(worker['pss'] for worker in workers) + result['master_pss_mb']
+    return result
+
+
+def measure_forked(args, env, preload):
+    started = time.perf_counter()
+    if preload:
+        processes = [spawn(args, 'master', env, stdin=subprocess.PIPE, stdout=subprocess.PIPE)]
+        lines = [processes[0].stdout.readline() for _ in range(args.workers)]
+    else:
+        processes = [spawn(args, 'worker', env, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+                     for _ in range(args.workers)]
+        lines = [process.stdout.readline() for process in processes]
+    ready = time.perf_counter() - started
+    try:
+        if not all(line.strip().isdigit() for line in lines):
+            raise SystemExit(f'a worker failed to start: {lines}')
+        return summarize_workers(ready, [int(line) for line in lines],
+                                 processes[0].pid if preload else None)
+    finally:
+        for process in processes:
+            process.stdin.close()
+            process.wait()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def worker_pids(master_pid):
+    with open(f'/proc/{master_pid}/task/{master_pid}/children') as handle:
+        return [int(pid) for pid in handle.read().split()]
+
+
+def measure_gunicorn(args, env, preload):
+    port = free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py'),
+         '--workers', str(args.workers), '--bind', f'127.0.0.1:{port}', '--log-level', 'warning'],
+        cwd=ROOT, env={**env, 'GUNICORN_PRELOAD': '1' if preload else '0'})
+    try:
+        deadline = time.monotonic() + 120
+        while True:
+            if process.poll() is not None:
+                raise SystemExit(f'gunicorn exited with status {process.returncode}')
+            if time.monotonic() > deadline:
+                raise SystemExit('gunicorn did not answer within 120s')
+            try:
+                with urllib.request.urlopen(base_url + '/', timeout=5) as response:
+                    if response.status == 200:
+                        break
+            except (OSError, urllib.error.URLError):
+                time.sleep(0.05)
+        first_response = time.perf_counter() - started
+        # كل عامل يأخذ نصيبه تقريباً من الطلبات فتمتلئ ذاكرته المؤقتة كما في التشغيل الفعلي
+        for i in range(args.requests * args.workers):
+            for path in PATHS:
+                with urllib.request.urlopen(base_url + path.format(id=i % args.products + 1)) as response:
+                    response.read()
+        result = summarize_workers(first_response, worker_pids(process.pid), process.pid)
+        return result
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--role', choices=list(ROLES), help=argparse.SUPPRESS)
+    parser.add_argument('--server', choices=('fork', 'gunicorn'), default='fork')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=50, help='page rounds each worker serves before measuring')
+    parser.add_argument('--repeat', type=int, default=5, help='cold start runs (the median is reported)')
+    parser.add_argument('--products', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--orders', type=int, default=5000)
+    parser.add_argument('--reviews', type=int, default=5000)
+    parser.add_argument('--output', help='results file (default: benchmarks/results/<time>-<commit>-startup.json)')
+    args = parser.parse_args()
+    if args.role:
+        ROLES[args.role](args)
+        return 0
+    if not os.path.exists('/proc/self/smaps_rollup'):
+        parser.error('memory is read from /proc/<pid>/smaps_rollup (Linux 4.14+)')
+    if args.server == 'gunicorn' and importlib.util.find_spec('gunicorn') is None:
+        parser.error('gunicorn is not installed (pip install gunicorn)')
+
+    commit, dirty = git_revision()
+    started_at = datetime.now()
+    output = os.path.abspath(args.output or os.path.join(
+        ROOT, 'benchmarks', 'results', f'{started_at:%Y%m%d-%H%M%S}-{commit}{"-dirty" if dirty else ""}-startup.json'))
+    workdir = tempfile.mkdtemp(prefix='marvo-bench-')
+    env = {
+        **os.environ,
+        'DATABASE_URL': f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        'SESSION_SECRET': SECRET,
+        'TASK_WORKERS': '0',
+        'PAGE_CACHE_DIR': os.path.join(workdir, 'page_cache'),
+        'FLASK_DEBUG': 'false',
+    }
+
+    seeding = time.perf_counter()
+    if spawn(args, 'seed', env).wait():
+        raise SystemExit('seeding failed')
+    print(f'seeded {args.products} products, {args.users} users, {args.orders} orders, '
+          f'{args.reviews} reviews in {time.perf_counter() - seeding:.1f}s')
+
+    coldstart = measure_coldstart(args, env)
+    measure = measure_gunicorn if args.server == 'gunicorn' else measure_forked
+    workers = {'preload': measure(args, env, preload=True), 'no_preload': measure(args, env, preload=False)}
+
+    print(f'\ncold start, median of {args.repeat} (ms)')
+    for name, value in coldstart.items():
+        print(f'  {name:<16}{value:8.1f}')
+    print(f'\nserver={args.server} workers={args.workers} requests={args.requests} '
+          f'commit={commit}{"+" if dirty else ""}')
+    print(f'  {"":<12}{"ready s":>9}{"worker RSS":>12}{"worker PSS":>12}{"worker USS":>12}'
+          f'{"master PSS":>12}{"total PSS":>11}')
+    for name, result in workers.items():
+        print(f'  {name:<12}{result["ready_s"]:9.2f}{result["worker_rss_mb"]:12.1f}{result["worker_pss_mb"]:12.1f}'
+              f'{result["worker_uss_mb"]:12.1f}{result["master_pss_mb"]:12.1f}{result["total_pss_mb"]:11.1f}')
+
+    report = {
+        'meta': {
+            'commit': commit,
+            'dirty': dirty,
+            'started_at': started_at.isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'args': {key: value for key, value in vars(args).items() if key not in ('output', 'role')},
+        },
+        'coldstart_ms': coldstart,
+        'workers': workers,
+    }
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as handle:
+        json.dump(report, handle, indent=2, ensure_ascii=False)
+    print(f'\nresults written to {output}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,540 @@
+"""Load-testing suite: seeded store, real routes, comparable JSON results.
+
+Seeds a scratch database with configurable volumes of products (with size
+and colour variants), users, past orders and reviews. Then it drives the
+app either in-process through the Flask test client or over HTTP against a
+local gunicorn. Each scenario runs a fixed number of iterations spread over
+concurrent virtual users. Every virtual user is a logged-in customer with
+its own cookie jar and CSRF token:
+
+    browse       catalog pages (both sorts) and search
+    product      product detail pages
+    add_to_cart  POST /add_to_cart, then follow the redirect like a browser
+    cart         the cart page with a few lines in it
+    checkout     one item added (not timed), then POST /checkout
+    profile      profile with order history and points
+
+The timed request's latency gives p50/p95/p99. Throughput is completed
+iterations per second. The query count and the db/render/app split come
+from the Server-Timing header added by instrumentation.py. Results go to
+benchmarks/results/ as JSON. Pass --compare to diff against an earlier run.
+The exit status is 1 when p95 or throughput regress by more than
+--threshold percent, or when a scenario needs half a query more on average.
+
+    cd MarvoStore && python benchmarks/suite.py
+    python benchmarks/suite.py --server gunicorn --workers 4 --concurrency 16
+    python benchmarks/suite.py --compare benchmarks/results/<earlier>.json
+
+With the test client all virtual users share one interpreter, so the
+numbers show per-request cost and query counts more than parallelism. Use
+--server gunicorn for throughput under real concurrency.
+"""
+import argparse
+import importlib.util
+import itertools
+import json
+import os
+import platform
+import random
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from http.cookiejar import CookieJar
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PASSWORD = 'bench-password'
+SECRET = 'bench-secret'
+STOCK = 10 ** 6  # لا ينفد المخزون أثناء القياس
+CATEGORIES = ('shirts', 'pants', 'shoes', 'accessories')
+SIZES = ('S', 'M', 'L', 'XL')
+COLORS = ('أسود', 'أبيض', 'أزرق', 'أحمر')
+WORDS = ('قميص', 'قطن', 'صيفي', 'جينز', 'حذاء', 'جلد', 'رياضي', 'ساعة', 'شنطة', 'كلاسيك')
+BASKET_SIZE = 4  # منتجات كل مستخدم في add_to_cart، فتبقى السلة بضعة أسطر
+
+Response = namedtuple('Response', 'status location timing body elapsed')
+TIMING = re.compile(r'(\w+);dur=([\d.]+)(?:;desc="(\d+) queries")?')
+CSRF = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"|value="([^"]+)"[^>]*name="csrf_token"')
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+# --- البيانات ---
+
+def seed(app, db, args, rng):
+    from werkzeug.security import generate_password_hash
+    from app import Product, User, Order, OrderItem, Review, sync_variants
+    from catalog_io import chunked
+    from search import index_products
+
+    now = datetime.utcnow()
+    options = {}
+    products = []
+    for product_id in range(1, args.products + 1):
+        # ثلث المنتجات بلا خيارات، والباقي بأحجام وألوان
+        sizes = list(rng.sample(SIZES, rng.randint(2, 4))) if product_id % 3 else []
+        colors = list(rng.sample(COLORS, rng.randint(1, 3))) if product_id % 3 else []
+        options[product_id] = (sizes, colors)
+        products.append({
+            'id': product_id,
+            'name': f'{rng.choice(WORDS)} {rng.choice(WORDS)} {product_id}',
+            'description': ' '.join(rng.choices(WORDS, k=12)),
+            'price': round(rng.uniform(50, 1500), 2),
+            'category': rng.choice(CATEGORIES),
+            'stock': STOCK,
+            'size_options': json.dumps(sizes, ensure_ascii=False),
+            'color_options': json.dumps(colors, ensure_ascii=False),
+            'created_at': now - timedelta(minutes=product_id),
+        })
+    password_hash = generate_password_hash(PASSWORD)
+    users = [{
+        'id': user_id,
+        'username': f'bench{user_id}',
+        'email': f'bench{user_id}@example.com',
+        'password_hash': password_hash,
+        'first_name': 'Bench',
+        'last_name': str(user_id),
+        'phone': '01000000000',
+        'address': 'Cairo',
+        'city': 'Cairo',
+        'governorate': 'cairo',
+        'referral_code': f'B{user_id:08d}',
+        'created_at': now - timedelta(days=30),
+    } for user_id in range(1, args.users + 1)]
+
+    with app.app_context():
+        for chunk in chunked(products, 1000):
+            db.session.execute(db.insert(Product), chunk)
+            sync_variants([{'id': row['id'], 'sizes': options[row['id']][0], 'colors': options[row['id']][1],
+                            'stock': STOCK} for row in chunk])
+            index_products(db.session, chunk)
+        for chunk in chunked(users, 1000):
+            db.session.execute(db.insert(User), chunk)
+
+        orders, items = [], []
+        for order_id in range(1, args.orders + 1):
+            lines = [(rng.randint(1, args.products), rng.randint(1, 3)) for _ in range(rng.randint(1, 4))]
+            prices = [(product_id, quantity, products[product_id - 1]['price']) for product_id, quantity in lines]
+            orders.append({
+                'id': order_id,
+                'user_id': rng.randint(1, args.users),
+                'order_number': f'BENCH{order_id:08d}',
+                'total_amount': sum(quantity * price for _, quantity, price in prices),
+                'donation_amount': 0.0,
+                'status': rng.choice(('pending', 'confirmed', 'shipped', 'delivered')),
+                'shipping_address': 'Cairo',
+                'phone': '01000000000',
+                'item_count': len(lines),
+                'created_at': now - timedelta(minutes=args.orders - order_id),
+            })
+            items.extend({'order_id': order_id, 'product_id': product_id, 'quantity': quantity, 'price': price}
+                         for product_id, quantity, price in prices)
+        for chunk in chunked(orders, 1000):
+            db.session.execute(db.insert(Order), chunk)
+        for chunk in chunked(items, 1000):
+            db.session.execute(db.insert(OrderItem), chunk)
+
+        pairs = set()
+        wanted = min(args.reviews, args.users * args.products)
+        while len(pairs) < wanted:
+            pairs.add((rng.randint(1, args.users), rng.randint(1, args.products)))
+        reviews = [{'user_id': user_id, 'product_id': product_id, 'rating': rng.randint(1, 5),
+                    'comment': ' '.join(rng.choices(WORDS, k=8))} for user_id, product_id in sorted(pairs)]
+        for chunk in chunked(reviews, 1000):
+            db.session.execute(db.insert(Review), chunk)
+        db.session.commit()
+
+    result = app.test_cli_runner().invoke(args=['rebuild-ratings'])
+    if result.exit_code:
+        raise SystemExit(f'rebuild-ratings failed: {result.output}')
+    return options
+
+
+# --- العملاء ---
+
+class ClientSession:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        started = time.perf_counter()
+        response = self.client.open(path, method=method, data=data)
+        body = response.get_data(as_text=True)
+        elapsed = time.perf_counter() - started
+        return Response(response.status_code, response.headers.get('Location', ''),
+                        response.headers.get('Server-Timing', ''), body, elapsed)
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HTTPSession:
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()), _NoRedirect)
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        request = urllib.request.Request(self.base_url + path, data=body, method=method)
+        started = time.perf_counter()
+        try:
+            with self.opener.open(request, timeout=60) as response:
+                status, headers, content = response.status, response.headers, response.read()
+        except urllib.error.HTTPError as e:
+            status, headers, content = e.code, e.headers, e.read()
+        elapsed = time.perf_counter() - started
+        return Response(status, headers.get('Location', ''), headers.get('Server-Timing', ''),
+                        content.decode('utf-8', 'replace'), elapsed)
+
+
+class GunicornServer:
+    def __init__(self, workers, port, env):
+        self.port = port or self._free_port()
+        self.base_url = f'http://127.0.0.1:{self.port}'
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--bind', f'127.0.0.1:{self.port}',
+             '--log-level', 'warning', 'app:create_app()'],
+            cwd=ROOT, env={**os.environ, **env})
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise SystemExit(f'gunicorn exited with status {self.process.returncode}')
+            try:
+                with socket.create_connection(('127.0.0.1', self.port), timeout=1):
+                    return
+            except OSError:
+                time.sleep(0.2)
+        self.stop()
+        raise SystemExit('gunicorn did not start within 60s')
+
+    @staticmethod
+    def _free_port():
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            return sock.getsockname()[1]
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+class VirtualUser:
+    def __init__(self, session, user_id, options, seed):
+        self.session = session
+        self.user_id = user_id
+        self.rng = random.Random(seed)
+        self.options = options
+        self.csrf = None
+        products = self.rng.sample(sorted(options), min(BASKET_SIZE, len(options)))
+        self.basket = [(product_id, self._pick(product_id)) for product_id in products]
+
+    def _pick(self, product_id):
+        sizes, colors = self.options[product_id]
+        return (self.rng.choice(sizes) if sizes else '', self.rng.choice(colors) if colors else '')
+
+    def get(self, path):
+        return self.session.request('GET', path)
+
+    def post(self, path, data):
+        return self.session.request('POST', path, {'csrf_token': self.csrf, **data})
+
+    def follow(self, response):
+        # مثل المتصفح: صفحة التحويل تعرض رسائل flash فلا تتراكم في الجلسة
+        if 300 <= response.status < 400 and response.location:
+            self.get(urllib.parse.urlsplit(response.location)._replace(scheme='', netloc='').geturl())
+
+    def login(self):
+        page = self.get('/login')
+        match = CSRF.search(page.body)
+        if match is None:
+            raise SystemExit('no csrf_token on /login')
+        self.csrf = match.group(1) or match.group(2)
+        response = self.post('/login', {'email': f'bench{self.user_id}@example.com', 'password': PASSWORD})
+        if response.status != 302:
+            raise SystemExit(f'login failed for bench{self.user_id}: HTTP {response.status}')
+        self.follow(response)
+
+    def add_item(self):
+        product_id, (size, color) = self.rng.choice(self.basket)
+        return self.post('/add_to_cart', {'product_id': product_id, 'quantity': 1, 'size': size, 'color': color})
+
+
+# --- السيناريوهات: كل دالة تعيد الطلب المقاس، والتحقق يعيد True إن نجح ---
+
+def browse(vu):
+    roll = vu.rng.random()
+    if roll < 0.5:
+        return vu.get('/')
+    if roll < 0.75:
+        return vu.get('/?sort=rating')
+    return vu.get('/search?' + urllib.parse.urlencode({'query': vu.rng.choice(WORDS)}))
+
+
+def product(vu):
+    return vu.get(f'/product/{vu.rng.randint(1, len(vu.options))}')
+
+
+def add_to_cart(vu):
+    response = vu.add_item()
+    vu.follow(response)
+    return response
+
+
+def cart(vu):
+    return vu.get('/cart')
+
+
+def checkout(vu):
+    vu.follow(vu.add_item())
+    response = vu.post('/checkout', {'shipping_address': 'Cairo', 'phone': '01000000000'})
+    vu.follow(response)
+    return response
+
+
+def profile(vu):
+    return vu.get('/profile')
+
+
+def redirects_to(fragment):
+    return lambda response: response.status == 302 and fragment in response.location
+
+
+def is_ok(response):
+    return response.status == 200
+
+
+SCENARIOS = {
+    'browse': (browse, is_ok),
+    'product': (product, is_ok),
+    'add_to_cart': (add_to_cart, redirects_to('/cart')),
+    'cart': (cart, is_ok),
+    'checkout': (checkout, redirects_to('/order_tracking/')),
+    'profile': (profile, is_ok),
+}
+
+
+def run_scenario(vus, name, iterations):
+    scenario, check = SCENARIOS[name]
+    counter = itertools.count()
+
+    def worker(vu):
+        samples = []
+        while next(counter) < iterations:
+            response = scenario(vu)
+            timing = {metric: (float(duration), queries) for metric, duration, queries
+                      in TIMING.findall(response.timing)}
+            samples.append((response.elapsed, check(response), timing))
+        return samples
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(vus)) as pool:
+        samples = [sample for result in pool.map(worker, vus) for sample in result]
+    wall = time.perf_counter() - started
+    return samples, wall
+
+
+def summarize(samples, wall):
+    latencies = [elapsed * 1000 for elapsed, _, _ in samples]
+    timed = [timing for _, _, timing in samples if 'db' in timing]
+
+    def mean_of(metric):
+        return round(statistics.mean(timing[metric][0] for timing in timed), 2) if timed else None
+
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for _, ok, _ in samples if not ok),
+        'throughput_per_s': round(len(samples) / wall, 1),
+        'latency_ms': {
+            'p50': round(percentile(latencies, 50), 2),
+            'p95': round(percentile(latencies, 95), 2),
+            'p99': round(percentile(latencies, 99), 2),
+            'mean': round(statistics.mean(latencies), 2),
+            'max': round(max(latencies), 2),
+        },
+        'queries_per_request': round(statistics.mean(int(timing['db'][1] or 0) for timing in timed), 2)
+        if timed else None,
+        'db_ms': mean_of('db'),
+        'render_ms': mean_of('render'),
+        'app_ms': mean_of('app'),
+    }
+
+
+# --- النتائج والمقارنة ---
+
+def git_revision():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                                    capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', False
+    return commit, dirty
+
+
+def print_results(results):
+    print(f'{"scenario":<12} {"reqs":>6} {"err":>4} {"per s":>8} {"p50 ms":>8} {"p95 ms":>8} '
+          f'{"p99 ms":>8} {"queries":>8} {"db ms":>7} {"tpl ms":>7} {"app ms":>7}')
+    for name, result in results.items():
+        latency = result['latency_ms']
+        print(f'{name:<12} {result["requests"]:>6} {result["errors"]:>4} {result["throughput_per_s"]:>8} '
+              f'{latency["p50"]:>8} {latency["p95"]:>8} {latency["p99"]:>8} '
+              f'{result["queries_per_request"]!s:>8} {result["db_ms"]!s:>7} '
+              f'{result["render_ms"]!s:>7} {result["app_ms"]!s:>7}')
+
+
+def compare(baseline, results, threshold):
+    print(f'\ncompared with {baseline["meta"]["commit"]} ({baseline["meta"]["started_at"]}):')
+    regressions = []
+    for name, result in results.items():
+        before = baseline['scenarios'].get(name)
+        if before is None:
+            continue
+        changes = []
+        for label, old, new, worse_if_higher in (
+            ('p50', before['latency_ms']['p50'], result['latency_ms']['p50'], True),
+            ('p95', before['latency_ms']['p95'], result['latency_ms']['p95'], True),
+            ('p99', before['latency_ms']['p99'], result['latency_ms']['p99'], True),
+            ('per s', before['throughput_per_s'], result['throughput_per_s'], False),
+        ):
+            delta = (new - old) / old * 100 if old else 0.0
+            changes.append(f'{label} {old}→{new} ({delta:+.0f}%)')
+            if label in ('p95', 'per s') and (delta if worse_if_higher else -delta) > threshold:
+                regressions.append(f'{name} {label} {delta:+.0f}%')
+        old_queries, new_queries = before.get('queries_per_request'), result['queries_per_request']
+        if old_queries is not None and new_queries is not None:
+            changes.append(f'queries {old_queries}→{new_queries}')
+            # المتوسط يتذبذب قليلاً مع نسبة إصابة الذاكرة المؤقتة
+            if new_queries - old_queries >= 0.5:
+                regressions.append(f'{name} queries {old_queries}→{new_queries}')
+        print(f'  {name:<12} ' + ', '.join(changes))
+    if regressions:
+        print('regressions: ' + '; '.join(regressions))
+    else:
+        print(f'no regression beyond {threshold}%')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--orders', type=int, default=5000)
+    parser.add_argument('--reviews', type=int, default=5000)
+    parser.add_argument('--server', choices=('client', 'gunicorn'), default='client')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn worker processes')
+    parser.add_argument('--port', type=int, default=0, help='gunicorn port (default: a free one)')
+    parser.add_argument('--concurrency', type=int, default=8, help='virtual users')
+    parser.add_argument('--requests', type=int, default=400, help='timed iterations per scenario')
+    parser.add_argument('--warmup', type=int, default=40, help='untimed iterations per scenario')
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='results file (default: benchmarks/results/<time>-<commit>-<server>.json)')
+    parser.add_argument('--compare', help='earlier results file to diff against')
+    parser.add_argument('--threshold', type=float, default=10, help='allowed p95/throughput change in percent')
+    args = parser.parse_args()
+    if args.server == 'gunicorn' and importlib.util.find_spec('gunicorn') is None:
+        parser.error('gunicorn is not installed (pip install gunicorn)')
+    if args.concurrency > args.users:
+        parser.error('--concurrency cannot exceed --users: every virtual user logs in as its own customer')
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as handle:
+            baseline = json.load(handle)
+    commit, dirty = git_revision()
+    started_at = datetime.now()
+    output = os.path.abspath(args.output or os.path.join(
+        ROOT, 'benchmarks', 'results',
+        f'{started_at:%Y%m%d-%H%M%S}-{commit}{"-dirty" if dirty else ""}-{args.server}.json'))
+
+    workdir = tempfile.mkdtemp(prefix='marvo-bench-')
+    env = {
+        'DATABASE_URL': f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        'SESSION_SECRET': SECRET,
+        'TASK_WORKERS': os.environ.get('TASK_WORKERS', '0'),
+        'PAGE_CACHE_DIR': os.environ.get('PAGE_CACHE_DIR') or os.path.join(workdir, 'page_cache'),
+        'FLASK_DEBUG': 'false',
+    }
+    os.environ.update(env)
+    os.chdir(workdir)
+    from app import create_app, db
+    app = create_app()
+
+    app.logger.disabled = True
+    rng = random.Random(args.seed)
+    seeding = time.perf_counter()
+    options = seed(app, db, args, rng)
+    print(f'seeded {args.products} products, {args.users} users, {args.orders} orders, '
+          f'{args.reviews} reviews in {time.perf_counter() - seeding:.1f}s')
+
+    server = None
+    try:
+        if args.server == 'gunicorn':
+            server = GunicornServer(args.workers, args.port, env)
+            new_session = lambda: HTTPSession(server.base_url)  # noqa: E731
+        else:
+            new_session = lambda: ClientSession(app)  # noqa: E731
+        user_ids = rng.sample(range(1, args.users + 1), args.concurrency)
+        vus = [VirtualUser(new_session(), user_id, options, args.seed * 1000 + user_id) for user_id in user_ids]
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(VirtualUser.login, vus))
+
+        results = {}
+        for name in args.scenarios:
+            if args.warmup:
+                run_scenario(vus, name, args.warmup)
+            samples, wall = run_scenario(vus, name, args.requests)
+            results[name] = summarize(samples, wall)
+    finally:
+        if server is not None:
+            server.stop()
+
+    print(f'\nserver={args.server}' + (f' workers={args.workers}' if server else '') +
+          f' concurrency={args.concurrency} requests={args.requests} commit={commit}{"+" if dirty else ""}')
+    print_results(results)
+
+    report = {
+        'meta': {
+            'commit': commit,
+            'dirty': dirty,
+            'started_at': started_at.isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'args': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        },
+        'scenarios': results,
+    }
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as handle:
+        json.dump(report, handle, indent=2, ensure_ascii=False)
+    print(f'\nresults written to {output}')
+
+    failed = any(result['errors'] for result in results.values())
+    if baseline is not None and compare(baseline, results, args.threshold):
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,204 @@
+# ذاكرة مؤقتة للأجزاء المعروضة (HTML) مع إبطال بأرقام الإصدارات
+#
+# LRUCache داخل العملية مع مدة صلاحية، وFileCache على القرص يتشاركها كل عمال
+# gunicorn. المفاتيح تتضمن إصدار الكتالوج أو المنتج، فالإبطال يتم بتغيير الإصدار
+# فقط وتنتهي المدخلات القديمة وحدها. الإصدارات في مجلد فرعي على القرص دائماً حتى
+# يرى كل العمال الإبطال فوراً، والمدخلات المنتهية تُحذف دورياً مع حد أقصى لعددها.
+#
+#   PAGE_CACHE_TTL        ثواني صلاحية المدخل (الافتراضي 300، و0 لتعطيل الذاكرة المؤقتة)
+#   PAGE_CACHE_SIZE       أقصى عدد مدخلات داخل العملية (الافتراضي 1024)
+#   PAGE_CACHE_DIR        المجلد المشترك بين العمال (الافتراضي instance/page_cache/<قاعدة البيانات>)
+#   PAGE_CACHE_DIR_SIZE   أقصى عدد ملفات في المجلد المشترك (الافتراضي 10000)
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+class LRUCache:
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (time.monotonic() + (ttl or self.ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class FileCache:
+    def __init__(self, directory, ttl=300, maxsize=None):
+        self.directory = directory
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as handle:
+                expires, value = pickle.load(handle)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if expires < time.time():
+            return None
+        return value
+
+    def set(self, key, value, ttl=None):
+        # كتابة ذرية: ملف مؤقت ثم os.replace حتى لا يقرأ عامل آخر ملفاً ناقصاً
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'wb') as handle:
+            pickle.dump((time.time() + (ttl or self.ttl), value), handle)
+        os.replace(tmp_path, self._path(key))
+        if self.maxsize:
+            self._writes += 1
+            if self._writes >= max(self.maxsize // 10, 1):
+                self._writes = 0
+                self.prune()
+
+    def prune(self):
+        # حذف المنتهي (وقت التعديل أقدم من المدة) ثم الأقدم حتى 90% من الحد الأقصى
+        now = time.time()
+        entries = []
+        for entry in os.scandir(self.directory):
+            try:
+                if not entry.is_file():
+                    continue
+                modified = entry.stat().st_mtime
+                if modified + self.ttl < now:
+                    os.remove(entry.path)
+                else:
+                    entries.append((modified, entry.path))
+            except OSError:
+                pass
+        if self.maxsize and len(entries) > self.maxsize:
+            entries.sort()
+            for _, path in entries[:len(entries) - self.maxsize * 9 // 10]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+
+class FragmentCache:
+    def __init__(self, local, shared=None, enabled=True, versions=None):
+        self.local = local
+        self.shared = shared
+        self.enabled = enabled
+        # الإصدارات في مخزن منفصل لا يحذف منه حد الحجم؛ عددها بعدد المنتجات فقط
+        self.versions = versions if versions is not None else shared
+        self._versions = {}
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        value = self.local.get(key)
+        if value is None and self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                self.local.set(key, value)
+        return value
+
+    def set(self, key, value):
+        if not self.enabled:
+            return
+        self.local.set(key, value)
+        if self.shared is not None:
+            self.shared.set(key, value)
+
+    # الإصدارات لا تنتهي صلاحيتها؛ مع مجلد مشترك تُحفظ فيه حتى يراها كل العمال.
+    # مع كل إصدار وقت إنشائه (ثواني epoch) لترويسة Last-Modified
+    @property
+    def versions_shared(self):
+        # بدون مخزن مشترك لكل عامل إصداراته الخاصة: لا تصلح ETag ولا أساساً لرد 304،
+        # فقد لا يرى هذا العامل إبطالاً تم في غيره
+        return self.versions is not None
+
+    def version(self, name):
+        return self._stamp(name)[0]
+
+    def modified(self, name):
+        return self._stamp(name)[1]
+
+    def _stamp(self, name):
+        if self.versions is not None:
+            stamp = self.versions.get(f'version:{name}')
+            # إصدار قديم محفوظ بدون وقت يُستبدل بإصدار جديد مرة واحدة
+            if not isinstance(stamp, tuple):
+                stamp = self._set_stamp(name)
+            return stamp
+        stamp = self._versions.get(name)
+        if stamp is None:
+            stamp = self._set_stamp(name)
+        return stamp
+
+    def bump(self, name):
+        return self._set_stamp(name)[0]
+
+    def _set_stamp(self, name):
+        stamp = (uuid.uuid4().hex, time.time())
+        if self.versions is not None:
+            self.versions.set(f'version:{name}', stamp, ttl=10 * 365 * 24 * 3600)
+        else:
+            self._versions[name] = stamp
+        return stamp
+
+    def cached(self, key, render):
+        value = self.get(key)
+        if value is None:
+            value = render()
+            self.set(key, value)
+        return value
+
+
+def from_env(default_directory):
+    ttl = int(os.environ.get('PAGE_CACHE_TTL', 300))
+    local = LRUCache(maxsize=int(os.environ.get('PAGE_CACHE_SIZE', 1024)), ttl=ttl or 1)
+    directory = os.environ.get('PAGE_CACHE_DIR') or default_directory
+    shared = FileCache(directory, ttl=ttl or 1, maxsize=int(os.environ.get('PAGE_CACHE_DIR_SIZE', 10000)))
+    versions = FileCache(os.path.join(directory, 'versions'))
+    return FragmentCache(local, shared, enabled=ttl > 0, versions=versions)
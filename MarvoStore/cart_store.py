@@ -0,0 +1,230 @@
+# تخزين سلة التسوق: جدول CartItem في قاعدة البيانات، أو hash لكل سلة في Redis
+# (أو بديل محلي داخل العملية بنفس الأوامر) مع انتهاء صلاحية تلقائي للسلال المهجورة
+#
+#   CART_BACKEND     sql (الافتراضي) أو redis أو memory
+#   REDIS_URL        عنوان Redis عند CART_BACKEND=redis (يتطلب حزمة redis)
+#   CART_TTL_DAYS    أيام بقاء السلة بدون نشاط (الافتراضي 30)
+import base64
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+
+class CartLine:
+    __slots__ = ('id', 'product_id', 'quantity', 'size', 'color', 'product', 'line_total')
+
+    def __init__(self, id, product_id, quantity, size=None, color=None):
+        self.id = id
+        self.product_id = product_id
+        self.quantity = quantity
+        self.size = size
+        self.color = color
+        self.product = None
+        self.line_total = 0
+
+
+class SQLCartStore:
+    # الحذف عند إتمام الطلب يتم داخل معاملة الطلب نفسها
+    transactional = True
+
+    def __init__(self, db, model, ttl_seconds):
+        self.db = db
+        self.model = model
+        self.ttl = ttl_seconds
+
+    def _query(self, cart_id):
+        return self.model.query.filter_by(session_id=cart_id)
+
+    def get_lines(self, cart_id):
+        return (self._query(cart_id)
+                .options(self.db.joinedload(self.model.product))
+                .order_by(self.model.added_at, self.model.id)
+                .all())
+
+    def quantity(self, cart_id, product_id, size=None, color=None):
+        return self.db.session.query(self.model.quantity).filter_by(
+            session_id=cart_id, product_id=product_id, size=size, color=color).scalar() or 0
+
+    def add(self, cart_id, product_id, quantity, size=None, color=None):
+        item = self._query(cart_id).filter_by(product_id=product_id, size=size, color=color).first()
+        if item:
+            # زيادة ذرية في قاعدة البيانات بدلاً من قراءة ثم كتابة
+            item.quantity = self.model.quantity + quantity
+        else:
+            item = self.model()
+            item.session_id = cart_id
+            item.product_id = product_id
+            item.quantity = quantity
+            item.size = size
+            item.color = color
+            self.db.session.add(item)
+        self.db.session.commit()
+
+    def remove(self, cart_id, line_id):
+        try:
+            line_id = int(line_id)
+        except (TypeError, ValueError):
+            return False
+        removed = self._query(cart_id).filter_by(id=line_id).delete(synchronize_session=False)
+        self.db.session.commit()
+        return bool(removed)
+
+    def remove_lines(self, cart_id, lines):
+        # بدون commit: المستدعي يملك المعاملة
+        self.db.session.execute(
+            self.db.delete(self.model)
+            .where(self.model.session_id == cart_id,
+                   self.model.id.in_([line.id for line in lines]))
+            .execution_options(synchronize_session=False))
+
+    def merge(self, source_id, target_id):
+        for item in self._query(source_id).all():
+            existing = self._query(target_id).filter_by(
+                product_id=item.product_id, size=item.size, color=item.color).first()
+            if existing:
+                existing.quantity = self.model.quantity + item.quantity
+                self.db.session.delete(item)
+            else:
+                item.session_id = target_id
+        self.db.session.commit()
+
+    def purge_expired(self):
+        cutoff = datetime.utcnow() - timedelta(seconds=self.ttl)
+        removed = self.model.query.filter(self.model.added_at < cutoff).delete(synchronize_session=False)
+        self.db.session.commit()
+        return removed
+
+
+class HashCartStore:
+    # عنصر لكل (منتج، مقاس، لون) داخل hash واحد للسلة؛ القيمة هي الكمية
+    transactional = False
+
+    def __init__(self, client, ttl_seconds, prefix='cart:'):
+        self.client = client
+        self.ttl = ttl_seconds
+        self.prefix = prefix
+
+    def _key(self, cart_id):
+        return f'{self.prefix}{cart_id}'
+
+    @staticmethod
+    def encode_field(product_id, size, color):
+        raw = json.dumps([product_id, size, color], ensure_ascii=False).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+    @staticmethod
+    def decode_field(field):
+        if isinstance(field, bytes):
+            field = field.decode()
+        return json.loads(base64.urlsafe_b64decode(field + '=' * (-len(field) % 4)))
+
+    def get_lines(self, cart_id):
+        key = self._key(cart_id)
+        entries = self.client.hgetall(key)
+        if entries:
+            self.client.expire(key, self.ttl)
+        lines = []
+        for field, quantity in entries.items():
+            try:
+                product_id, size, color = self.decode_field(field)
+            except ValueError:
+                continue
+            field = field.decode() if isinstance(field, bytes) else field
+            lines.append(CartLine(field, product_id, int(quantity), size, color))
+        return lines
+
+    def quantity(self, cart_id, product_id, size=None, color=None):
+        value = self.client.hget(self._key(cart_id), self.encode_field(product_id, size, color))
+        return int(value) if value else 0
+
+    def add(self, cart_id, product_id, quantity, size=None, color=None):
+        key = self._key(cart_id)
+        self.client.hincrby(key, self.encode_field(product_id, size, color), quantity)
+        self.client.expire(key, self.ttl)
+
+    def remove(self, cart_id, line_id):
+        return bool(self.client.hdel(self._key(cart_id), line_id))
+
+    def remove_lines(self, cart_id, lines):
+        if lines:
+            self.client.hdel(self._key(cart_id), *[line.id for line in lines])
+
+    def merge(self, source_id, target_id):
+        source = self._key(source_id)
+        target = self._key(target_id)
+        for field, quantity in self.client.hgetall(source).items():
+            self.client.hincrby(target, field, int(quantity))
+        self.client.delete(source)
+        self.client.expire(target, self.ttl)
+
+    def purge_expired(self):
+        # Redis يحذف المفاتيح المنتهية بنفسه
+        return 0
+
+
+# بديل داخل العملية لأوامر Redis التي تستخدمها HashCartStore (للتطوير وعامل واحد)
+class LocalRedis:
+    def __init__(self):
+        self._data = {}
+        self._expires = {}
+        self._lock = threading.Lock()
+
+    def _hash(self, key, create=False):
+        expires = self._expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        if create:
+            return self._data.setdefault(key, {})
+        return self._data.get(key, {})
+
+    def hgetall(self, key):
+        with self._lock:
+            return dict(self._hash(key))
+
+    def hget(self, key, field):
+        with self._lock:
+            return self._hash(key).get(field)
+
+    def hincrby(self, key, field, amount=1):
+        with self._lock:
+            values = self._hash(key, create=True)
+            values[field] = int(values.get(field, 0)) + amount
+            return values[field]
+
+    def hdel(self, key, *fields):
+        with self._lock:
+            values = self._hash(key)
+            removed = sum(1 for field in fields if values.pop(field, None) is not None)
+            if not values:
+                self._data.pop(key, None)
+                self._expires.pop(key, None)
+            return removed
+
+    def delete(self, *keys):
+        with self._lock:
+            removed = 0
+            for key in keys:
+                removed += self._data.pop(key, None) is not None
+                self._expires.pop(key, None)
+            return removed
+
+    def expire(self, key, seconds):
+        with self._lock:
+            if key not in self._data:
+                return False
+            self._expires[key] = time.monotonic() + seconds
+            return True
+
+
+def from_env(db, model):
+    backend = os.environ.get('CART_BACKEND', 'sql').lower()
+    ttl = int(os.environ.get('CART_TTL_DAYS', 30)) * 24 * 3600
+    if backend == 'redis':
+        import redis
+        return HashCartStore(redis.Redis.from_url(os.environ.get('REDIS_URL', 'redis://localhost:6379/0')), ttl)
+    if backend == 'memory':
+        return HashCartStore(LocalRedis(), ttl)
+    return SQLCartStore(db, model, ttl)
@@ -0,0 +1,192 @@
+# استيراد وتصدير المنتجات بصيغة CSV أو JSONL كتدفق: القراءة والكتابة على دفعات
+# فلا يُحمل الملف أو الجدول كاملاً في الذاكرة، وجلب الصور بالتوازي.
+# روابط الصور تُجلب من عناوين عامة فقط (لا شبكة داخلية ولا loopback ولا link-local)
+# مع حد للحجم ومهلة كلية للتحميل.
+#
+#   IMPORT_BATCH_SIZE      عدد الصفوف في كل معاملة (الافتراضي 1000)
+#   IMPORT_IMAGE_WORKERS   خيوط جلب الصور أثناء الاستيراد (الافتراضي 8)
+#   IMPORT_IMAGE_TIMEOUT   أقصى ثواني لتحميل صورة من رابط (الافتراضي 15)
+import codecs
+import csv
+import http.client
+import io
+import ipaddress
+import json
+import os
+import ssl
+import time
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from images import upload_path
+
+
+EXPORT_FIELDS = ('id', 'name', 'description', 'price', 'category', 'stock', 'sizes', 'colors', 'image')
+PIL_EXTENSIONS = {'PNG': 'png', 'JPEG': 'jpg', 'GIF': 'gif', 'WEBP': 'webp'}
+
+
+class RowError(Exception):
+    pass
+
+
+def detect_format(filename):
+    return 'jsonl' if filename.lower().endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+
+def read_rows(stream, fmt):
+    # (رقم السطر، الصف) لكل صف من ملف ثنائي؛ الصف None إن تعذرت قراءته
+    stream = codecs.iterdecode(stream, 'utf-8-sig')
+    if fmt == 'jsonl':
+        for line_number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield line_number, row if isinstance(row, dict) else None
+    else:
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def split_options(value):
+    # خيارات بلا فراغات ولا تكرار وبترتيب ورودها: "S, S,M," -> ['S', 'M']
+    items = value if isinstance(value, list) else (value or '').split(',')
+    return list(dict.fromkeys(str(item).strip() for item in items if str(item).strip()))
+
+
+class _PublicOnly:
+    # الفحص على عنوان الاتصال الفعلي لا على نتيجة DNS مسبقة، فيشمل التحويلات
+    # وأسماء النطاقات التي يتغير عنوانها بين الفحص والاتصال
+    def connect(self):
+        super().connect()
+        address = ipaddress.ip_address(self.sock.getpeername()[0].split('%')[0])
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        if not address.is_global:
+            self.sock.close()
+            raise RowError(f'عنوان غير مسموح لجلب الصور: {address}')
+
+
+class _PublicHTTPConnection(_PublicOnly, http.client.HTTPConnection):
+    pass
+
+
+class _PublicHTTPSConnection(_PublicOnly, http.client.HTTPSConnection):
+    pass
+
+
+class _PublicHTTPHandler(urllib.request.HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(_PublicHTTPConnection, req)
+
+
+class _PublicHTTPSHandler(urllib.request.HTTPSHandler):
+    def https_open(self, req):
+        return self.do_open(_PublicHTTPSConnection, req, context=ssl.create_default_context())
+
+
+# بدون وكيل (proxy): عنوان الاتصال يجب أن يكون عنوان الموقع نفسه ليصح الفحص
+_opener = urllib.request.build_opener(urllib.request.ProxyHandler({}), _PublicHTTPHandler, _PublicHTTPSHandler)
+
+
+class ImageFetcher:
+    def __init__(self, upload_folder, source_dir=None, max_bytes=16 * 1024 * 1024, workers=None):
+        self.upload_folder = upload_folder
+        self.source_dir = source_dir
+        self.max_bytes = max_bytes
+        self.workers = workers or int(os.environ.get('IMPORT_IMAGE_WORKERS', 8))
+        self.timeout = int(os.environ.get('IMPORT_IMAGE_TIMEOUT', 15))
+
+    def is_existing_upload(self, value):
+        path = upload_path(self.upload_folder, value)
+        return path is not None and os.path.isfile(path)
+
+    def fetch_all(self, sources):
+        # {مصدر: (اسم الملف المحفوظ، رسالة الخطأ)} مع جلب كل مصدر مرة واحدة
+        unique = list(dict.fromkeys(sources))
+        if not unique:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(unique))) as pool:
+            return dict(zip(unique, pool.map(self._fetch, unique)))
+
+    def _open(self, source):
+        if source.startswith(('http://', 'https://')):
+            return _opener.open(source, timeout=self.timeout)
+        if self.source_dir is None:
+            raise RowError('روابط http(s) فقط مسموحة للصور')
+        path = os.path.realpath(os.path.join(self.source_dir, source))
+        if not path.startswith(os.path.realpath(self.source_dir) + os.sep):
+            raise RowError('مسار صورة خارج مجلد الصور')
+        return open(path, 'rb')
+
+    def _read(self, response):
+        # مهلة timeout لكل عملية على المقبس، لذا تُفحص المدة الكلية هنا أيضاً
+        length = getattr(response, 'length', None)
+        if length is not None and length > self.max_bytes:
+            raise RowError('الصورة أكبر من الحد المسموح')
+        deadline = time.monotonic() + self.timeout
+        chunks, size = [], 0
+        while chunk := response.read(64 * 1024):
+            size += len(chunk)
+            if size > self.max_bytes:
+                raise RowError('الصورة أكبر من الحد المسموح')
+            if time.monotonic() > deadline:
+                raise RowError('انتهت مهلة تحميل الصورة')
+            chunks.append(chunk)
+        return b''.join(chunks)
+
+    def _fetch(self, source):
+        filename = None
+        try:
+            with self._open(source) as response:
+                data = self._read(response)
+            from PIL import Image
+
+            with Image.open(io.BytesIO(data)) as image:
+                image.verify()
+                extension = PIL_EXTENSIONS.get(image.format)
+            if extension is None:
+                raise RowError('صيغة الصورة غير مدعومة')
+            filename = f'{uuid.uuid4().hex}.{extension}'
+            with open(os.path.join(self.upload_folder, filename), 'wb') as handle:
+                handle.write(data)
+            return filename, None
+        except Exception as e:
+            if filename and os.path.exists(os.path.join(self.upload_folder, filename)):
+                os.remove(os.path.join(self.upload_folder, filename))
+            return None, f'تعذر جلب الصورة {source}: {e}'
+
+
+def write_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    yield buffer.getvalue()
+    for chunk in rows:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(chunk)
+        yield buffer.getvalue()
+
+
+def write_jsonl(rows):
+    for chunk in rows:
+        yield ''.join(json.dumps(row, ensure_ascii=False) + '\n' for row in chunk)
+
+
+WRITERS = {'csv': write_csv, 'jsonl': write_jsonl}
+MIME_TYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
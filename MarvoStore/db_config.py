@@ -0,0 +1,85 @@
+# إعدادات قاعدة البيانات: SQLite مضبوطة للإنتاج أو قاعدة خادم عبر DATABASE_URL
+#
+#   DATABASE_URL           sqlite:///... أو postgresql://... (الافتراضي ملف SQLite في instance)
+#   DB_POOL_SIZE           عدد الاتصالات الدائمة لكل عامل (الافتراضي 5)
+#   DB_MAX_OVERFLOW        اتصالات إضافية مؤقتة (الافتراضي 10)
+#   DB_POOL_TIMEOUT        ثواني انتظار اتصال متاح (الافتراضي 30)
+#   DB_POOL_RECYCLE        إعادة فتح الاتصال بعد عدد ثواني (الافتراضي 1800)
+#   SQLITE_BUSY_TIMEOUT    مللي ثانية انتظار قفل الكتابة (الافتراضي 5000)
+#   SQLITE_CACHE_SIZE      بالكيلوبايت (الافتراضي 65536 أي 64MB)
+#   SQLITE_MMAP_SIZE       بالبايت (الافتراضي 268435456 أي 256MB)
+#   SQLITE_SYNCHRONOUS     NORMAL أو FULL (الافتراضي NORMAL)
+import os
+
+from sqlalchemy import event
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def database_uri(instance_path):
+    uri = os.environ.get('DATABASE_URL')
+    if not uri:
+        return f"sqlite:///{os.path.join(instance_path, 'marvo_store.db')}"
+    # Heroku/Replit يعطيان postgres:// وSQLAlchemy يتطلب postgresql://
+    if uri.startswith('postgres://'):
+        uri = 'postgresql://' + uri[len('postgres://'):]
+    return uri
+
+
+def is_sqlite(uri):
+    return uri.startswith('sqlite')
+
+
+def engine_options(uri):
+    if is_sqlite(uri):
+        if uri in ('sqlite://', 'sqlite:///:memory:'):
+            return {}
+        # SQLite يسمح بكاتب واحد، فالاتصالات الزائدة تنتظر القفل فقط
+        return {
+            'pool_size': _env_int('DB_POOL_SIZE', 5),
+            'max_overflow': _env_int('DB_MAX_OVERFLOW', 10),
+            'pool_timeout': _env_int('DB_POOL_TIMEOUT', 30),
+            'connect_args': {
+                'timeout': _env_int('SQLITE_BUSY_TIMEOUT', 5000) / 1000,
+                'check_same_thread': False,
+            },
+        }
+    return {
+        'pool_size': _env_int('DB_POOL_SIZE', 5),
+        'max_overflow': _env_int('DB_MAX_OVERFLOW', 10),
+        'pool_timeout': _env_int('DB_POOL_TIMEOUT', 30),
+        'pool_recycle': _env_int('DB_POOL_RECYCLE', 1800),
+        'pool_pre_ping': True,
+    }
+
+
+def sqlite_pragmas():
+    return {
+        'journal_mode': 'WAL',
+        'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+        'busy_timeout': _env_int('SQLITE_BUSY_TIMEOUT', 5000),
+        'cache_size': -_env_int('SQLITE_CACHE_SIZE', 65536),
+        'mmap_size': _env_int('SQLITE_MMAP_SIZE', 268435456),
+        'temp_store': 'MEMORY',
+    }
+
+
+def install_sqlite_pragmas(engine, pragmas=None):
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = pragmas or sqlite_pragmas()
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+
+def init_db(app, db):
+    with app.app_context():
+        install_sqlite_pragmas(db.engine)
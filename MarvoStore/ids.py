@@ -0,0 +1,106 @@
+# مولد أرقام الطلبات: معرفات على نمط Snowflake بدون الرجوع لقاعدة البيانات
+#
+# المعرف 63 بت: 41 بت للوقت بالميلي ثانية منذ EPOCH_MS، ثم 10 بت لرقم العامل
+# ثم 12 بت تسلسل داخل نفس الميلي ثانية. يُكتب بترميز Crockford base32 بطول
+# ثابت، فالترتيب النصي لأرقام الطلبات هو نفس ترتيب إنشائها.
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+EPOCH_MS = 1704067200000  # 2024-01-01 UTC
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+MAX_WORKER_ID = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+# بدون I و L و O و U لتجنب الالتباس عند قراءة الرقم بالهاتف
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+ENCODED_LENGTH = 13  # ceil(63 / 5)
+
+
+def encode_base32(value, length=ENCODED_LENGTH):
+    chars = []
+    for _ in range(length):
+        value, remainder = divmod(value, 32)
+        chars.append(ALPHABET[remainder])
+    return ''.join(reversed(chars))
+
+
+def decode_base32(value):
+    result = 0
+    for char in value.upper():
+        result = result * 32 + ALPHABET.index(char)
+    return result
+
+
+class OrderNumberGenerator:
+    def __init__(self, prefix='MRV', worker_id=None, lock_dir=None):
+        self.prefix = prefix
+        self.lock_dir = lock_dir
+        self._configured_worker_id = worker_id
+        self._lock = threading.Lock()
+        self._pid = None
+        self._worker_id = None
+        self._lock_file = None
+        self._last_ms = -1
+        self._sequence = 0
+
+    @property
+    def worker_id(self):
+        # بعد fork (مثل gunicorn --preload) يحتاج كل عامل رقماً خاصاً به
+        if self._pid != os.getpid():
+            self._worker_id = self._acquire_worker_id()
+            self._pid = os.getpid()
+            self._last_ms = -1
+            self._sequence = 0
+        return self._worker_id
+
+    def _acquire_worker_id(self):
+        if self._configured_worker_id is not None:
+            worker_id = int(self._configured_worker_id)
+            if not 0 <= worker_id <= MAX_WORKER_ID:
+                raise ValueError(f'worker id must be between 0 and {MAX_WORKER_ID}')
+            return worker_id
+        if fcntl is None or not self.lock_dir:
+            return os.getpid() & MAX_WORKER_ID
+        # حجز رقم عامل بقفل ملف يُحرر تلقائياً عند انتهاء العملية
+        os.makedirs(self.lock_dir, exist_ok=True)
+        start = os.getpid() & MAX_WORKER_ID
+        for offset in range(MAX_WORKER_ID + 1):
+            candidate = (start + offset) & MAX_WORKER_ID
+            handle = open(os.path.join(self.lock_dir, f'{candidate}.lock'), 'w')
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                handle.close()
+                continue
+            if self._lock_file is not None:
+                self._lock_file.close()
+            self._lock_file = handle
+            return candidate
+        raise RuntimeError('no free order worker id')
+
+    def next_id(self):
+        with self._lock:
+            worker_id = self.worker_id
+            now = int(time.time() * 1000)
+            # في نفس الميلي ثانية أو إذا رجعت الساعة للخلف نكمل من آخر وقت
+            # مستخدم، وعند امتلاء التسلسل نتقدم ميلي ثانية منطقية واحدة
+            if now <= self._last_ms:
+                now = self._last_ms
+                self._sequence = (self._sequence + 1) & MAX_SEQUENCE
+                if self._sequence == 0:
+                    now += 1
+            else:
+                self._sequence = 0
+            self._last_ms = now
+            return ((now - EPOCH_MS) << (WORKER_BITS + SEQUENCE_BITS)) \
+                | (worker_id << SEQUENCE_BITS) | self._sequence
+
+    def next_order_number(self):
+        return f'{self.prefix}{encode_base32(self.next_id())}'
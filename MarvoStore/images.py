@@ -0,0 +1,150 @@
+# معالجة صور المنتجات: نسخ مصغرة بأحجام ثابتة بصيغة WebP (وAVIF اختيارياً)
+# بالإضافة للصيغة الأصلية، بدون بيانات EXIF أو GPS، في مجموعة عمال بالخلفية
+#
+#   IMAGE_WORKERS   عدد خيوط المعالجة لكل عامل gunicorn (الافتراضي 2)
+#   IMAGE_AVIF      1 لإنتاج نسخ AVIF أيضاً إن كانت Pillow تدعمها (أبطأ في الترميز)
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Pillow تُستورد داخل الدوال عند أول معالجة فقط، فلا يدفع كل عامل ثمنها عند الإقلاع
+
+# العرض الأقصى لكل نسخة بالبكسل
+VARIANT_WIDTHS = {
+    'thumb': 160,
+    'card': 400,
+    'detail': 1000,
+}
+
+# صيغة حفظ النسخ المطابقة للصيغة الأصلية (GIF يُحفظ كإطار واحد PNG)
+ORIGINAL_FORMATS = {
+    'jpg': ('JPEG', 'jpg'),
+    'jpeg': ('JPEG', 'jpg'),
+    'png': ('PNG', 'png'),
+    'gif': ('PNG', 'png'),
+    'webp': ('WEBP', 'webp'),
+}
+
+SAVE_OPTIONS = {
+    'JPEG': {'quality': 85, 'optimize': True, 'progressive': True},
+    'PNG': {'optimize': True},
+    'WEBP': {'quality': 80, 'method': 4},
+    'AVIF': {'quality': 60, 'speed': 6},
+}
+
+MIME_TYPES = {
+    'jpg': 'image/jpeg',
+    'png': 'image/png',
+    'webp': 'image/webp',
+    'avif': 'image/avif',
+}
+
+
+def modern_formats():
+    from PIL import features
+
+    formats = [('WEBP', 'webp')]
+    if os.environ.get('IMAGE_AVIF') == '1' and features.check('avif'):
+        formats.insert(0, ('AVIF', 'avif'))
+    return formats
+
+
+def _prepare(image, pil_format):
+    if pil_format == 'JPEG' and image.mode != 'RGB':
+        return image.convert('RGB')
+    if image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+        return image.convert('RGBA' if 'transparency' in image.info or image.mode == 'P' else 'RGB')
+    return image
+
+
+def _save(image, path, pil_format):
+    # الحفظ بدون exif أو icc_profile أو pnginfo يحذف البيانات الوصفية
+    _prepare(image, pil_format).save(path, pil_format, **SAVE_OPTIONS[pil_format])
+
+
+def process_image(upload_folder, filename):
+    from PIL import Image, ImageOps
+
+    stem, extension = filename.rsplit('.', 1)
+    pil_format, original_extension = ORIGINAL_FORMATS[extension.lower()]
+    formats = modern_formats()
+    if (pil_format, original_extension) not in formats:
+        formats.append((pil_format, original_extension))
+
+    source_path = os.path.join(upload_folder, filename)
+    with Image.open(source_path) as source:
+        source.seek(0)
+        # تطبيق اتجاه الكاميرا قبل حذف EXIF حتى لا تظهر الصورة مقلوبة
+        image = ImageOps.exif_transpose(source)
+        image.load()
+
+    variants = {}
+    for name, width in VARIANT_WIDTHS.items():
+        resized = image.copy()
+        resized.thumbnail((width, width * 4), Image.Resampling.LANCZOS)
+        variants[name] = {'width': resized.width, 'files': {}}
+        for variant_format, variant_extension in formats:
+            variant_name = f'{stem}-{name}.{variant_extension}'
+            _save(resized, os.path.join(upload_folder, variant_name), variant_format)
+            variants[name]['files'][variant_extension] = f'uploads/{variant_name}'
+
+    # الأصل المرفوع نفسه متاح للعامة، فنعيد حفظه بدون بيانات وصفية
+    if extension.lower() != 'gif':
+        options = dict(SAVE_OPTIONS[pil_format], quality=95) if pil_format == 'JPEG' else SAVE_OPTIONS[pil_format]
+        _prepare(image, pil_format).save(source_path, pil_format, **options)
+    return variants
+
+
+def upload_path(upload_folder, relative_path):
+    # المسار المطلق لقيمة مثل "uploads/<اسم>" المحفوظة في image_url، أو None إن لم تكن
+    # اسم ملف مباشراً داخل مجلد الرفع (قيمة مستوردة مثل uploads/../../app.py)
+    prefix, _, name = (relative_path or '').partition('/')
+    if prefix != 'uploads' or not name or name in ('.', '..') or '/' in name or '\\' in name:
+        return None
+    root = os.path.realpath(upload_folder)
+    path = os.path.realpath(os.path.join(root, name))
+    return path if os.path.dirname(path) == root else None
+
+
+def variant_paths(variants_json):
+    if not variants_json:
+        return []
+    variants = json.loads(variants_json)
+    return [path for variant in variants.values() for path in variant['files'].values()]
+
+
+def picture(variants_json, variant):
+    # صيغ <source> بترتيب الأفضلية، والصيغة الأصلية أخيراً كـ <img> للمتصفحات القديمة
+    variants = json.loads(variants_json)
+    extensions = list(variants[variant]['files'])
+    fallback = extensions[-1]
+
+    def entries(extension):
+        return [(variants[name]['files'][extension], variants[name]['width'])
+                for name in VARIANT_WIDTHS if name in variants]
+
+    return {
+        'sources': [(MIME_TYPES[ext], entries(ext)) for ext in extensions[:-1]],
+        'src': variants[variant]['files'][fallback],
+        'srcset': entries(fallback),
+    }
+
+
+class ImagePipeline:
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or int(os.environ.get('IMAGE_WORKERS', 2))
+        self._executor = None
+        self._pid = None
+
+    def submit(self, fn, *args):
+        # مجموعة الخيوط لا تنتقل عبر fork، فننشئها عند أول استخدام في كل عملية
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                thread_name_prefix='images')
+            self._pid = os.getpid()
+        return self._executor.submit(fn, *args)
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
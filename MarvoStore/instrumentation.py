@@ -0,0 +1,284 @@
+# قياس أداء كل طلب: الزمن الكلي مقسماً إلى قاعدة البيانات وعرض القوالب وبايثون،
+# وعدد الاستعلامات مع تنبيه للاستعلامات البطيئة والمكررة (N+1)، وعرضها بصيغة
+# Prometheus على /metrics، مع عينات cProfile اختيارية لكل رووت
+#
+#   SLOW_QUERY_MS          زمن الاستعلام البطيء بالمللي ثانية (الافتراضي 100)
+#   N_PLUS_ONE_THRESHOLD   تكرار نفس الاستعلام في طلب واحد يُعد N+1 (الافتراضي 5)
+#   METRICS_DIR            مجلد مشترك لتجميع مقاييس كل عمال gunicorn (اختياري)
+#   METRICS_TOKEN          يتطلب Authorization: Bearer <token> على /metrics (اختياري)
+#   PROFILE_SAMPLE_RATE    نسبة الطلبات التي تُحلل بـ cProfile، مثل 0.01 (الافتراضي 0)
+#   PROFILE_DIR            مجلد ملفات ‎.prof (الافتراضي instance/profiles)
+import cProfile
+import glob
+import hmac
+import logging
+import os
+import pickle
+import random
+import re
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from flask import g, has_request_context, request, template_rendered, before_render_template
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SNAPSHOT_INTERVAL = 5  # ثوانٍ بين كتابات ملف المقاييس المشترك
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+class Metrics:
+    # عدادات ومدرجات تراكمية فقط، فتجميع عدة عمليات يتم بالجمع
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = Counter()
+        self.histograms = {}
+        self.help = {}
+
+    def describe(self, name, kind, text):
+        self.help[name] = (kind, text)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] += value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            buckets, total, count = self.histograms.get(key, ([0] * len(DURATION_BUCKETS), 0.0, 0))
+            buckets = [n + (value <= bound) for n, bound in zip(buckets, DURATION_BUCKETS)]
+            self.histograms[key] = (buckets, total + value, count + 1)
+
+    def snapshot(self):
+        with self._lock:
+            return Counter(self.counters), dict(self.histograms)
+
+    @staticmethod
+    def merge(snapshots):
+        counters, histograms = Counter(), {}
+        for snapshot_counters, snapshot_histograms in snapshots:
+            counters.update(snapshot_counters)
+            for key, (buckets, total, count) in snapshot_histograms.items():
+                merged = histograms.get(key, ([0] * len(DURATION_BUCKETS), 0.0, 0))
+                histograms[key] = ([a + b for a, b in zip(merged[0], buckets)],
+                                   merged[1] + total, merged[2] + count)
+        return counters, histograms
+
+    def render(self, counters, histograms):
+        lines = []
+        by_name = {}
+        for (name, labels), value in counters.items():
+            by_name.setdefault(name, []).append((labels, [f'{name}{_labels(labels)} {value}']))
+        for (name, labels), (buckets, total, count) in histograms.items():
+            series = [f'{name}_bucket{_labels(labels + (("le", bound),))} {cumulative}'
+                      for bound, cumulative in zip(DURATION_BUCKETS, buckets)]
+            series.append(f'{name}_bucket{_labels(labels + (("le", "+Inf"),))} {count}')
+            series.append(f'{name}_sum{_labels(labels)} {total}')
+            series.append(f'{name}_count{_labels(labels)} {count}')
+            by_name.setdefault(name, []).append((labels, series))
+        for name in sorted(by_name):
+            kind, text = self.help.get(name, ('untyped', ''))
+            lines.append(f'# HELP {name} {text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for _, series in sorted(by_name[name], key=lambda item: [(k, str(v)) for k, v in item[0]]):
+                lines.extend(series)
+        return lines
+
+
+class Instrumentation:
+    def __init__(self, app=None, db=None):
+        self.metrics = Metrics()
+        self.collectors = []
+        for name, kind, text in (
+            ('marvo_requests_total', 'counter', 'Requests by endpoint, method and status'),
+            ('marvo_request_duration_seconds', 'histogram', 'Request wall time'),
+            ('marvo_request_db_seconds_total', 'counter', 'Time spent in SQL per endpoint'),
+            ('marvo_request_render_seconds_total', 'counter', 'Time spent rendering templates per endpoint'),
+            ('marvo_request_python_seconds_total', 'counter', 'Remaining request time per endpoint'),
+            ('marvo_request_queries_total', 'counter', 'SQL statements executed per endpoint'),
+            ('marvo_slow_queries_total', 'counter', 'Statements slower than SLOW_QUERY_MS'),
+            ('marvo_n_plus_one_total', 'counter', 'Requests repeating one statement N_PLUS_ONE_THRESHOLD times'),
+        ):
+            self.metrics.describe(name, kind, text)
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        self.app = app
+        self.slow_query = int(os.environ.get('SLOW_QUERY_MS', 100)) / 1000
+        self.n_plus_one = int(os.environ.get('N_PLUS_ONE_THRESHOLD', 5))
+        self.metrics_dir = os.environ.get('METRICS_DIR')
+        self.token = os.environ.get('METRICS_TOKEN')
+        self.profile_rate = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+        self.profile_dir = os.environ.get('PROFILE_DIR', os.path.join(app.instance_path, 'profiles'))
+        self._profiling = threading.Lock()
+        self._last_snapshot = 0
+        if self.metrics_dir:
+            os.makedirs(self.metrics_dir, exist_ok=True)
+        if self.profile_rate:
+            os.makedirs(self.profile_dir, exist_ok=True)
+
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        before_render_template.connect(self._render_started, app)
+        template_rendered.connect(self._render_finished, app)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', self._query_started)
+            event.listen(db.engine, 'after_cursor_execute', self._query_finished)
+
+    def add_collector(self, collector):
+        # دالة تعيد أسطر Prometheus إضافية عند كل قراءة لـ /metrics
+        self.collectors.append(collector)
+        return collector
+
+    # --- قياس الطلب ---
+
+    def _start(self):
+        g.instrumentation = {
+            'started': time.perf_counter(),
+            'db': 0.0,
+            'render': 0.0,
+            'render_stack': [],
+            'queries': 0,
+            'statements': Counter(),
+            'slow': 0,
+        }
+        if self.profile_rate and random.random() < self.profile_rate and self._profiling.acquire(blocking=False):
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    def _finish(self, response):
+        stats = g.pop('instrumentation', None)
+        if stats is None:
+            return response
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            self._dump_profile(profiler)
+            self._profiling.release()
+
+        endpoint = request.endpoint or 'unknown'
+        total = time.perf_counter() - stats['started']
+        python = max(total - stats['db'] - stats['render'], 0.0)
+        metrics = self.metrics
+        metrics.inc('marvo_requests_total', endpoint=endpoint, method=request.method,
+                    status=response.status_code)
+        metrics.observe('marvo_request_duration_seconds', total, endpoint=endpoint)
+        metrics.inc('marvo_request_db_seconds_total', stats['db'], endpoint=endpoint)
+        metrics.inc('marvo_request_render_seconds_total', stats['render'], endpoint=endpoint)
+        metrics.inc('marvo_request_python_seconds_total', python, endpoint=endpoint)
+        metrics.inc('marvo_request_queries_total', stats['queries'], endpoint=endpoint)
+        if stats['slow']:
+            metrics.inc('marvo_slow_queries_total', stats['slow'], endpoint=endpoint)
+
+        repeated = [(statement, count) for statement, count in stats['statements'].items()
+                    if count >= self.n_plus_one]
+        if repeated:
+            metrics.inc('marvo_n_plus_one_total', endpoint=endpoint)
+            for statement, count in repeated:
+                logger.warning('N+1 in %s: %d× %s', endpoint, count, statement[:300])
+
+        response.headers['Server-Timing'] = (
+            f'db;dur={stats["db"] * 1000:.1f};desc="{stats["queries"]} queries", '
+            f'render;dur={stats["render"] * 1000:.1f}, '
+            f'app;dur={python * 1000:.1f}')
+        self._maybe_snapshot()
+        return response
+
+    def _render_started(self, sender, template, context, **extra):
+        stats = g.get('instrumentation')
+        if stats is not None:
+            stats['render_stack'].append((time.perf_counter(), stats['db']))
+
+    def _render_finished(self, sender, template, context, **extra):
+        stats = g.get('instrumentation')
+        if stats is not None and stats['render_stack']:
+            started, db_before = stats['render_stack'].pop()
+            # الاستعلامات الكسولة أثناء العرض تُحسب لقاعدة البيانات فقط
+            elapsed = time.perf_counter() - started - (stats['db'] - db_before)
+            if not stats['render_stack']:
+                stats['render'] += max(elapsed, 0.0)
+
+    def _query_started(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def _query_finished(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_started'].pop()
+        stats = g.get('instrumentation') if has_request_context() else None
+        if elapsed >= self.slow_query:
+            logger.warning('slow query %.0fms in %s: %s', elapsed * 1000,
+                           request.endpoint if has_request_context() else 'background', statement[:500])
+        if stats is None:
+            return
+        stats['db'] += elapsed
+        stats['queries'] += 1
+        if elapsed >= self.slow_query:
+            stats['slow'] += 1
+        if not executemany:
+            stats['statements'][_LITERALS.sub('?', statement)] += 1
+
+    def _dump_profile(self, profiler):
+        endpoint = (request.endpoint or 'unknown').replace('.', '_')
+        path = os.path.join(self.profile_dir, f'{endpoint}-{int(time.time() * 1000)}-{os.getpid()}.prof')
+        try:
+            profiler.dump_stats(path)
+        except OSError:
+            logger.exception('could not write profile %s', path)
+
+    # --- التجميع بين العمال وعرض /metrics ---
+
+    def _snapshot_path(self, pid=None):
+        return os.path.join(self.metrics_dir, f'{pid or os.getpid()}.metrics')
+
+    def _maybe_snapshot(self, force=False):
+        if not self.metrics_dir:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_snapshot < SNAPSHOT_INTERVAL:
+            return
+        self._last_snapshot = now
+        fd, tmp_path = tempfile.mkstemp(dir=self.metrics_dir)
+        with os.fdopen(fd, 'wb') as handle:
+            pickle.dump(self.metrics.snapshot(), handle)
+        os.replace(tmp_path, self._snapshot_path())
+
+    def collect(self):
+        if not self.metrics_dir:
+            return self.metrics.snapshot()
+        self._maybe_snapshot(force=True)
+        snapshots = []
+        for path in glob.glob(os.path.join(self.metrics_dir, '*.metrics')):
+            try:
+                with open(path, 'rb') as handle:
+                    snapshots.append(pickle.load(handle))
+            except (OSError, EOFError, pickle.UnpicklingError):
+                continue
+        return Metrics.merge(snapshots)
+
+    def metrics_view(self):
+        if self.token:
+            supplied = request.headers.get('Authorization', '').removeprefix('Bearer ')
+            if not hmac.compare_digest(supplied, self.token):
+                return self.app.response_class('unauthorized\n', status=401, mimetype='text/plain')
+        lines = self.metrics.render(*self.collect())
+        for collector in self.collectors:
+            lines.extend(collector())
+        return self.app.response_class('\n'.join(lines) + '\n',
+                                       mimetype='text/plain; version=0.0.4; charset=utf-8')
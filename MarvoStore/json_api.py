@@ -0,0 +1,89 @@
+# ردود JSON للواجهة البرمجية العامة: تحويل سريع بـ orjson إن كان مثبتاً، وضغط gzip
+# (وbrotli إن كانت مثبتة) حسب Accept-Encoding، والطلبات الشرطية بـ If-None-Match على
+# إصدار الذاكرة المؤقتة تُجاب بـ 304 قبل أي استعلام (فقط إن كانت الإصدارات مشتركة بين
+# العمال، وإلا تُرسل الردود بدون ETag/Last-Modified).
+#
+#   API_COMPRESS_MIN_BYTES   أصغر رد يُضغط (الافتراضي 1024)
+#   API_GZIP_LEVEL           مستوى ضغط gzip (الافتراضي 6)
+import gzip
+import json
+import os
+from datetime import date, datetime, timezone
+
+from flask import current_app, request
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.environ.get('API_COMPRESS_MIN_BYTES', 1024))
+GZIP_LEVEL = int(os.environ.get('API_GZIP_LEVEL', 6))
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def dump_json(value):
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=_default).encode()
+
+
+def accepted_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress_json(body, encoding):
+    # (المحتوى، الترميز الفعلي)؛ الردود الصغيرة تُرسل كما هي
+    if encoding is None or len(body) < COMPRESS_MIN_BYTES:
+        return body, None
+    if encoding == 'br':
+        return brotli.compress(body, quality=5), 'br'
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0), 'gzip'
+
+
+def _validators(response, version, modified):
+    # ETag ضعيف لأن نفس الإصدار يُرسل بأكثر من ترميز
+    response.set_etag(version, weak=True)
+    response.last_modified = datetime.fromtimestamp(int(modified), timezone.utc)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def not_modified(version, modified):
+    # رد 304 إن كانت نسخة العميل هي الإصدار الحالي، وإلا None. بالـ ETag وحده: Last-Modified
+    # بالثواني، فإصداران في نفس الثانية لهما نفس القيمة وIf-Modified-Since لا يميز بينهما
+    if not request.if_none_match.contains_weak(version):
+        return None
+    return _validators(current_app.response_class(status=304), version, modified)
+
+
+def json_response(encoded, version=None, modified=None):
+    body, encoding = encoded
+    response = current_app.response_class(body, mimetype='application/json')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if version is None:
+        response.vary.add('Accept-Encoding')
+        return response
+    return _validators(response, version, modified)
+
+
+def json_error(message, status=400):
+    return current_app.response_class(dump_json({'error': message}), status=status, mimetype='application/json')
@@ -0,0 +1,120 @@
+# محرك البحث عن المنتجات: فهرس SQLite FTS5 مع توحيد الحروف العربية
+import re
+
+from sqlalchemy import text
+
+FTS_TABLE = 'product_fts'
+SEARCH_PAGE_SIZE = 24
+
+# التشكيل والتطويل
+_DIACRITICS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')
+_FOLDING = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ى': 'ي', 'ئ': 'ي',
+    'ؤ': 'و',
+    'ة': 'ه',
+    '٠': '0', '١': '1', '٢': '2', '٣': '3', '٤': '4',
+    '٥': '5', '٦': '6', '٧': '7', '٨': '8', '٩': '9',
+})
+_TOKEN = re.compile(r'\w+')
+
+
+def normalize_arabic(value):
+    if not value:
+        return ''
+    value = _DIACRITICS.sub('', value)
+    return value.translate(_FOLDING).lower()
+
+
+def build_match_query(value):
+    # كل كلمة تصبح بحثاً بالبادئة، والكلمات مربوطة بـ AND ضمنياً
+    tokens = _TOKEN.findall(normalize_arabic(value))
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def is_supported(bind):
+    return bind.dialect.name == 'sqlite'
+
+
+def create_search_index(conn):
+    if not is_supported(conn):
+        return
+    conn.execute(text(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+        "USING fts5(name, description, tokenize='unicode61 remove_diacritics 2')"
+    ))
+    # ملء الفهرس مرة واحدة لقواعد البيانات التي سبقت إنشاءه
+    indexed = conn.execute(text(f"SELECT count(*) FROM {FTS_TABLE}")).scalar()
+    if indexed:
+        return
+    rows = conn.execute(text("SELECT id, name, description FROM product")).all()
+    if rows:
+        conn.execute(
+            text(f"INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (:id, :name, :description)"),
+            [{'id': row.id, 'name': normalize_arabic(row.name),
+              'description': normalize_arabic(row.description)} for row in rows],
+        )
+
+
+def index_product(session, product):
+    index_products(session, [product])
+
+
+def index_products(session, products):
+    # أي كائنات أو قواميس فيها id وname وdescription، بتعليمتين لكل دفعة
+    if not products or not is_supported(session.get_bind()):
+        return
+    rows = [product if isinstance(product, dict) else
+            {'id': product.id, 'name': product.name, 'description': product.description}
+            for product in products]
+    session.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"), [{'id': row['id']} for row in rows])
+    session.execute(
+        text(f"INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (:id, :name, :description)"),
+        [{'id': row['id'], 'name': normalize_arabic(row['name']),
+          'description': normalize_arabic(row['description'])} for row in rows],
+    )
+
+
+def unindex_product(session, product_id):
+    if not is_supported(session.get_bind()):
+        return
+    session.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"), {'id': product_id})
+
+
+def search_products(session, query=None, category=None, min_price=None, max_price=None,
+                    page=1, per_page=SEARCH_PAGE_SIZE):
+    filters = []
+    params = {'limit': per_page + 1, 'offset': (page - 1) * per_page}
+    if category:
+        filters.append('p.category = :category')
+        params['category'] = category
+    if min_price is not None:
+        filters.append('p.price >= :min_price')
+        params['min_price'] = float(min_price)
+    if max_price is not None:
+        filters.append('p.price <= :max_price')
+        params['max_price'] = float(max_price)
+
+    columns = ('p.id, p.name, substr(p.description, 1, 100) AS description, p.price, '
+               'p.image_url, p.image_variants, p.rating_average, p.rating_count')
+    match = build_match_query(query)
+    if match and is_supported(session.get_bind()):
+        # الاسم أهم من الوصف في الترتيب
+        filters.insert(0, f'{FTS_TABLE} MATCH :match')
+        params['match'] = match
+        sql = (f"SELECT {columns} FROM {FTS_TABLE} JOIN product p ON p.id = {FTS_TABLE}.rowid "
+               f"WHERE {' AND '.join(filters)} "
+               f"ORDER BY bm25({FTS_TABLE}, 10.0, 1.0) LIMIT :limit OFFSET :offset")
+    elif query and query.strip():
+        filters.insert(0, '(p.name LIKE :like OR p.description LIKE :like)')
+        params['like'] = f'%{query.strip()}%'
+        sql = (f"SELECT {columns} FROM product p WHERE {' AND '.join(filters)} "
+               "ORDER BY p.created_at DESC, p.id DESC LIMIT :limit OFFSET :offset")
+    else:
+        where = f"WHERE {' AND '.join(filters)} " if filters else ''
+        sql = (f"SELECT {columns} FROM product p {where}"
+               "ORDER BY p.created_at DESC, p.id DESC LIMIT :limit OFFSET :offset")
+
+    rows = session.execute(text(sql), params).all()
+    has_next = len(rows) > per_page
+    return rows[:per_page], has_next
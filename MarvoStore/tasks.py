@@ -0,0 +1,243 @@
+# طابور مهام في قاعدة البيانات للأعمال التي تأتي بعد إتمام الطلب (النقاط، الإشعارات...)
+#
+# المهمة تُكتب في نفس معاملة الطلب، فلا تضيع إن توقفت العملية بعد commit ولا تُنفذ
+# إن أُلغيت المعاملة. مجموعة خيوط داخل كل عامل تبدأ مع العامل (after_fork أو أول طلب)
+# وتلتقطها فور commit، وتستطلع الجدول دورياً للمهام المؤجلة (run_at وإعادة المحاولة)
+# ومهام العمليات الأخرى. ويمكن بدلاً من ذلك تشغيل عامل مستقل بالأمر `flask run-tasks`. أثر المهمة وتعليمها كمنتهية
+# يُحفظان في معاملة واحدة، ومفتاح المهمة (key) يمنع تكرار إضافتها.
+#
+#   TASK_WORKERS        عدد الخيوط لكل عامل ويب (الافتراضي 2، و0 للاعتماد على run-tasks)
+#   TASK_POLL_INTERVAL  ثواني انتظار مهام جديدة أو مؤجلة (الافتراضي 2)
+#   TASK_MAX_ATTEMPTS   عدد المحاولات قبل اعتبار المهمة فاشلة (الافتراضي 5)
+#   TASK_LEASE          ثواني حجز المهمة قبل أن يلتقطها عامل آخر (الافتراضي 300)
+import json
+import logging
+import os
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, or_
+
+logger = logging.getLogger(__name__)
+
+RETRY_DELAY = 5  # ثانية، تتضاعف مع كل محاولة
+LATENCY_SAMPLES = 1000
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+class TaskQueue:
+    def __init__(self, app, db, model, workers=None):
+        self.app = app
+        self.db = db
+        self.model = model
+        self.workers = int(os.environ.get('TASK_WORKERS', 2)) if workers is None else workers
+        self.poll_interval = float(os.environ.get('TASK_POLL_INTERVAL', 2))
+        self.max_attempts = int(os.environ.get('TASK_MAX_ATTEMPTS', 5))
+        self.lease = int(os.environ.get('TASK_LEASE', 300))
+        self.handlers = {}
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self._counters = {'completed': 0, 'retried': 0, 'failed': 0}
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._durations = deque(maxlen=LATENCY_SAMPLES)
+        event.listen(db.session, 'after_commit', self._after_commit)
+        app.before_request(self.start)
+
+    def task(self, name):
+        def register(fn):
+            self.handlers[name] = fn
+            return fn
+        return register
+
+    def enqueue(self, name, key=None, delay=0, **payload):
+        # بدون commit: المهمة جزء من معاملة المستدعي
+        now = datetime.utcnow()
+        values = {
+            'name': name,
+            'key': key,
+            'payload': json.dumps(payload),
+            'status': 'pending',
+            'attempts': 0,
+            'run_at': now + timedelta(seconds=delay),
+            'created_at': now,
+        }
+        table = self.model.__table__
+        dialect = self.db.session.get_bind().dialect.name
+        if key and dialect in ('sqlite', 'postgresql'):
+            if dialect == 'sqlite':
+                from sqlalchemy.dialects.sqlite import insert
+            else:
+                from sqlalchemy.dialects.postgresql import insert
+            statement = insert(table).values(**values).on_conflict_do_nothing(index_elements=['key'])
+        else:
+            statement = table.insert().values(**values)
+        self.db.session.execute(statement)
+        self.db.session.info['tasks_enqueued'] = True
+
+    def _after_commit(self, session):
+        if session.info.pop('tasks_enqueued', False):
+            self.wake()
+
+    def start(self):
+        # لا تنتظر الخيوط أول مهمة تضيفها هذه العملية، وإلا بقيت المهام المؤجلة دون تنفيذ
+        if self.workers:
+            self._ensure_workers()
+
+    def wake(self):
+        if self.workers:
+            self._ensure_workers()
+            self._wake.set()
+
+    # الخيوط لا تنتقل عبر fork، فتُنشأ عند أول استخدام في كل عملية
+    def _ensure_workers(self):
+        if self._pid == os.getpid() and self._threads:
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._threads:
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._threads = [threading.Thread(target=self._loop, name=f'tasks-{i}', daemon=True)
+                             for i in range(self.workers)]
+            for thread in self._threads:
+                thread.start()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            if not self.run_pending():
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    def run_pending(self, limit=10):
+        # عدد المهام المنفذة؛ صفر يعني أن الطابور فارغ حالياً
+        done = 0
+        with self.app.app_context():
+            while done < limit:
+                task = self._claim()
+                if task is None:
+                    break
+                self._run(task)
+                done += 1
+            self.db.session.remove()
+        return done
+
+    def _claim(self):
+        Task = self.model
+        now = datetime.utcnow()
+        ready = or_(
+            (Task.status == 'pending') & (Task.run_at <= now),
+            # عامل توقف أثناء التنفيذ
+            (Task.status == 'running') & (Task.locked_until < now),
+        )
+        try:
+            candidates = (self.db.session.query(Task.id, Task.attempts)
+                          .filter(ready).order_by(Task.run_at, Task.id).limit(5).all())
+            for task_id, attempts in candidates:
+                # الحجز المشروط يمنع عاملين من التقاط نفس المهمة
+                claimed = (Task.query.filter(Task.id == task_id, Task.attempts == attempts, ready)
+                           .update({'status': 'running', 'attempts': attempts + 1,
+                                    'locked_until': now + timedelta(seconds=self.lease)},
+                                   synchronize_session=False))
+                self.db.session.commit()
+                if claimed:
+                    return self.db.session.get(Task, task_id)
+        except Exception:
+            self.db.session.rollback()
+            logger.exception('task claim failed')
+        return None
+
+    def _run(self, task):
+        started = time.monotonic()
+        task_id = task.id
+        handler = self.handlers.get(task.name)
+        try:
+            if handler is None:
+                raise LookupError(f'no handler for task {task.name!r}')
+            handler(**json.loads(task.payload or '{}'))
+            # أثر المهمة وتعليمها كمنتهية في نفس المعاملة
+            finished = datetime.utcnow()
+            latency = (finished - task.created_at).total_seconds()
+            task.status = 'done'
+            task.finished_at = finished
+            task.last_error = None
+            self.db.session.commit()
+        except Exception:
+            self.db.session.rollback()
+            self._retry(task_id, traceback.format_exc())
+            return
+        with self._lock:
+            self._counters['completed'] += 1
+            self._durations.append(time.monotonic() - started)
+            self._latencies.append(latency)
+
+    def _retry(self, task_id, error):
+        task = self.db.session.get(self.model, task_id)
+        if task is None:
+            return
+        if task.attempts >= self.max_attempts:
+            task.status = 'failed'
+            task.finished_at = datetime.utcnow()
+            outcome = 'failed'
+            logger.error('task %s #%s failed after %s attempts:\n%s',
+                         task.name, task.id, task.attempts, error)
+        else:
+            task.status = 'pending'
+            task.run_at = datetime.utcnow() + timedelta(seconds=RETRY_DELAY * 2 ** (task.attempts - 1))
+            outcome = 'retried'
+        task.locked_until = None
+        task.last_error = error[-4000:]
+        try:
+            self.db.session.commit()
+        except Exception:
+            # تبقى المهمة محجوزة وتُعاد بعد انتهاء الحجز
+            self.db.session.rollback()
+            logger.exception('could not record task %s failure', task_id)
+            return
+        with self._lock:
+            self._counters[outcome] += 1
+
+    def stats(self):
+        Task = self.model
+        depth = dict(self.db.session.query(Task.status, self.db.func.count(Task.id))
+                     .filter(Task.status.in_(('pending', 'running', 'failed')))
+                     .group_by(Task.status).all())
+        with self._lock:
+            latencies = list(self._latencies)
+            durations = list(self._durations)
+            counters = dict(self._counters)
+        return {
+            'pending': depth.get('pending', 0),
+            'running': depth.get('running', 0),
+            'failed': depth.get('failed', 0),
+            **counters,
+            'latency_p50': _percentile(latencies, 50),
+            'latency_p95': _percentile(latencies, 95),
+            'duration_p50': _percentile(durations, 50),
+            'duration_p95': _percentile(durations, 95),
+        }
+
+    def purge(self, older_than_days=7):
+        cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+        removed = (self.model.query
+                   .filter(self.model.status == 'done', self.model.finished_at < cutoff)
+                   .delete(synchronize_session=False))
+        self.db.session.commit()
+        return removed
+
+    def run_forever(self):
+        self.workers = 0  # هذه العملية تنفذ في الخيط الرئيسي
+        while True:
+            if not self.run_pending():
+                time.sleep(self.poll_interval)
@@ -0,0 +1,48 @@
+# ذاكرة مؤقتة لمستخدم الجلسة: current_user يُبنى من نسخة مختصرة محفوظة داخل العملية
+# بدلاً من استعلام عن صف User كاملاً في كل طلب. التغييرات على المستخدم (النقاط،
+# البيانات الشخصية) تُبطل نسخته بعد commit، والعمال الآخرون يرونها بعد انتهاء المدة.
+#
+#   USER_CACHE_TTL    ثواني صلاحية النسخة (الافتراضي 30، و0 للتعطيل)
+#   USER_CACHE_SIZE   أقصى عدد مستخدمين داخل العملية (الافتراضي 10000)
+import os
+
+from sqlalchemy import event
+
+from cache import LRUCache
+
+
+class UserCache:
+    def __init__(self, db, load, ttl=None, maxsize=None):
+        self.db = db
+        self.load = load
+        self.ttl = int(os.environ.get('USER_CACHE_TTL', 30)) if ttl is None else ttl
+        self._users = LRUCache(maxsize=maxsize or int(os.environ.get('USER_CACHE_SIZE', 10000)),
+                               ttl=self.ttl or 1)
+        event.listen(db.session, 'after_commit', self._after_commit)
+        event.listen(db.session, 'after_rollback', self._after_rollback)
+
+    def get(self, user_id):
+        if not self.ttl:
+            return self.load(user_id)
+        user = self._users.get(user_id)
+        if user is None:
+            user = self.load(user_id)
+            if user is not None:
+                self._users.set(user_id, user)
+        return user
+
+    def invalidate(self, *user_ids):
+        # الحذف الآن وبعد commit، حتى لا يحفظ طلب آخر القيمة القديمة أثناء المعاملة
+        for user_id in user_ids:
+            self._users.delete(user_id)
+        self.db.session.info.setdefault('stale_users', set()).update(user_ids)
+
+    def clear(self):
+        self._users.clear()
+
+    def _after_commit(self, session):
+        for user_id in session.info.pop('stale_users', ()):
+            self._users.delete(user_id)
+
+    def _after_rollback(self, session):
+        session.info.pop('stale_users', None)